@@ -1,133 +1,150 @@
-import csv
-from collections import defaultdict
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import interval_cells, interval_columns, ratio, run_with_intervals
+from engine import Analysis, first_appearances, run_analyses
+from event_store import load_event_store
+from scoring import ScoreFeatures, weighted_sum
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Entry Defense Analysis/filtered_entry_defense_dataset.csv'
 output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Entry Defense Analysis/top_players_entry_defense_analysis.csv'
 
+# Define date range
+start_date = '2018-02-11'
+end_date = '2018-02-21'
+
 # Define weights for each event type
 weights = {
     'Denial': 3,
     'Denial Rate': 150
 }
 
-# Step 1: Filter the data based on the date range
-def filter_data_by_date(file_path, filtered_path, start_date, end_date):
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            game_date = row['game_date']
-            if start_date <= game_date <= end_date:
-                writer.writerow(row)
-
-# Step 2: Calculate player entry defense scores with weights
-def calculate_entry_defense_analysis(file_path):
-    player_stats = {}
-    player_games = defaultdict(set)  # Track unique games for each player
-
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        headers = reader.fieldnames
-
-        for row in reader:
-            game_date = row['game_date']
-            event = row['Event']
-            detail = row['Detail 1']
-            player = row['Player']
-            opponent = row['Player 2']
-            home_team = row['Home Team']
-            away_team = row['Away Team']
-            
-            # Get coordinates
-            try:
-                x_coord = float(row['X Coordinate'])
-            except ValueError:
-                x_coord = None
-
-            # Initialize players if not already in dictionary
-            if player not in player_stats:
-                player_stats[player] = {'total_score': 0, 'denials': 0, 'total_entries': 0, 'games_played': 0}
-            if opponent not in player_stats:
-                player_stats[opponent] = {'total_score': 0, 'denials': 0, 'total_entries': 0, 'games_played': 0}
-
-            # Create unique game identifier
-            game_id = f"{game_date}_{home_team}_{away_team}"
-
-            # Count Zone Entries
-            if event == 'Zone Entry' and detail in ['Carried', 'Dumped', 'Played']:
-                if player:
-                    player_stats[player]['total_entries'] += 1
-                    player_games[player].add(game_id)
-
-            # Case 1: Player attempts "Dump In/Out" and loses possession
-            if event == 'Dump In/Out' and detail == 'Lost':
-                if player and opponent:
-                    player_stats[opponent]['denials'] += 1
-                    player_stats[opponent]['total_score'] += weights['Denial']
-                    player_games[player].add(game_id)
-                    player_games[opponent].add(game_id)
-
-            # Case 2: "Incomplete Play" event with coordinate check
-            elif event == 'Incomplete Play' and x_coord is not None:
-                if 29 <= x_coord <= 207:
-                    if player and opponent:
-                        player_stats[opponent]['denials'] += 1
-                        player_stats[opponent]['total_score'] += weights['Denial']
-                        player_games[player].add(game_id)
-                        player_games[opponent].add(game_id)
-
-            # Case 3: "Takeaway" event with coordinate check
-            elif event == 'Takeaway' and x_coord is not None:
-                if 29 <= x_coord <= 207:
-                    if player:
-                        player_stats[player]['denials'] += 1
-                        player_stats[player]['total_score'] += weights['Denial']
-                        player_games[player].add(game_id)
-
-    # Update games played for each player based on unique game_ids
-    for player in player_stats:
-        player_stats[player]['games_played'] = len(player_games[player])
-
-    # Calculate denial rates and adjust scores
-    for player in player_stats:
-        if player_stats[player]['total_entries'] > 0:
-            denial_rate = player_stats[player]['denials'] / player_stats[player]['total_entries']
-            denial_rate_weight = weights['Denial Rate'] * denial_rate
-        else:
-            denial_rate = 0
-            denial_rate_weight = 0
-
-        player_stats[player]['total_score'] += denial_rate_weight
-        player_stats[player]['denial_rate'] = denial_rate
-
-    return player_stats
-
-# Step 3: Save the top players to a CSV file
-def save_top_players_to_csv(player_stats, output_file_path, top_n=50):
+# Count behind each event weight, and the stat behind each rate weight
+SCORED_COUNTS = {'Denial': 'denials'}
+SCORED_RATES = {'Denial Rate': 'denial_rate'}
+
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {'Total Score': 2, 'Denial Rate': 2}
+
+# Step 1: Calculate player entry defense scores with weights
+class EntryDefenseAnalysis(Analysis):
+    """Player entry defense scores, accumulated one game at a time from the shared event stream."""
+
+    code_column = 'Player'
+    accumulators = ('denials', 'total_entries', 'games_played')
+
+    def bind(self, store):
+        super().bind(store)
+        n_players = len(store.names('Player'))
+        self.seen = np.zeros(n_players, dtype=bool)
+        self.order = []
+        self.denials = np.zeros(n_players, dtype=np.int64)
+        self.total_entries = np.zeros(n_players, dtype=np.int64)
+        self.games_played = np.zeros(n_players, dtype=np.int64)
+
+    def consume(self, batch):
+        player = batch['Player']
+        opponent = batch['Player 2']
+
+        # Initialize players in the order they appear, blank names included
+        self.order.extend(first_appearances(np.column_stack((player, opponent)).ravel(), self.seen).tolist())
+
+        # Count Zone Entries
+        entry_details = batch.has_detail('Detail 1', 'Carried') | batch.has_detail('Detail 1', 'Dumped') | batch.has_detail('Detail 1', 'Played')
+        entries = batch.is_event('Zone Entry') & entry_details & (player > 0)
+        np.add.at(self.total_entries, player[entries], 1)
+
+        # Case 1 and 2: a lost dump or a neutral zone incomplete play is a denial for Player 2
+        both = (player > 0) & (opponent > 0)
+        opponent_denials = both & (batch.lost_dump | (batch.is_event('Incomplete Play') & batch.neutral_zone))
+
+        # Case 3: a neutral zone takeaway is a denial for the player
+        player_denials = (player > 0) & batch.is_event('Takeaway') & batch.neutral_zone
+
+        denied_by = np.concatenate((opponent[opponent_denials], player[player_denials]))
+        np.add.at(self.denials, denied_by, 1)
+
+        # Games played counts each game a player had an entry or was part of a denial
+        involved = np.concatenate((player[entries | opponent_denials | player_denials], opponent[opponent_denials]))
+        self.games_played[np.unique(involved)] += 1
+
+    def finalize(self):
+        player_stats = {}
+        for player in self.order:
+            player_stats[player] = {
+                'total_score': 0,
+                'denials': self.denials[player].item(),
+                'total_entries': self.total_entries[player].item(),
+                'games_played': self.games_played[player].item(),
+            }
+
+        # Calculate denial rates
+        for player in player_stats:
+            if player_stats[player]['total_entries'] > 0:
+                denial_rate = player_stats[player]['denials'] / player_stats[player]['total_entries']
+            else:
+                denial_rate = 0
+
+            player_stats[player]['denial_rate'] = denial_rate
+
+        # Score every player at once from the raw counts and rates; kept for re-scoring
+        codes = np.array(self.order, dtype=np.int64)
+        self.features = ScoreFeatures(
+            [self.store.decode('Player', player) for player in player_stats],
+            {name: getattr(self, stat)[codes] for name, stat in SCORED_COUNTS.items()},
+            {name: [stats[rate] for stats in player_stats.values()] for name, rate in SCORED_RATES.items()},
+            self.total_entries[codes] > 0,
+        )
+        for stats, score in zip(player_stats.values(), self.features.scores(weights)):
+            stats['total_score'] = score
+
+        # Key the results by player name
+        return {self.store.decode('Player', player): stats for player, stats in player_stats.items()}
+
+    def window_metrics(self):
+        """The INTERVAL_DECIMALS columns for many sets of games at once (see Analysis)."""
+        denial_rate = ratio(self.denials, self.total_entries)
+        return {
+            'Total Score': weighted_sum({'Denial': self.denials, 'Denial Rate': np.nan_to_num(denial_rate)}, weights),
+            'Denial Rate': denial_rate,
+        }
+
+def calculate_entry_defense_analysis(store):
+    return run_analyses(store, [EntryDefenseAnalysis()])[0]
+
+def create_analysis():
+    """Entry defense analysis for this report's date range, for the combined runner."""
+    return EntryDefenseAnalysis(start_date, end_date)
+
+# Step 2: Save the top players to a CSV file
+def save_top_players_to_csv(player_stats, output_file_path, top_n=50, intervals=None):
+    """Save the top_n players, with bootstrap CI columns when intervals are given."""
     sorted_players = sorted(player_stats.items(), key=lambda x: x[1]['total_score'], reverse=True)[:top_n]
 
     with open(output_file_path, 'w', newline='') as file:
-        headers = 'Player,Total Score,Denials,Denial Rate,Games Played\n'
-        file.write(headers)
+        headers = 'Player,Total Score,Denials,Denial Rate,Games Played'
+        if intervals is not None:
+            headers += ''.join(f",{column}" for column in interval_columns(INTERVAL_DECIMALS))
+        file.write(headers + '\n')
 
         for player, stats in sorted_players:
-            line = f"{player},{stats['total_score']},{stats['denials']},{stats['denial_rate']:.2f},{stats['games_played']}\n"
-            file.write(line)
+            line = f"{player},{stats['total_score']},{stats['denials']},{stats['denial_rate']:.2f},{stats['games_played']}"
+            if intervals is not None:
+                line += ''.join(f",{cell}" for cell in interval_cells(intervals, player, INTERVAL_DECIMALS))
+            file.write(line + '\n')
     print(f"Top {top_n} entry defense players saved to {output_file_path}")
 
 # Main function to run the analysis
 if __name__ == "__main__":
-    start_date = '2018-02-11'
-    end_date = '2018-02-21'
-    
-    # Step 1: Filter data by date range
-    filter_data_by_date(original_file_path, filtered_file_path, start_date, end_date)
+    # Step 1: Load the shared event store for the date range
+    store = load_event_store(original_file_path).between(start_date, end_date)
     
-    # Step 2: Calculate player entry defense analysis
-    best_players_analysis = calculate_entry_defense_analysis(filtered_file_path)
+    # Step 2: Calculate player entry defense analysis, with bootstrap intervals over the games
+    (best_players_analysis,), (intervals,) = run_with_intervals(store, [EntryDefenseAnalysis()])
     
     # Step 3: Save the top players to CSV
-    save_top_players_to_csv(best_players_analysis, output_file_path)
\ No newline at end of file
+    save_top_players_to_csv(best_players_analysis, output_file_path, intervals=intervals)
\ No newline at end of file
@@ -1,111 +1,252 @@
 import csv
-from collections import defaultdict
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import (code_positions, game_arrays, interval_cells, interval_columns, played_games, ratio,
+                       replicate_analysis, run_with_intervals)
+from engine import Analysis, first_appearances, merge_analyses, reduce_analyses, run_analyses
+from event_store import load_event_store
+from possessions import ENTRY_SHOT_WINDOW
+from rolling_form import window_totals
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Entry Defense Analysis/filtered_team_tradeoff_dataset.csv'
 output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Entry Defense Analysis/team_tradeoff_analysis.csv'
+trends_output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Entry Defense Analysis/team_tradeoff_trends.csv'
 
-# Step 1: Filter the data based on the date range
-def filter_data_by_date(file_path, filtered_path, start_date, end_date):
-    """Filter the CSV data by a specified date range."""
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            game_date = row['game_date']
-            if start_date <= game_date <= end_date:
-                writer.writerow(row)
+# Define the date range
+start_date = '2018-02-11'
+end_date = '2018-02-21'
+
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {'Denial Rate': 2, 'Offense Limiting Rate': 2, 'Tradeoff Score': 4}
+
+# Games in each rolling tradeoff window
+TREND_WINDOW = 3
+TREND_COUNTS = {
+    'Denials': 'denials',
+    'Total Entries': 'total_entries',
+    'Opponent Shots': 'opponent_shots',
+    'Opponent Possessions': 'opponent_possessions',
+    'Entries Against': 'entries_against',
+    'Entry Shots Against': 'entry_shots_against',
+}
+# window_metrics() columns in the trends, with the decimals they are rounded to
+TREND_DECIMALS = {**INTERVAL_DECIMALS, 'Shots Per Entry Against': 2}
+
+# Step 1: Calculate the tradeoff score for each team
+class TradeoffAnalysis(Analysis):
+    """Team denial and opponent offense counts, accumulated one game at a time."""
+
+    code_column = 'Team'
+    accumulators = ('denials', 'total_entries', 'opponent_shots', 'opponent_possessions',
+                    'entries_against', 'entry_shots_against')
+
+    def bind(self, store):
+        super().bind(store)
+        n_teams = len(store.names('Team'))
+        self.seen = np.zeros(n_teams, dtype=bool)
+        self.order = []
+        self.denials = np.zeros(n_teams, dtype=np.int64)
+        self.total_entries = np.zeros(n_teams, dtype=np.int64)
+        self.opponent_shots = np.zeros(n_teams, dtype=np.int64)
+        self.opponent_possessions = np.zeros(n_teams, dtype=np.int64)
+        self.entries_against = np.zeros(n_teams, dtype=np.int64)
+        self.entry_shots_against = np.zeros(n_teams, dtype=np.int64)
+
+    def consume(self, batch):
+        team = batch['Team']
+        opponent = batch.opponent
+
+        # Count Zone Entries
+        entry_details = batch.has_detail('Detail 1', 'Carried') | batch.has_detail('Detail 1', 'Dumped') | batch.has_detail('Detail 1', 'Played')
+        entries = batch.is_event('Zone Entry') & entry_details
+
+        # Track entry denial events (keeping original logic)
+        turnovers = batch.is_event('Incomplete Play') | batch.is_event('Takeaway')
+        denials = batch.lost_dump | (turnovers & batch.neutral_zone)
+
+        # Track opponent's offensive metrics
+        against = team != opponent
+        shots = against & batch.is_event('Shot')
+        possessions = against & (batch.is_event('Zone Entry') | batch.is_event('Puck Possession'))
+
+        # Shots and goals the opponent gets off its entries, later in the same possession
+        entry_shots = batch.possessions.count_within(entries, batch.shot_attempts, ENTRY_SHOT_WINDOW)
+
+        # Teams are reported in the order they are first credited with anything
+        appearances = np.column_stack((team, opponent)).ravel()
+        credited = np.column_stack((entries | denials, shots | possessions)).ravel()
+        self.order.extend(first_appearances(appearances[credited], self.seen).tolist())
+
+        np.add.at(self.total_entries, team[entries], 1)
+        np.add.at(self.denials, team[denials], 1)
+        np.add.at(self.opponent_shots, opponent[shots], 1)
+        np.add.at(self.opponent_possessions, opponent[possessions], 1)
+        np.add.at(self.entries_against, opponent[entries], 1)
+        np.add.at(self.entry_shots_against, opponent[entries], entry_shots[entries])
+
+    def finalize(self):
+        data = []
+
+        # Calculate metrics and tradeoff score for each team
+        for team in self.order:
+            stats = {
+                'denials': self.denials[team].item(),
+                'total_entries': self.total_entries[team].item(),
+                'opponent_shots': self.opponent_shots[team].item(),
+                'opponent_possessions': self.opponent_possessions[team].item(),
+                'entries_against': self.entries_against[team].item(),
+                'entry_shots_against': self.entry_shots_against[team].item(),
+            }
+            if stats['total_entries'] > 0 and stats['opponent_possessions'] > 0:
+                denial_rate = stats['denials'] / stats['total_entries']
+                offense_limiting_rate = 1 - (stats['opponent_shots'] / stats['opponent_possessions'])
+                tradeoff_score = (denial_rate - offense_limiting_rate) ** 2
+                if stats['entries_against'] > 0:
+                    shots_per_entry_against = stats['entry_shots_against'] / stats['entries_against']
+                else:
+                    shots_per_entry_against = 0
 
-# Step 2: Calculate the tradeoff score for each team
-def calculate_tradeoff_score(file_path):
+                data.append({
+                    'Team': self.store.decode('Team', team),
+                    'Denials': stats['denials'],
+                    'Total Entries': stats['total_entries'],
+                    'Denial Rate': round(denial_rate, 2),
+                    'Opponent Shots': stats['opponent_shots'],
+                    'Opponent Possessions': stats['opponent_possessions'],
+                    'Offense Limiting Rate': round(offense_limiting_rate, 2),
+                    'Tradeoff Score': round(tradeoff_score, 4),
+                    'Entries Against': stats['entries_against'],
+                    'Entry Shots Against': stats['entry_shots_against'],
+                    'Shots Per Entry Against': round(shots_per_entry_against, 2)
+                })
+
+        return data
+
+    def window_metrics(self):
+        """The INTERVAL_DECIMALS columns and shots per entry against for many sets of games at once (see Analysis)."""
+        denial_rate = ratio(self.denials, self.total_entries)
+        offense_limiting_rate = 1 - ratio(self.opponent_shots, self.opponent_possessions)
+        return {
+            'Denial Rate': denial_rate,
+            'Offense Limiting Rate': offense_limiting_rate,
+            'Tradeoff Score': (denial_rate - offense_limiting_rate) ** 2,
+            'Shots Per Entry Against': ratio(self.entry_shots_against, self.entries_against),
+        }
+
+def calculate_tradeoff_score(store):
     """Calculate the tradeoff score for each team."""
-    team_stats = defaultdict(lambda: {'denials': 0, 'total_entries': 0, 'opponent_shots': 0, 'opponent_possessions': 0})
-    data = []
-
-    # Read data from filtered CSV file
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        
-        for row in reader:
-            home_team = row['Home Team']
-            away_team = row['Away Team']
-            event_team = row['Team']
-            event = row['Event']
-            detail = row['Detail 1']
-            
-            # Get opponent team
-            opponent_team = away_team if event_team == home_team else home_team
-            
-            # Get coordinates if relevant
-            try:
-                x_coord = float(row['X Coordinate'])
-            except ValueError:
-                x_coord = None
-
-            # Count Zone Entries
-            if event == 'Zone Entry' and detail in ['Carried', 'Dumped', 'Played']:
-                team_stats[event_team]['total_entries'] += 1
-
-            # Track entry denial events (keeping original logic)
-            if event in ['Dump In/Out', 'Incomplete Play', 'Takeaway']:
-                if event == 'Dump In/Out' and detail == 'Lost':
-                    team_stats[event_team]['denials'] += 1
-                elif event == 'Incomplete Play' and x_coord is not None and 29 <= x_coord <= 207:
-                    team_stats[event_team]['denials'] += 1
-                elif event == 'Takeaway' and x_coord is not None and 29 <= x_coord <= 207:
-                    team_stats[event_team]['denials'] += 1
-
-            # Track opponent's offensive metrics
-            if event_team != opponent_team:
-                if event == 'Shot':
-                    team_stats[opponent_team]['opponent_shots'] += 1
-                if event in ['Zone Entry', 'Puck Possession']:
-                    team_stats[opponent_team]['opponent_possessions'] += 1
-
-    # Calculate metrics and tradeoff score for each team
-    for team, stats in team_stats.items():
-        if stats['total_entries'] > 0 and stats['opponent_possessions'] > 0:
-            denial_rate = stats['denials'] / stats['total_entries']
-            offense_limiting_rate = 1 - (stats['opponent_shots'] / stats['opponent_possessions'])
-            tradeoff_score = (denial_rate - offense_limiting_rate) ** 2
-
-            data.append({
-                'Team': team,
-                'Denials': stats['denials'],
-                'Total Entries': stats['total_entries'],
-                'Denial Rate': round(denial_rate, 2),
-                'Opponent Shots': stats['opponent_shots'],
-                'Opponent Possessions': stats['opponent_possessions'],
-                'Offense Limiting Rate': round(offense_limiting_rate, 2),
-                'Tradeoff Score': round(tradeoff_score, 4)
-            })
-
-    return data
-
-# Step 3: Save the metrics to a CSV file for visualization
-def save_tradeoff_scores_to_csv(data, output_file):
-    """Save the tradeoff scores to a CSV file."""
+    return run_analyses(store, [TradeoffAnalysis()])[0]
+
+def calculate_tradeoff_trends(store, window=TREND_WINDOW):
+    """Tradeoff scores for every team in every game it played, as long-format rows.
+
+    Each game gives one row per team and scope: the game alone, the team's last window games,
+    and all its games so far against that game's opponent. Every scope comes from running
+    totals of the per-game team counters, for all teams, games and opponent pairings at once.
+    """
+    analysis = TradeoffAnalysis()
+    store, games = reduce_analyses(store, [analysis])
+    merge_analyses(store, [analysis], games)
+    covered = [(game_id, rows) for (game_id, rows), records in zip(store.game_slices(), games) if records[0] is not None]
+    records = [records[0] for records in games if records[0] is not None]
+    arrays = game_arrays(analysis, records)
+    played = played_games(analysis, records)
+
+    # Each team's opponent in every game, by position in analysis.order (-1 when unknown)
+    positions = code_positions(analysis)
+    home = positions[[store['Home Team'][rows.start] for _, rows in covered]]
+    away = positions[[store['Away Team'][rows.start] for _, rows in covered]]
+    opponent = np.full(played.shape, -1)
+    for side, other in ((home, away), (away, home)):
+        known = side >= 0
+        opponent[np.flatnonzero(known), side[known]] = other[known]
+
+    # The same counters keyed by (team, opponent) pairing, so each pairing accumulates on its own
+    n_teams = len(analysis.order)
+    game, team = np.nonzero(played & (opponent >= 0))
+    pairing = team * n_teams + opponent[game, team]
+    pairing_played = np.zeros((len(covered), n_teams * n_teams), dtype=bool)
+    pairing_played[game, pairing] = True
+    pairing_arrays = {}
+    for name, array in arrays.items():
+        pairing_arrays[name] = np.zeros((len(covered), n_teams * n_teams), dtype=array.dtype)
+        pairing_arrays[name][game, pairing] = array[game, team]
+
+    scopes = [
+        ('Game', team, window_totals(arrays, played, 1)),
+        (f"Last {window}", team, window_totals(arrays, played, window)),
+        ('Vs Opponent', pairing, window_totals(pairing_arrays, pairing_played)),
+    ]
+    names = store.names('Team')[analysis.order].tolist()
+    dates = store['game_date']
+    rows = []
+    for scope, columns, (totals, games_in_window) in scopes:
+        metrics = replicate_analysis(analysis, totals).window_metrics()
+        for i, (g, column) in enumerate(zip(game, columns)):
+            game_id, game_rows = covered[g]
+            row = {
+                'Date': str(dates[game_rows.start]),
+                'Game': game_id,
+                'Team': names[team[i]],
+                'Opponent': names[opponent[g, team[i]]],
+                'Scope': scope,
+                'Games': games_in_window[g, column].item(),
+            }
+            row.update({header: totals[stat][g, column].item() for header, stat in TREND_COUNTS.items()})
+            row.update({header: values[g, column].item() for header, values in metrics.items()})
+            rows.append(row)
+    rows.sort(key=lambda row: (row['Date'], row['Game'], row['Team']))
+    return rows
+
+def create_analysis():
+    """Tradeoff analysis for this report's date range, for the combined runner."""
+    return TradeoffAnalysis(start_date, end_date)
+
+# Step 2: Save the metrics to a CSV file for visualization
+def save_tradeoff_scores_to_csv(data, output_file, intervals=None):
+    """Save the tradeoff scores to a CSV file, with bootstrap CI columns when intervals are given."""
     with open(output_file, 'w', newline='') as file:
         headers = ['Team', 'Denials', 'Total Entries', 'Denial Rate', 
-                   'Opponent Shots', 'Opponent Possessions', 'Offense Limiting Rate', 'Tradeoff Score']
+                   'Opponent Shots', 'Opponent Possessions', 'Offense Limiting Rate', 'Tradeoff Score',
+                   'Entries Against', 'Entry Shots Against', 'Shots Per Entry Against']
+        if intervals is not None:
+            headers += interval_columns(INTERVAL_DECIMALS)
         writer = csv.DictWriter(file, fieldnames=headers)
         writer.writeheader()
         for row in data:
+            if intervals is not None:
+                row = {**row, **dict(zip(interval_columns(INTERVAL_DECIMALS),
+                                         interval_cells(intervals, row['Team'], INTERVAL_DECIMALS)))}
             writer.writerow(row)
     print(f"Tradeoff scores saved to {output_file}")
 
+def save_tradeoff_trends_to_csv(rows, output_file):
+    """Save calculate_tradeoff_trends() rows to a CSV file; undefined rates are left blank."""
+    with open(output_file, 'w', newline='') as file:
+        headers = ['Date', 'Game', 'Team', 'Opponent', 'Scope', 'Games', *TREND_COUNTS, *TREND_DECIMALS]
+        writer = csv.DictWriter(file, fieldnames=headers)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, **{
+                column: '' if row[column] != row[column] else round(row[column], places)
+                for column, places in TREND_DECIMALS.items()
+            }})
+    print(f"Tradeoff trends saved to {output_file}")
+
 if __name__ == "__main__":
-    # Define the date range
-    start_date = '2018-02-11'
-    end_date = '2018-02-21'
+    # Step 1: Load the shared event store for the date range
+    store = load_event_store(original_file_path).between(start_date, end_date)
     
-    # Step 1: Filter data by date range
-    filter_data_by_date(original_file_path, filtered_file_path, start_date, end_date)
-    
-    # Step 2: Calculate tradeoff scores using the filtered data
-    teams_metrics = calculate_tradeoff_score(filtered_file_path)
+    # Step 2: Calculate tradeoff scores for the selected events, with bootstrap intervals over the games
+    (teams_metrics,), (intervals,) = run_with_intervals(store, [TradeoffAnalysis()])
     
     # Step 3: Save the results to CSV
-    save_tradeoff_scores_to_csv(teams_metrics, output_file_path)
\ No newline at end of file
+    save_tradeoff_scores_to_csv(teams_metrics, output_file_path, intervals)
+
+    # Step 4: Save per-game, rolling and per-opponent tradeoff trends
+    save_tradeoff_trends_to_csv(calculate_tradeoff_trends(store), trends_output_file_path)
\ No newline at end of file
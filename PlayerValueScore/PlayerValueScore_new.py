@@ -1,12 +1,25 @@
 import csv
 from collections import defaultdict
-import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import interval_cells, interval_columns, ratio, run_with_intervals
+from engine import Analysis, MetricTensor, first_appearances, run_analyses
+from event_store import load_event_store
+from scoring import ScoreFeatures, weighted_sum
+from shot_model import calculate_expected_goals
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/PlayerValueScore/filtered_playervaluescore_dataset.csv'
 output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/PlayerValueScore/playervalue_analysis.csv'
 
+# Define date range
+start_date = '2018-02-11'
+end_date = '2018-02-21'
+
 # Define weights for scoring
 weights = {
     'Goal': {
@@ -66,176 +79,150 @@ weights = {
     'Faceoff Win Rate': 10
 }
 
-# Step 1: Filter data by date range
-def filter_data_by_date(file_path, filtered_path, start_date, end_date):
-    """Filter the dataset by a specified date range and save to a new CSV."""
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            game_date = row['game_date']
-            if start_date <= game_date <= end_date:
-                writer.writerow(row)
-
-def determine_game_situation(row, event_team):
-    """Determine if the team is on powerplay, shorthanded, or even strength."""
-    home_team = row['Home Team']
-    home_skaters = int(row['Home Team Skaters'])
-    away_skaters = int(row['Away Team Skaters'])
-    
-    if event_team == home_team:
-        if home_skaters > away_skaters and away_skaters <= 4:
-            return 'powerplay'
-        elif home_skaters < away_skaters and home_skaters <= 4:
-            return 'shorthanded'
-    else:
-        if away_skaters > home_skaters and home_skaters <= 4:
-            return 'powerplay'
-        elif away_skaters < home_skaters and away_skaters <= 4:
-            return 'shorthanded'
-    return 'evenstrength'
-
-# Step 2: Calculate player value scores
-def calculate_player_value_scores(file_path):
-    player_stats = {}
-
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        
-        for row in reader:
-            event_team = row['Team']
-            event = row['Event']
-            detail = row['Detail 1']
-            detail_2 = row['Detail 2']
-            player = row['Player']
-            player2 = row['Player 2']
-
-            situation = determine_game_situation(row, event_team)
-
-            # Get coordinates
-            try:
-                x_coord = float(row['X Coordinate'])
-            except ValueError:
-                x_coord = None
-
-            # Initialize player in dictionary if not present
-            for p in [player, player2]:
-                if p and p not in player_stats:
-                    player_stats[p] = {
-                        'total_score': 0,
-                        'expected_value': 0,
-                        'goals': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'expected_goals': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'penalties': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'faceoff_wins': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'carried': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'dumped': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'shots': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'shots_on_net': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},  # Added shots on net
-                        'danger_zone_shots': {'evenstrength': 0, 'powerplay': 0, 'shorthanded': 0, 'total': 0},
-                        'total_shots': 0,
-                        'total_entries': 0,
-                        'successful_entries': 0,
-                        'denials': 0,
-                        'total_faceoffs': 0
-                    }
-
-            if player:
-                stats = player_stats[player]
-                
-                # Process shots and expected goals
-                if event == 'Shot':
-                    stats['total_shots'] += 1
-                    if detail_2 != 'Blocked':
-                        stats['shots'][situation] += 1
-                        stats['shots']['total'] += 1
-                        stats['total_score'] += weights['Shot'][situation]
-                        
-                        # Add counter for shots on net
-                        if detail_2 == 'On Net':
-                            stats['shots_on_net'][situation] += 1
-                            stats['shots_on_net']['total'] += 1
-                            stats['total_score'] += weights['Shot on Net'][situation]
-                        
-                        try:
-                            x_coord = float(row['X Coordinate'])
-                            y_coord = float(row['Y Coordinate'])
-                            
-                            # Standardize coordinates
-                            if x_coord > 100:
-                                x_coord = 200 - x_coord
-                                y_coord = 85 - y_coord
-                            
-                            distance = math.sqrt((x_coord - 0)**2 + (y_coord - 42.5)**2)
-                            angle = abs(math.atan2(y_coord - 42.5, x_coord))
-                            
-                            # Calculate expected goals
-                            xg = 0.09
-                            xg *= 0.985 ** (distance/10)
-                            xg *= 0.985 ** (math.degrees(angle))
-                            
-                            # Check for danger zone
-                            if ((11 <= x_coord <= 19.8 or 180.2 <= x_coord <= 188.8) and 
-                                (20.5 <= y_coord <= 64.4)):
-                                stats['danger_zone_shots'][situation] += 1
-                                stats['danger_zone_shots']['total'] += 1
-                                xg *= 2.0
-                                stats['total_score'] += weights['Danger Zone Shot'][situation]
-                            
-                            # Apply situation weights to expected goals
-                            weighted_xg = xg * weights['Expected_Value'][situation]
-                            stats['expected_goals'][situation] += weighted_xg
-                            stats['expected_goals']['total'] += weighted_xg
-                            
-                        except (ValueError, TypeError):
-                            pass
-
-                # Process other events
-                if event == 'Goal':
-                    stats['goals'][situation] += 1
-                    stats['goals']['total'] += 1
-                    stats['total_score'] += weights['Goal'][situation]
-                
-                elif event == 'Penalty Taken':
-                    stats['penalties'][situation] += 1
-                    stats['penalties']['total'] += 1
-                    stats['total_score'] += weights['Penalty Taken'][situation]
-                
-                elif event == 'Puck Recovery':
-                    stats['total_score'] += weights['Puck Recovery'][situation]
-                
-                elif event == 'Faceoff Win':
-                    stats['faceoff_wins'][situation] += 1
-                    stats['faceoff_wins']['total'] += 1
-                    stats['total_score'] += weights['Faceoff Win'][situation]
-                    stats['total_faceoffs'] += 1
-                    if player2:
-                        player_stats[player2]['total_faceoffs'] += 1
-
-                elif event == 'Zone Entry':
-                    stats['total_entries'] += 1
-                    if detail == 'Carried':
-                        stats['carried'][situation] += 1
-                        stats['carried']['total'] += 1
-                        stats['total_score'] += weights['Carried'][situation]
-                        stats['successful_entries'] += 1
-                    elif detail == 'Dumped':
-                        stats['dumped'][situation] += 1
-                        stats['dumped']['total'] += 1
-                        stats['total_score'] += weights['Dumped'][situation]
-                        stats['successful_entries'] += 1
-
-                # Calculate denials using Entry Defense Analysis (a) logic
-                if event == 'Dump In/Out' and detail == 'Lost':
-                    if player and player2:
-                        player_stats[player2]['denials'] += 1
-                elif event == 'Incomplete Play' and x_coord is not None:
-                    if 29 <= x_coord <= 207 and player and player2:
-                        player_stats[player2]['denials'] += 1
-                elif event == 'Takeaway' and x_coord is not None:
-                    if 29 <= x_coord <= 207 and player:
-                        player_stats[player]['denials'] += 1
+# Situation names used in player_stats, indexed by the engine's situation codes
+SITUATIONS = ['evenstrength', 'powerplay', 'shorthanded']
+SITUATION_COUNTS = ['goals', 'penalties', 'faceoff_wins', 'carried', 'dumped',
+                    'shots', 'shots_on_net', 'danger_zone_shots']
+PLAYER_COUNTS = ['total_shots', 'total_entries', 'successful_entries', 'denials', 'total_faceoffs']
+# Counts kept alongside the reported ones: located shots behind expected_goals (so players
+# without one report an integer 0) and puck recoveries, which are only scored
+TRACKING_COUNTS = ['expected_goals_shots', 'puck_recoveries']
+
+# Count behind each per-situation event weight, and the stat behind each rate weight
+SCORED_COUNTS = {
+    'Goal': 'goals',
+    'Penalty Taken': 'penalties',
+    'Puck Recovery': 'puck_recoveries',
+    'Faceoff Win': 'faceoff_wins',
+    'Carried': 'carried',
+    'Dumped': 'dumped',
+    'Shot': 'shots',
+    'Shot on Net': 'shots_on_net',
+    'Danger Zone Shot': 'danger_zone_shots',
+}
+SCORED_RATES = {
+    'Entry Rate': 'entry_rate',
+    'Denial Rate': 'denial_rate',
+    'Carried Rate': 'carried_rate',
+    'Dumped Rate': 'dumped_rate',
+    'Faceoff Win Rate': 'faceoff_win_rate',
+}
+
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {
+    'Total Score': 2,
+    'Goals Above Expected': 2,
+    'Faceoff Win Rate': 1,
+    'Entry Rate': 1,
+    'Denial Rate': 1,
+}
+
+# Step 1: Calculate player value scores
+class PlayerValueAnalysis(Analysis):
+    """Player value scores, accumulated one game at a time from the shared event stream."""
+
+    code_column = 'Player'
+    accumulators = ('counts', 'expected_goals', 'expected_goals_total')
+
+    def bind(self, store):
+        super().bind(store)
+        n_players = len(store.names('Player'))
+        self.expected_value_weights = np.array([weights['Expected_Value'][situation] for situation in SITUATIONS])
+        self.seen = np.zeros(n_players, dtype=bool)
+        self.seen[0] = True  # blank player
+        self.order = []
+        self.counts = MetricTensor(n_players, SITUATION_COUNTS + PLAYER_COUNTS + TRACKING_COUNTS, len(SITUATIONS))
+        self.expected_goals = np.zeros((n_players, len(SITUATIONS)))
+        self.expected_goals_total = np.zeros(n_players)
+
+    def count(self, batch, mask, metric, player=None):
+        """Add one to metric for every masked row, split by situation, score state and period.
+
+        Rows are credited to Player unless another player column is given; that is Player 2,
+        on the other side, so its rows take the opponent's situation and score state.
+        """
+        if player is None:
+            player, situation, score_state = batch['Player'], batch.situation, batch.score_state
+        else:
+            situation, score_state = batch.opponent_situation, batch.opponent_score_state
+        self.counts.add(metric, player[mask], situation[mask], score_state[mask], batch.period_index[mask])
+
+    def consume(self, batch):
+        player = batch['Player']
+        player2 = batch['Player 2']
+        situation = batch.situation
+
+        # Players enter the results in the order they first appear (Player, then Player 2)
+        appearances = np.column_stack((player, player2)).ravel()
+        self.order.extend(first_appearances(appearances[appearances > 0], self.seen).tolist())
+
+        active = player > 0
+        has_player2 = player2 > 0
+
+        # Process shots and expected goals
+        shots = active & batch.is_event('Shot')
+        self.count(batch, shots, 'total_shots')
+        unblocked = shots & ~batch.has_detail('Detail 2', 'Blocked')
+        self.count(batch, unblocked, 'shots')
+        self.count(batch, unblocked & batch.has_detail('Detail 2', 'On Net'), 'shots_on_net')
+
+        # Expected goals for every located shot at once; the situation enters through the weights
+        located = unblocked & batch.has_coordinates
+        xg, is_danger_zone = calculate_expected_goals(batch['X Coordinate'][located], batch['Y Coordinate'][located])
+        shooter, shot_situation = player[located], situation[located]
+
+        danger_zone = np.zeros(len(batch), dtype=bool)
+        danger_zone[located] = is_danger_zone
+        self.count(batch, danger_zone, 'danger_zone_shots')
+
+        # Apply situation weights to expected goals
+        weighted_xg = xg * self.expected_value_weights[shot_situation]
+        np.add.at(self.expected_goals, (shooter, shot_situation), weighted_xg)
+        np.add.at(self.expected_goals_total, shooter, weighted_xg)
+        self.count(batch, located, 'expected_goals_shots')
+
+        # Process other events
+        self.count(batch, active & batch.is_event('Goal'), 'goals')
+        self.count(batch, active & batch.is_event('Penalty Taken'), 'penalties')
+        self.count(batch, active & batch.is_event('Puck Recovery'), 'puck_recoveries')
+
+        faceoffs = active & batch.is_event('Faceoff Win')
+        self.count(batch, faceoffs, 'faceoff_wins')
+        self.count(batch, faceoffs, 'total_faceoffs')
+        self.count(batch, faceoffs & has_player2, 'total_faceoffs', player=player2)
+
+        entries = active & batch.is_event('Zone Entry')
+        self.count(batch, entries, 'total_entries')
+        for detail, metric in [('Carried', 'carried'), ('Dumped', 'dumped')]:
+            successful = entries & batch.has_detail('Detail 1', detail)
+            self.count(batch, successful, metric)
+            self.count(batch, successful, 'successful_entries')
+
+        # Calculate denials using Entry Defense Analysis (a) logic
+        denied_by_player2 = active & has_player2 & (
+            batch.lost_dump | (batch.is_event('Incomplete Play') & batch.neutral_zone))
+        denied_by_player = active & batch.is_event('Takeaway') & batch.neutral_zone
+        self.count(batch, denied_by_player2, 'denials', player=player2)
+        self.count(batch, denied_by_player, 'denials')
+
+    def finalize(self):
+        player_stats = {}
+        for player in self.order:
+            stats = {'total_score': 0, 'expected_value': 0}
+            for metric in SITUATION_COUNTS:
+                stats[metric] = dict(zip(SITUATIONS, self.counts[metric][player].tolist()))
+                stats[metric]['total'] = sum(stats[metric].values())
+            # Players without a scored shot keep an integer 0, as in the row-by-row version
+            xg_shots = self.counts['expected_goals_shots'][player]
+            stats['expected_goals'] = {
+                situation: (self.expected_goals[player, s].item() if xg_shots[s] else 0)
+                for s, situation in enumerate(SITUATIONS)
+            }
+            stats['expected_goals']['total'] = self.expected_goals_total[player].item() if xg_shots.any() else 0
+            totals = self.counts.totals(player)
+            for metric in PLAYER_COUNTS:
+                stats[metric] = totals[metric]
+            player_stats[self.store.decode('Player', player)] = stats
 
         # Calculate rates and expected value
         for stats in player_stats.values():
@@ -245,21 +232,12 @@ def calculate_player_value_scores(file_path):
                 stats['denial_rate'] = stats['denials'] / stats['total_entries']
                 stats['carried_rate'] = stats['carried']['total'] / stats['total_entries']
                 stats['dumped_rate'] = stats['dumped']['total'] / stats['total_entries']
-                
-                # Add rate weights to total score
-                stats['total_score'] += (
-                    stats['entry_rate'] * weights['Entry Rate'] +
-                    stats['denial_rate'] * weights['Denial Rate'] +
-                    stats['carried_rate'] * weights['Carried Rate'] +
-                    stats['dumped_rate'] * weights['Dumped Rate']
-                )
             else:
                 stats['entry_rate'] = stats['denial_rate'] = stats['carried_rate'] = stats['dumped_rate'] = 0
 
             # Faceoff rate
             if stats['total_faceoffs'] > 0:
                 stats['faceoff_win_rate'] = stats['faceoff_wins']['total'] / stats['total_faceoffs']
-                stats['total_score'] += stats['faceoff_win_rate'] * weights['Faceoff Win Rate']
             else:
                 stats['faceoff_win_rate'] = 0
 
@@ -272,9 +250,53 @@ def calculate_player_value_scores(file_path):
             # Goals above expected
             stats['goals_above_expected'] = stats['goals']['total'] - stats['expected_goals']['total']
 
-    return player_stats
+        # Score every player at once from the raw counts and rates; kept for re-scoring
+        codes = np.array(self.order, dtype=np.int64)
+        self.features = ScoreFeatures(
+            list(player_stats),
+            {name: self.counts[metric][codes] for name, metric in SCORED_COUNTS.items()},
+            {name: [stats[rate] for stats in player_stats.values()] for name, rate in SCORED_RATES.items()},
+            [stats['total_entries'] > 0 or stats['total_faceoffs'] > 0 for stats in player_stats.values()],
+            SITUATIONS,
+        )
+        for stats, score in zip(player_stats.values(), self.features.scores(weights)):
+            stats['total_score'] = score
+
+        return player_stats
+
+    def window_metrics(self):
+        """Expected Goals and the INTERVAL_DECIMALS columns for many sets of games at once (see Analysis)."""
+        total_entries = self.counts['total_entries'].sum(axis=-1)
+        total_faceoffs = self.counts['total_faceoffs'].sum(axis=-1)
+        rates = {
+            'Entry Rate': ratio(self.counts['successful_entries'].sum(axis=-1), total_entries),
+            'Denial Rate': ratio(self.counts['denials'].sum(axis=-1), total_entries),
+            'Carried Rate': ratio(self.counts['carried'].sum(axis=-1), total_entries),
+            'Dumped Rate': ratio(self.counts['dumped'].sum(axis=-1), total_entries),
+            'Faceoff Win Rate': ratio(self.counts['faceoff_wins'].sum(axis=-1), total_faceoffs),
+        }
+        # Undefined rates score 0, as in finalize()
+        scored_rates = {name: np.nan_to_num(rate) for name, rate in rates.items()}
+        counts = {name: self.counts[metric] for name, metric in SCORED_COUNTS.items()}
+        return {
+            'Total Score': weighted_sum(counts, weights, SITUATIONS) + weighted_sum(scored_rates, weights),
+            'Expected Goals': self.expected_goals_total,
+            'Goals Above Expected': self.counts['goals'].sum(axis=-1) - self.expected_goals_total,
+            'Faceoff Win Rate': rates['Faceoff Win Rate'] * 100,
+            'Entry Rate': rates['Entry Rate'] * 100,
+            'Denial Rate': rates['Denial Rate'] * 100,
+        }
+
+def calculate_player_value_scores(store):
+    """Calculate player value scores for every player in store."""
+    return run_analyses(store, [PlayerValueAnalysis()])[0]
+
+def create_analysis():
+    """Player value analysis over this report's date range, for the combined runner."""
+    return PlayerValueAnalysis(start_date, end_date)
 
-def save_top_players_to_csv(player_stats, output_file_path):
+def save_top_players_to_csv(player_stats, output_file_path, intervals=None):
+    """Save the top 10 players, with bootstrap CI columns when intervals are given."""
     with open(output_file_path, 'w', newline='') as file:
         fieldnames = [
             'Player', 'Total Score', 'Goals', 'Expected Goals', 'Goals Above Expected',
@@ -283,12 +305,14 @@ def save_top_players_to_csv(player_stats, output_file_path):
             'Denials', 'Entry Rate', 'Denial Rate', 'Carried Rate', 'Dumped Rate',
             'Shots', 'Shots on Net', 'Danger Zone Shots', 'Shot Accuracy'  # Added Shots on Net
         ]
+        if intervals is not None:
+            fieldnames += interval_columns(INTERVAL_DECIMALS)
         writer = csv.DictWriter(file, fieldnames=fieldnames)
         writer.writeheader()
 
         sorted_players = sorted(player_stats.items(), key=lambda x: x[1]['total_score'], reverse=True)
         for player, stats in sorted_players[:10]:
-            writer.writerow({
+            row = {
                 'Player': player,
                 'Total Score': round(stats['total_score'], 2),
                 'Goals': stats['goals']['total'],
@@ -310,15 +334,16 @@ def save_top_players_to_csv(player_stats, output_file_path):
                 'Shots on Net': stats['shots_on_net']['total'],  # Added shots on net to output
                 'Danger Zone Shots': stats['danger_zone_shots']['total'],
                 'Shot Accuracy': round(stats['shot_accuracy'] * 100, 1)
-            })
+            }
+            if intervals is not None:
+                row.update(zip(interval_columns(INTERVAL_DECIMALS), interval_cells(intervals, player, INTERVAL_DECIMALS)))
+            writer.writerow(row)
     print(f"Top players saved to {output_file_path}")
 
 if __name__ == "__main__":
-    # Filter data by date range
-    start_date = '2018-02-11'
-    end_date = '2018-02-21'
-    filter_data_by_date(original_file_path, filtered_file_path, start_date, end_date)
+    # Load the shared event store and select the date range
+    store = load_event_store(original_file_path).between(start_date, end_date)
     
-    # Calculate and save player value scores
-    player_stats = calculate_player_value_scores(filtered_file_path)
-    save_top_players_to_csv(player_stats, output_file_path)
\ No newline at end of file
+    # Calculate and save player value scores, with bootstrap intervals over the games
+    (player_stats,), (intervals,) = run_with_intervals(store, [PlayerValueAnalysis()])
+    save_top_players_to_csv(player_stats, output_file_path, intervals)
\ No newline at end of file
@@ -1,27 +1,21 @@
-import pandas as pd
+import os
+import sys
+
 import matplotlib.pyplot as plt
-import seaborn as sns
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from density_cache import subject_density
+from heatmap_plot import draw_density
 
 # Load the dataset
 file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'  # Update with correct path
-data = pd.read_csv(file_path)
-
-# Filter data for Brianne Jenner's shots
-brianne_data = data[data['Player'] == 'Brianne Jenner']
 
-# Get only the 'Shot' events and relevant X, Y coordinates
-brianne_shots = brianne_data[brianne_data['Event'] == 'Shot']
-
-# Extract X and Y coordinates of the shots
-shots_df = brianne_shots[['X Coordinate', 'Y Coordinate']]
+# Density of Brianne Jenner's shots
+density = subject_density(file_path, 'Player', ['Brianne Jenner'])
 
 # Create a heatmap for the shot locations
 plt.figure(figsize=(10, 6))
-sns.kdeplot(x=shots_df['X Coordinate'], y=shots_df['Y Coordinate'], cmap="YlGnBu", fill=True)
-
-plt.title("Shot Map for Brianne Jenner")
-plt.xlabel("X Coordinate (Feet)")
-plt.ylabel("Y Coordinate (Feet)")
+draw_density(density, "Shot Map for Brianne Jenner")
 
 # Show the plot
 plt.show()
@@ -1,12 +1,24 @@
 import csv
 from collections import defaultdict
-import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import interval_cells, interval_columns, ratio, run_with_intervals
+from engine import Analysis, MetricTensor, first_appearances, run_analyses
+from event_store import load_event_store
+from scoring import ScoreFeatures, weighted_sum
+from shot_model import calculate_expected_goals
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Postgame/filtered_toppostgameplayers_dataset.csv'
 output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Postgame/toppostgameplayers.csv'
 
+# Define the game to report on
+game_date = '2019-02-17'
+
 # Define weights for scoring
 weights = {
     'Goal': {
@@ -61,34 +73,6 @@ weights = {
     'Faceoff Win Rate': 10
 }
 
-def filter_data_by_date(file_path, filtered_path, game_date):
-    """Filter the dataset for a specific game date and save to a new CSV."""
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            if row['game_date'] == game_date:
-                writer.writerow(row)
-
-def determine_game_situation(row, event_team):
-    """Determine if the team is on powerplay, shorthanded, or even strength."""
-    home_team = row['Home Team']
-    home_skaters = int(row['Home Team Skaters'])
-    away_skaters = int(row['Away Team Skaters'])
-    
-    if event_team == home_team:
-        if home_skaters > away_skaters and away_skaters <= 4:
-            return 'powerplay'
-        elif home_skaters < away_skaters and home_skaters <= 4:
-            return 'shorthanded'
-    else:
-        if away_skaters > home_skaters and home_skaters <= 4:
-            return 'powerplay'
-        elif away_skaters < home_skaters and away_skaters <= 4:
-            return 'shorthanded'
-    return 'evenstrength'
-
 def initialize_player_stats(team):
     """Initialize dictionary for player statistics."""
     return {
@@ -117,134 +101,158 @@ def initialize_player_stats(team):
         'situations': defaultdict(int)
     }
 
-def calculate_expected_goals(x_coord, y_coord, situation):
-    """Calculate expected goals based on shot location and situation."""
-    if x_coord > 100:
-        x_coord = 200 - x_coord
-        y_coord = 85 - y_coord
-    
-    distance = math.sqrt((x_coord - 0)**2 + (y_coord - 42.5)**2)
-    angle = abs(math.atan2(y_coord - 42.5, x_coord))
-    
-    xg = 0.09
-    xg *= 0.985 ** (distance/10)
-    xg *= 0.985 ** (math.degrees(angle))
-    
-    is_danger_zone = ((11 <= x_coord <= 19.8 or 180.2 <= x_coord <= 188.8) and 
-                    (20.5 <= y_coord <= 64.4))
-    
-    if is_danger_zone:
-        xg *= 2.0
-    
-    situation_multiplier = {'evenstrength': 1.0, 'powerplay': 1.2, 'shorthanded': 0.8}
-    xg *= situation_multiplier[situation]
-    
-    return xg, is_danger_zone
+# Situation names used by the weights, indexed by the engine's situation codes
+SITUATIONS = ['evenstrength', 'powerplay', 'shorthanded']
+PLAYER_COUNTS = ['goals', 'penalties', 'faceoff_wins', 'total_faceoffs', 'carried', 'dumped',
+                 'total_entries', 'successful_entries', 'denials', 'shots', 'danger_zone_shots', 'total_shots']
+# Counts kept alongside the reported ones: located shots behind expected_goals, events per
+# situation and puck recoveries, which are only scored
+TRACKING_COUNTS = ['expected_goals_shots', 'events', 'puck_recoveries']
 
-def calculate_player_value_scores(file_path):
-    """Calculate player value scores for all players."""
-    player_stats = {}
-
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        
-        for row in reader:
-            event_team = row['Team']
-            home_team = row['Home Team']
-            away_team = row['Away Team']
-            event = row['Event']
-            detail = row['Detail 1']
-            detail_2 = row['Detail 2']
-            player = row['Player']
-            player2 = row['Player 2']
-
-            situation = determine_game_situation(row, event_team)
-
-            # Initialize players
-            for p in [player, player2]:
-                if p and p not in player_stats:
-                    team = event_team if p == player else (home_team if event_team == away_team else away_team)
-                    player_stats[p] = initialize_player_stats(team)
-
-            if player:
-                player_stats[player]['situations'][situation] += 1
-
-                # Process events
-                if event == 'Shot':
-                    player_stats[player]['total_shots'] += 1
-                    if detail_2 != 'Blocked':
-                        player_stats[player]['shots'] += 1
-                        player_stats[player]['total_score'] += weights['Shot'][situation]
-                        
-                        try:
-                            x_coord = float(row['X Coordinate'])
-                            y_coord = float(row['Y Coordinate'])
-                            xg, is_danger_zone = calculate_expected_goals(x_coord, y_coord, situation)
-                            
-                            player_stats[player]['expected_goals'] += xg
-                            player_stats[player]['expected_goals_weight'] += xg * weights['Expected Goals'][situation]
-                            
-                            if is_danger_zone:
-                                player_stats[player]['danger_zone_shots'] += 1
-                                player_stats[player]['total_score'] += weights['Danger Zone Shot'][situation]
-                            
-                        except (ValueError, TypeError):
-                            pass
-
-                elif event == 'Goal':
-                    player_stats[player]['goals'] += 1
-                    player_stats[player]['total_score'] += weights['Goal'][situation]
-                elif event == 'Penalty Taken':
-                    player_stats[player]['penalties'] += 1
-                    player_stats[player]['total_score'] += weights['Penalty Taken'][situation]
-                elif event == 'Puck Recovery':
-                    player_stats[player]['total_score'] += weights['Puck Recovery'][situation]
-                elif event == 'Faceoff Win':
-                    player_stats[player]['faceoff_wins'] += 1
-                    player_stats[player]['total_score'] += weights['Faceoff Win'][situation]
-                    player_stats[player]['total_faceoffs'] += 1
-                    if player2:
-                        player_stats[player2]['total_faceoffs'] += 1
-                elif event == 'Zone Entry':
-                    player_stats[player]['total_entries'] += 1
-                    if detail == 'Carried':
-                        player_stats[player]['carried'] += 1
-                        player_stats[player]['total_score'] += weights['Carried'][situation]
-                        player_stats[player]['successful_entries'] += 1
-                    elif detail == 'Dumped':
-                        player_stats[player]['dumped'] += 1
-                        player_stats[player]['total_score'] += weights['Dumped'][situation]
-                        player_stats[player]['successful_entries'] += 1
-
-                if event == 'Dump In/Out' and detail == 'Lost' and player2:
-                    player_stats[player2]['denials'] += 1
-                elif event in ['Incomplete Play', 'Takeaway'] and row['X Coordinate']:
-                    try:
-                        x_coord = float(row['X Coordinate'])
-                        if 29 <= x_coord <= 207:
-                            player_stats[player]['denials'] += 1
-                    except ValueError:
-                        pass
+# Count behind each per-situation event weight, and the stat behind each rate weight
+SCORED_COUNTS = {
+    'Goal': 'goals',
+    'Penalty Taken': 'penalties',
+    'Puck Recovery': 'puck_recoveries',
+    'Faceoff Win': 'faceoff_wins',
+    'Carried': 'carried',
+    'Dumped': 'dumped',
+    'Shot': 'shots',
+    'Danger Zone Shot': 'danger_zone_shots',
+}
+SCORED_RATES = {
+    'Entry Rate': 'entry_rate',
+    'Denial Rate': 'denial_rate',
+    'Carried Rate': 'carried_rate',
+    'Dumped Rate': 'dumped_rate',
+    'Faceoff Win Rate': 'faceoff_win_rate',
+}
+
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {
+    'Total Score': 2,
+    'Goals Above Expected': 2,
+    'Faceoff Win Rate': 1,
+    'Entry Rate': 1,
+    'Denial Rate': 1,
+}
+
+class PostgamePlayerAnalysis(Analysis):
+    """Postgame player value scores, accumulated one game at a time from the shared event stream."""
+
+    code_column = 'Player'
+    accumulators = ('counts', 'expected_goals')
+    first_seen = {'team': 'Team'}
+
+    def bind(self, store):
+        super().bind(store)
+        n_players = len(store.names('Player'))
+        self.seen = np.zeros(n_players, dtype=bool)
+        self.order = []
+        self.team = np.zeros(n_players, dtype=np.int32)
+        self.counts = MetricTensor(n_players, PLAYER_COUNTS + TRACKING_COUNTS, len(SITUATIONS))
+        self.expected_goals = np.zeros((n_players, len(SITUATIONS)))
+
+    def count(self, batch, mask, metric, player=None):
+        """Add one to metric for every masked row, split by situation, score state and period.
+
+        Rows are credited to Player unless another player column is given; that is Player 2,
+        on the other side, so its rows take the opponent's situation and score state.
+        """
+        if player is None:
+            player, situation, score_state = batch['Player'], batch.situation, batch.score_state
+        else:
+            situation, score_state = batch.opponent_situation, batch.opponent_score_state
+        self.counts.add(metric, player[mask], situation[mask], score_state[mask], batch.period_index[mask])
+
+    def consume(self, batch):
+        player = batch['Player']
+        player2 = batch['Player 2']
+        situation = batch.situation
+
+        # Initialize players: Player belongs to the event team, Player 2 to the other side
+        team = batch['Team']
+        other_team = np.where(team == batch['Away Team'], batch['Home Team'], batch['Away Team'])
+        appearances = np.column_stack((player, player2)).ravel()
+        appearance_teams = np.column_stack((team, other_team)).ravel()
+        present = appearances > 0
+        new_players, first = first_appearances(appearances[present], self.seen, return_index=True)
+        self.order.extend(new_players.tolist())
+        self.team[new_players] = appearance_teams[present][first]
+
+        active = player > 0
+        self.count(batch, active, 'events')
+
+        # Process events
+        shots = active & batch.is_event('Shot')
+        self.count(batch, shots, 'total_shots')
+        unblocked = shots & ~batch.has_detail('Detail 2', 'Blocked')
+        self.count(batch, unblocked, 'shots')
+
+        # Expected goals for every located shot at once
+        located = unblocked & batch.has_coordinates
+        shooter, shot_situation = player[located], situation[located]
+        xg, is_danger_zone = calculate_expected_goals(
+            batch['X Coordinate'][located], batch['Y Coordinate'][located], shot_situation)
+
+        np.add.at(self.expected_goals, (shooter, shot_situation), xg)
+        self.count(batch, located, 'expected_goals_shots')
+
+        danger_zone = np.zeros(len(batch), dtype=bool)
+        danger_zone[located] = is_danger_zone
+        self.count(batch, danger_zone, 'danger_zone_shots')
+
+        self.count(batch, active & batch.is_event('Goal'), 'goals')
+        self.count(batch, active & batch.is_event('Penalty Taken'), 'penalties')
+        self.count(batch, active & batch.is_event('Puck Recovery'), 'puck_recoveries')
+
+        faceoffs = active & batch.is_event('Faceoff Win')
+        self.count(batch, faceoffs, 'faceoff_wins')
+        self.count(batch, faceoffs, 'total_faceoffs')
+        self.count(batch, faceoffs & (player2 > 0), 'total_faceoffs', player=player2)
+
+        entries = active & batch.is_event('Zone Entry')
+        self.count(batch, entries, 'total_entries')
+        for detail, metric in [('Carried', 'carried'), ('Dumped', 'dumped')]:
+            successful = entries & batch.has_detail('Detail 1', detail)
+            self.count(batch, successful, metric)
+            self.count(batch, successful, 'successful_entries')
+
+        denied_by_player2 = active & batch.lost_dump & (player2 > 0)
+        denied_by_player = active & (batch.is_event('Incomplete Play') | batch.is_event('Takeaway')) & batch.neutral_zone
+        self.count(batch, denied_by_player2, 'denials', player=player2)
+        self.count(batch, denied_by_player, 'denials')
+
+    def finalize(self):
+        # Expected goals weighted by the shooter's situation
+        expected_goals_weights = np.array([weights['Expected Goals'][situation] for situation in SITUATIONS])
+        expected_goals_weight = self.expected_goals @ expected_goals_weights
+
+        player_stats = {}
+        for player in self.order:
+            stats = initialize_player_stats(self.store.decode('Team', self.team[player]))
+            totals = self.counts.totals(player)
+            for metric in PLAYER_COUNTS:
+                stats[metric] = totals[metric]
+            # Players without a scored shot keep an integer 0, as in the row-by-row version
+            if totals['expected_goals_shots']:
+                stats['expected_goals'] = self.expected_goals[player].sum().item()
+                stats['expected_goals_weight'] = expected_goals_weight[player].item()
+            for situation, events in zip(SITUATIONS, self.counts['events'][player].tolist()):
+                if events:
+                    stats['situations'][situation] = events
+            player_stats[self.store.decode('Player', player)] = stats
 
         # Calculate final rates and scores
         for stats in player_stats.values():
-            stats['total_score'] += stats['expected_goals_weight']
-
             if stats['total_entries'] > 0:
                 stats['entry_rate'] = stats['successful_entries'] / stats['total_entries']
                 stats['denial_rate'] = stats['denials'] / stats['total_entries']
                 stats['carried_rate'] = stats['carried'] / stats['total_entries']
                 stats['dumped_rate'] = stats['dumped'] / stats['total_entries']
-                
+            
                 stats['carried_rate_weight'] = stats['carried_rate'] * weights['Carried Rate']
                 stats['dumped_rate_weight'] = stats['dumped_rate'] * weights['Dumped Rate']
-                
-                stats['total_score'] += (
-                    stats['entry_rate'] * weights['Entry Rate'] +
-                    stats['denial_rate'] * weights['Denial Rate'] +
-                    stats['carried_rate_weight'] +
-                    stats['dumped_rate_weight']
-                )
             else:
                 stats['entry_rate'] = stats['denial_rate'] = 0
                 stats['carried_rate'] = stats['dumped_rate'] = 0
@@ -252,16 +260,60 @@ def calculate_player_value_scores(file_path):
 
             if stats['total_faceoffs'] > 0:
                 stats['faceoff_win_rate'] = stats['faceoff_wins'] / stats['total_faceoffs']
-                stats['total_score'] += stats['faceoff_win_rate'] * weights['Faceoff Win Rate']
             else:
                 stats['faceoff_win_rate'] = 0
 
             stats['goals_above_expected'] = stats['goals'] - stats['expected_goals']
 
-    return player_stats
+        # Score every player at once from the raw counts, expected goals and rates; kept for re-scoring
+        codes = np.array(self.order, dtype=np.int64)
+        rates = {name: [stats[rate] for stats in player_stats.values()] for name, rate in SCORED_RATES.items()}
+        self.features = ScoreFeatures(
+            list(player_stats),
+            {name: self.counts[metric][codes] for name, metric in SCORED_COUNTS.items()},
+            {'Expected Goals': self.expected_goals[codes], **rates},
+            (self.counts['expected_goals_shots'][codes].any(axis=1) |
+             (self.counts['total_entries'][codes].sum(axis=1) > 0) |
+             (self.counts['total_faceoffs'][codes].sum(axis=1) > 0)),
+            SITUATIONS,
+        )
+        for stats, score in zip(player_stats.values(), self.features.scores(weights)):
+            stats['total_score'] = score
+
+        return player_stats
+
+    def window_metrics(self):
+        """Expected Goals and the INTERVAL_DECIMALS columns for many sets of games at once (see Analysis)."""
+        totals = {metric: self.counts[metric].sum(axis=-1) for metric in PLAYER_COUNTS}
+        rates = {
+            'Entry Rate': ratio(totals['successful_entries'], totals['total_entries']),
+            'Denial Rate': ratio(totals['denials'], totals['total_entries']),
+            'Carried Rate': ratio(totals['carried'], totals['total_entries']),
+            'Dumped Rate': ratio(totals['dumped'], totals['total_entries']),
+            'Faceoff Win Rate': ratio(totals['faceoff_wins'], totals['total_faceoffs']),
+        }
+        # Undefined rates score 0, as in finalize()
+        scored_rates = {name: np.nan_to_num(rate) for name, rate in rates.items()}
+        counts = {name: self.counts[metric] for name, metric in SCORED_COUNTS.items()}
+        return {
+            'Total Score': weighted_sum({**counts, 'Expected Goals': self.expected_goals, **scored_rates}, weights, SITUATIONS),
+            'Expected Goals': self.expected_goals.sum(axis=-1),
+            'Goals Above Expected': totals['goals'] - self.expected_goals.sum(axis=-1),
+            'Faceoff Win Rate': rates['Faceoff Win Rate'] * 100,
+            'Entry Rate': rates['Entry Rate'] * 100,
+            'Denial Rate': rates['Denial Rate'] * 100,
+        }
+
+def calculate_player_value_scores(store):
+    """Calculate player value scores for all players."""
+    return run_analyses(store, [PostgamePlayerAnalysis()])[0]
+
+def create_analysis():
+    """Postgame player analysis for this report's game date, for the combined runner."""
+    return PostgamePlayerAnalysis(game_date, game_date)
 
-def save_players_to_csv(player_stats, output_file_path):
-    """Save player statistics to CSV file."""
+def save_players_to_csv(player_stats, output_file_path, intervals=None):
+    """Save player statistics to CSV file, with bootstrap CI columns when intervals are given."""
     fieldnames = [
         'Player', 'Team', 'Total Score', 'Goals', 'Expected Goals', 'Expected Goals Weight',
         'Goals Above Expected', 'Penalties', 'Faceoff Wins', 'Faceoff Win Rate',
@@ -271,6 +323,8 @@ def save_players_to_csv(player_stats, output_file_path):
         'Carried Rate', 'Carried Rate Weight',  # Added rate metrics
         'Dumped Rate', 'Dumped Rate Weight'     # Added rate metrics
     ]
+    if intervals is not None:
+        fieldnames += interval_columns(INTERVAL_DECIMALS)
     
     with open(output_file_path, 'w', newline='') as file:
         writer = csv.DictWriter(file, fieldnames=fieldnames)
@@ -278,7 +332,7 @@ def save_players_to_csv(player_stats, output_file_path):
 
         sorted_players = sorted(player_stats.items(), key=lambda x: x[1]['total_score'], reverse=True)
         for player, stats in sorted_players:
-            writer.writerow({
+            row = {
                 'Player': player,
                 'Team': stats['team'],
                 'Total Score': round(stats['total_score'], 2),
@@ -303,11 +357,13 @@ def save_players_to_csv(player_stats, output_file_path):
                 'Carried Rate Weight': round(stats['carried_rate_weight'], 2),
                 'Dumped Rate': round(stats['dumped_rate'] * 100, 1),
                 'Dumped Rate Weight': round(stats['dumped_rate_weight'], 2)
-            })
+            }
+            if intervals is not None:
+                row.update(zip(interval_columns(INTERVAL_DECIMALS), interval_cells(intervals, player, INTERVAL_DECIMALS)))
+            writer.writerow(row)
     print(f"Player stats saved to {output_file_path}")
 
 if __name__ == "__main__":
-    game_date = '2019-02-17'
-    filter_data_by_date(original_file_path, filtered_file_path, game_date)
-    player_stats = calculate_player_value_scores(filtered_file_path)
-    save_players_to_csv(player_stats, output_file_path)
\ No newline at end of file
+    store = load_event_store(original_file_path).on(game_date)
+    (player_stats,), (intervals,) = run_with_intervals(store, [PostgamePlayerAnalysis()])
+    save_players_to_csv(player_stats, output_file_path, intervals)
\ No newline at end of file
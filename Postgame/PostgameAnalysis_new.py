@@ -1,11 +1,22 @@
 import csv
 from collections import defaultdict
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import interval_cells, interval_columns, ratio, run_with_intervals
+from engine import Analysis, MetricTensor, first_appearances, run_analyses
+from event_store import load_event_store
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Postgame/filtered_postgame_dataset.csv'
 output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Postgame/postgame.csv'
 
+# Define the game to report on
+game_date = '2019-02-17'
+
 # Define goal probability constants based on situation and location
 GOAL_PROBABILITIES = {
     'powerplay': {
@@ -22,119 +33,123 @@ GOAL_PROBABILITIES = {
     }
 }
 
-# Step 1: Filter the data by date
-def filter_data_by_date(file_path, filtered_path, start_date, end_date):
-    """Filter the CSV data by date range."""
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            game_date = row['game_date']
-            if start_date <= game_date <= end_date:
-                writer.writerow(row)
+# Situation categories, indexed by the engine's situation codes, and the order they are reported in
+CATEGORIES = ['even_strength', 'powerplay', 'shorthanded']
+REPORT_CATEGORIES = ['shorthanded', 'powerplay', 'even_strength']
+STAT_NAMES = ['goals', 'entries', 'successful_entries', 'denials', 'faceoff_wins', 'shots', 'shots_on_net',
+              'danger_zone_shots', 'dumped', 'carried', 'takeaways', 'blocked', 'total_entries',
+              'expected_goals', 'non_danger_shots']
+
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {
+    'Goals vs Expected': 2,
+    'Entry Rate': 2,
+    'Denial Rate': 2,
+    'Faceoff Win Rate': 2,
+}
 
-# Step 2: Calculate metrics for prescout analysis
-def calculate_prescout_metrics(file_path):
+# Goal probability per shot, indexed by [situation code, is danger zone]
+SHOT_PROBABILITIES = np.array([
+    [GOAL_PROBABILITIES[category]['non_danger'], GOAL_PROBABILITIES[category]['danger_zone']]
+    for category in CATEGORIES
+])
+
+# Step 1: Calculate metrics for prescout analysis
+class PostgameTeamAnalysis(Analysis):
+    """Team metrics per situation, accumulated one game at a time from the shared event stream."""
+
+    code_column = 'Team'
+    accumulators = ('counts', 'expected_goals')
+
+    def bind(self, store):
+        super().bind(store)
+        n_teams = len(store.names('Team'))
+        self.seen = np.zeros(n_teams, dtype=bool)
+        self.order = []
+        self.counts = MetricTensor(n_teams, STAT_NAMES, len(CATEGORIES))
+        self.expected_goals = np.zeros((n_teams, len(CATEGORIES)))
+
+    def count(self, batch, mask, *stats, team=None, score_state=None):
+        """Add one to each stat for every masked row, credited to the event team by default."""
+        team = batch['Team'] if team is None else team
+        score_state = batch.score_state if score_state is None else score_state
+        for stat in stats:
+            self.counts.add(stat, team[mask], batch.situation[mask], score_state[mask], batch.period_index[mask])
+
+    def consume(self, batch):
+        goals = batch.is_event('Goal')
+        entries = batch.is_event('Zone Entry')
+        dumped = entries & batch.has_detail('Detail 1', 'Dumped')
+        carried = entries & batch.has_detail('Detail 1', 'Carried')
+        denials = batch.has_detail('Detail 1', 'Lost')
+        faceoff_wins = batch.is_event('Faceoff Win')
+        shots = batch.is_event('Shot') & batch.has_coordinates
+        takeaways = batch.is_event('Takeaway')
+        blocked = batch.is_event('Shot') & batch.has_detail('Detail 2', 'Blocked')
+
+        # Teams are reported in the order they are first credited with anything
+        credited = goals | entries | denials | faceoff_wins | shots | takeaways
+        appearances = np.column_stack((batch['Team'], batch.opponent)).ravel()
+        self.order.extend(first_appearances(appearances[np.column_stack((credited, blocked)).ravel()], self.seen).tolist())
+
+        self.count(batch, goals, 'goals')
+        self.count(batch, entries, 'entries', 'total_entries')
+        self.count(batch, dumped, 'dumped', 'successful_entries')
+        self.count(batch, carried, 'carried', 'successful_entries')
+        self.count(batch, denials, 'denials')
+        self.count(batch, faceoff_wins, 'faceoff_wins')
+
+        # Shots and Danger Zone Shots with Expected Goals
+        danger_zone = batch.danger_zone
+        self.count(batch, shots, 'shots')
+        self.count(batch, shots & batch.has_detail('Detail 2', 'On Net'), 'shots_on_net')
+        self.count(batch, shots & danger_zone, 'danger_zone_shots')
+        self.count(batch, shots & ~danger_zone, 'non_danger_shots')
+        situation = batch.situation[shots]
+        np.add.at(self.expected_goals, (batch['Team'][shots], situation),
+                  SHOT_PROBABILITIES[situation, danger_zone[shots].astype(int)])
+
+        self.count(batch, takeaways, 'takeaways')
+
+        # Blocked shots count for the opponent, in the shooting team's situation but its own score state
+        self.count(batch, blocked, 'blocked', team=batch.opponent, score_state=batch.opponent_score_state)
+
+    def finalize(self):
+        team_stats = {}
+        for team in self.order:
+            categories = {}
+            for category in REPORT_CATEGORIES:
+                situation = CATEGORIES.index(category)
+                stats = dict(zip(STAT_NAMES, self.counts.collapse(self.counts.values[team, :, situation]).tolist()))
+                # Expected goals stay an integer 0 until the team records a shot
+                if stats['shots']:
+                    stats['expected_goals'] = self.expected_goals[team, situation].item()
+                categories[category] = stats
+            team_stats[self.store.decode('Team', team)] = categories
+        return team_stats
+
+    def window_metrics(self):
+        """Expected Goals and the INTERVAL_DECIMALS columns per situation for many sets of games at once (see Analysis)."""
+        faceoff_wins = self.counts['faceoff_wins']
+        return {
+            'Expected Goals': self.expected_goals,
+            'Goals vs Expected': self.counts['goals'] - self.expected_goals,
+            'Entry Rate': ratio(self.counts['successful_entries'], self.counts['total_entries']),
+            'Denial Rate': ratio(self.counts['denials'], self.counts['entries']),
+            # Shared out among the reported teams, as in save_prescout_metrics_to_csv()
+            'Faceoff Win Rate': ratio(faceoff_wins, faceoff_wins.sum(axis=-2, keepdims=True)),
+        }
+
+def calculate_prescout_metrics(store):
     """Calculate metrics for prescout analysis."""
-    team_stats = defaultdict(lambda: {
-        'shorthanded': {'goals': 0, 'entries': 0, 'successful_entries': 0, 'denials': 0, 
-                        'faceoff_wins': 0, 'shots': 0, 'shots_on_net': 0, 'danger_zone_shots': 0, 
-                        'dumped': 0, 'carried': 0, 'takeaways': 0, 'blocked': 0, 'total_entries': 0,
-                        'expected_goals': 0, 'non_danger_shots': 0},  # Added shots_on_net
-        'powerplay': {'goals': 0, 'entries': 0, 'successful_entries': 0, 'denials': 0, 
-                      'faceoff_wins': 0, 'shots': 0, 'shots_on_net': 0, 'danger_zone_shots': 0, 
-                      'dumped': 0, 'carried': 0, 'takeaways': 0, 'blocked': 0, 'total_entries': 0,
-                      'expected_goals': 0, 'non_danger_shots': 0},  # Added shots_on_net
-        'even_strength': {'goals': 0, 'entries': 0, 'successful_entries': 0, 'denials': 0, 
-                          'faceoff_wins': 0, 'shots': 0, 'shots_on_net': 0, 'danger_zone_shots': 0, 
-                          'dumped': 0, 'carried': 0, 'takeaways': 0, 'blocked': 0, 'total_entries': 0,
-                          'expected_goals': 0, 'non_danger_shots': 0}  # Added shots_on_net
-    })
-
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            home_team = row['Home Team']
-            away_team = row['Away Team']
-            event_team = row['Team']
-            event = row['Event']
-            detail = row['Detail 1']
-            detail_2 = row['Detail 2']  # For Blocked Shots and On Net
-            home_skaters = int(row['Home Team Skaters'])
-            away_skaters = int(row['Away Team Skaters'])
-            
-            # Determine category based on player counts with the condition for shorthanded
-            if home_skaters > away_skaters and away_skaters <= 4:
-                home_category = 'powerplay'
-                away_category = 'shorthanded'
-            elif away_skaters > home_skaters and home_skaters <= 4:
-                home_category = 'shorthanded'
-                away_category = 'powerplay'
-            else:
-                home_category = away_category = 'even_strength'
-            
-            category = home_category if event_team == home_team else away_category
-
-            # Goals
-            if event == 'Goal':
-                team_stats[event_team][category]['goals'] += 1
-
-            # Update logic for Dumped, Carried, Entries, and Successful Entries
-            if event == 'Zone Entry':
-                team_stats[event_team][category]['entries'] += 1
-                team_stats[event_team][category]['total_entries'] += 1
-
-                if detail == 'Dumped':
-                    team_stats[event_team][category]['dumped'] += 1
-                    team_stats[event_team][category]['successful_entries'] += 1
-                elif detail == 'Carried':
-                    team_stats[event_team][category]['carried'] += 1
-                    team_stats[event_team][category]['successful_entries'] += 1
-
-            # Update Denials based on event details
-            if detail == 'Lost':
-                team_stats[event_team][category]['denials'] += 1
-
-            # Faceoff Wins
-            if event == 'Faceoff Win':
-                team_stats[event_team][category]['faceoff_wins'] += 1
-
-            # Shots and Danger Zone Shots with Expected Goals
-            if event == 'Shot' and row['X Coordinate'] and row['Y Coordinate']:
-                x_coord = float(row['X Coordinate'])
-                y_coord = float(row['Y Coordinate'])
-                team_stats[event_team][category]['shots'] += 1
-                
-                # Add counter for shots on net
-                if detail_2 == 'On Net':
-                    team_stats[event_team][category]['shots_on_net'] += 1
+    return run_analyses(store, [PostgameTeamAnalysis()])[0]
 
-                # Determine if shot is from danger zone and calculate expected goals
-                is_danger_zone = (11 <= x_coord <= 19.8 or 180.2 <= x_coord <= 188.8) and (20.5 <= y_coord <= 64.4)
-                
-                if is_danger_zone:
-                    team_stats[event_team][category]['danger_zone_shots'] += 1
-                    team_stats[event_team][category]['expected_goals'] += GOAL_PROBABILITIES[category]['danger_zone']
-                else:
-                    team_stats[event_team][category]['non_danger_shots'] += 1
-                    team_stats[event_team][category]['expected_goals'] += GOAL_PROBABILITIES[category]['non_danger']
-
-            # Added logic for Takeaways
-            elif event == 'Takeaway':
-                team_stats[event_team][category]['takeaways'] += 1
-
-            # Blocked Shots - if Shot event and Detail 2 is 'Blocked', increment the opponent's blocked shots
-            if event == 'Shot' and detail_2 == 'Blocked':
-                if event_team == home_team:
-                    team_stats[away_team][category]['blocked'] += 1  # Opponent's blocked shot
-                else:
-                    team_stats[home_team][category]['blocked'] += 1  # Opponent's blocked shot
-
-    return team_stats
-
-def save_prescout_metrics_to_csv(team_stats, output_file):
-    """Save prescout metrics to a CSV file."""
+def create_analysis():
+    """Postgame team analysis for this report's game date, for the combined runner."""
+    return PostgameTeamAnalysis(game_date, game_date)
+
+def save_prescout_metrics_to_csv(team_stats, output_file, intervals=None):
+    """Save prescout metrics to a CSV file, with bootstrap CI columns when intervals are given."""
     with open(output_file, 'w', newline='') as file:
         headers = [
             'Team', 'Category', 'Goals', 'Expected Goals', 'Goals vs Expected', 
@@ -144,6 +159,8 @@ def save_prescout_metrics_to_csv(team_stats, output_file):
             'Danger Zone Shots', 'Non-Danger Shots', 'Shot Danger Rate',
             'Takeaways', 'Blocked', 'Shooting Percentage'
         ]
+        if intervals is not None:
+            headers += interval_columns(INTERVAL_DECIMALS)
         writer = csv.writer(file)
         writer.writerow(headers)
 
@@ -176,7 +193,7 @@ def save_prescout_metrics_to_csv(team_stats, output_file):
                 shooting_percentage = (goals / total_shots * 100) if total_shots > 0 else 0
                 goals_vs_expected = goals - stats['expected_goals']
 
-                writer.writerow([
+                row = [
                     team, category.capitalize(), goals, f"{stats['expected_goals']:.2f}", 
                     f"{goals_vs_expected:.2f}", entries, successful_entries, 
                     f"{entry_rate:.2f}", denials, f"{denial_rate:.2f}", total_entries, 
@@ -185,11 +202,12 @@ def save_prescout_metrics_to_csv(team_stats, output_file):
                     stats['shots_on_net'],  # Added shots on net to output
                     danger_shots, stats['non_danger_shots'], f"{shot_danger_rate:.2f}",
                     stats['takeaways'], stats['blocked'], f"{shooting_percentage:.2f}"
-                ])
+                ]
+                if intervals is not None:
+                    row += interval_cells(intervals, team, INTERVAL_DECIMALS, CATEGORIES.index(category))
+                writer.writerow(row)
 
 if __name__ == "__main__":
-    start_date = '2019-02-17'
-    end_date = '2019-02-17'
-    filter_data_by_date(original_file_path, filtered_file_path, start_date, end_date)
-    team_stats = calculate_prescout_metrics(filtered_file_path)
-    save_prescout_metrics_to_csv(team_stats, output_file_path)
\ No newline at end of file
+    store = load_event_store(original_file_path).on(game_date)
+    (team_stats,), (intervals,) = run_with_intervals(store, [PostgameTeamAnalysis()])
+    save_prescout_metrics_to_csv(team_stats, output_file_path, intervals)
\ No newline at end of file
@@ -1,12 +1,26 @@
 import csv
 from collections import defaultdict
 import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import interval_cells, interval_columns, ratio, run_with_intervals
+from engine import Analysis, MetricTensor, first_appearances, run_analyses
+from event_store import POWERPLAY, load_event_store
+from scoring import ScoreFeatures, weighted_sum
+from shot_model import calculate_expected_goals
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Powerplay/Powerplaytop10filtered.csv'
 output_file_path = '//Users/joshuaolin/Desktop/Calgary/NewDraft/Powerplay/Powerplaytop10analysis.csv'
 
+# Use the same date range as PrescoutAnalysis
+start_date = '2018-02-11'
+end_date = '2018-02-21'
+
 # Define goal probability constants
 GOAL_PROBABILITIES = {
     'danger_zone': 0.18,    # 18% chance of scoring from danger zone on powerplay
@@ -31,45 +45,7 @@ weights = {
     'Expected Goals': 5
 }
 
-def filter_data_by_date(file_path, filtered_path, start_date, end_date):
-    """Filter the dataset by a specified date range and save to a new CSV."""
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            game_date = row['game_date']
-            if start_date <= game_date <= end_date:
-                writer.writerow(row)
-
-def is_powerplay(row, event_team):
-    """Determine if the team is on powerplay."""
-    home_team = row['Home Team']
-    home_skaters = int(row['Home Team Skaters'])
-    away_skaters = int(row['Away Team Skaters'])
-    
-    if event_team == home_team:
-        return home_skaters > away_skaters and away_skaters <= 4
-    else:
-        return away_skaters > home_skaters and home_skaters <= 4
-
-def get_shot_details(x_coord, y_coord):
-    """Calculate if shot is from danger zone and determine expected goal value."""
-    if x_coord > 100:
-        x_coord = 200 - x_coord
-        y_coord = 85 - y_coord
-    
-    is_danger_zone = ((11 <= x_coord <= 19.8 or 180.2 <= x_coord <= 188.8) and 
-                    (20.5 <= y_coord <= 64.4))
-    
-    if is_danger_zone:
-        expected_goals = GOAL_PROBABILITIES['danger_zone']
-    else:
-        expected_goals = GOAL_PROBABILITIES['non_danger']
-        
-    return is_danger_zone, expected_goals
-
-def initialize_player_stats(team, opponent):
+def initialize_player_stats(team):
     """Initialize dictionary for player statistics."""
     return {
         'team': team,
@@ -91,86 +67,145 @@ def initialize_player_stats(team, opponent):
         'powerplay_time': 0
     }
 
-def calculate_powerplay_player_scores(file_path):
-    """Calculate player scores during powerplay situations."""
-    player_stats = {}
-
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        
-        for row in reader:
-            event_team = row['Team']
-            event = row['Event']
-            detail = row['Detail 1']
-            detail_2 = row['Detail 2']
-            player = row['Player']
-            player2 = row['Player 2']
-
-            # Only process powerplay situations
-            if not is_powerplay(row, event_team):
-                continue
-
-            # Initialize players if needed
-            for p in [player, player2]:
-                if p and p not in player_stats:
-                    opponent = row['Away Team'] if event_team == row['Home Team'] else row['Home Team']
-                    player_stats[p] = initialize_player_stats(
-                        event_team if p == player else opponent,
-                        opponent if p == player else event_team
-                    )
-
-            if player:
-                # Process shots
-                if event == 'Shot':
-                    player_stats[player]['total_shots'] += 1
-                    if detail_2 != 'Blocked':
-                        player_stats[player]['shots'] += 1
-                        player_stats[player]['total_score'] += weights['Shot']
-                        
-                        try:
-                            x_coord = float(row['X Coordinate'])
-                            y_coord = float(row['Y Coordinate'])
-                            is_danger_zone, expected_goals = get_shot_details(x_coord, y_coord)
-                            
-                            if is_danger_zone:
-                                player_stats[player]['danger_zone_shots'] += 1
-                                player_stats[player]['total_score'] += weights['Danger Zone Shot']
-                            else:
-                                player_stats[player]['non_danger_shots'] += 1
-                            
-                            player_stats[player]['expected_goals'] += expected_goals
-                            
-                        except (ValueError, TypeError):
-                            pass
-
-                # Process other events
-                if event == 'Goal':
-                    player_stats[player]['goals'] += 1
-                    player_stats[player]['total_score'] += weights['Goal']
-                elif event == 'Penalty Taken':
-                    player_stats[player]['penalties'] += 1
-                    player_stats[player]['total_score'] += weights['Penalty Taken']
-                elif event == 'Puck Recovery':
-                    player_stats[player]['total_score'] += weights['Puck Recovery']
-                elif event == 'Faceoff Win':
-                    player_stats[player]['faceoff_wins'] += 1
-                    player_stats[player]['total_score'] += weights['Faceoff Win']
-                    player_stats[player]['total_faceoffs'] += 1
-                    if player2:
-                        player_stats[player2]['total_faceoffs'] += 1
-
-                elif event == 'Zone Entry':
-                    player_stats[player]['total_entries'] += 1
-                    if detail in ['Carried', 'Dumped']:
-                        player_stats[player][detail.lower()] += 1
-                        player_stats[player]['total_score'] += weights[detail]
-                        player_stats[player]['successful_entries'] += 1
-
-                # Process denials
-                if (event == 'Dump In/Out' and detail == 'Lost' and player2) or \
-                   (event in ['Incomplete Play', 'Takeaway'] and 
-                    row['X Coordinate'] and 29 <= float(row['X Coordinate']) <= 207):
-                    player_stats[player]['denials'] += 1
+PLAYER_COUNTS = ['goals', 'penalties', 'faceoff_wins', 'total_faceoffs', 'carried', 'dumped', 'total_entries',
+                 'successful_entries', 'denials', 'shots', 'danger_zone_shots', 'total_shots', 'non_danger_shots']
+# Puck recoveries are only scored, not reported
+TRACKING_COUNTS = ['puck_recoveries']
+
+# Count behind each event weight, and the stat behind each rate weight
+SCORED_COUNTS = {
+    'Goal': 'goals',
+    'Penalty Taken': 'penalties',
+    'Puck Recovery': 'puck_recoveries',
+    'Faceoff Win': 'faceoff_wins',
+    'Carried': 'carried',
+    'Dumped': 'dumped',
+    'Shot': 'shots',
+    'Danger Zone Shot': 'danger_zone_shots',
+}
+SCORED_RATES = {
+    'Entry Rate': 'entry_rate',
+    'Denial Rate': 'denial_rate',
+    'Carried Rate': 'carried_rate',
+    'Dumped Rate': 'dumped_rate',
+    'Faceoff Win Rate': 'faceoff_win_rate',
+    'Expected Goals': 'expected_goals',
+}
+
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {
+    'Total Score': 2,
+    'Goals Above Expected': 2,
+    'Faceoff Win Rate': 1,
+    'Entry Rate': 1,
+    'Denial Rate': 1,
+}
+
+class PowerplayPlayerAnalysis(Analysis):
+    """Player scores during powerplay situations, accumulated one game at a time."""
+
+    code_column = 'Player'
+    accumulators = ('counts', 'expected_goals', 'powerplay_seconds')
+    first_seen = {'team': 'Team'}
+
+    def bind(self, store):
+        super().bind(store)
+        n_players = len(store.names('Player'))
+        self.seen = np.zeros(n_players, dtype=bool)
+        self.order = []
+        self.team = np.zeros(n_players, dtype=np.int32)
+        # Every event counted here is a powerplay event, so the tensor has a single situation
+        self.counts = MetricTensor(n_players, PLAYER_COUNTS + TRACKING_COUNTS, n_situations=1)
+        self.expected_goals = np.zeros(n_players)
+        self.powerplay_seconds = np.zeros(n_players, dtype=np.int64)
+
+    def count(self, batch, mask, metric, player=None):
+        """Add one to metric for every masked row, split by score state and period.
+
+        Rows are credited to Player unless another player column is given; that is Player 2,
+        on the other side, so its rows take the opponent's score state. The tensor's single
+        situation is the powerplay, so no situation is looked up: the event masks only pass
+        rows where the credited player's team is on the powerplay.
+        """
+        score_state = batch.score_state if player is None else batch.opponent_score_state
+        player = (batch['Player'] if player is None else player)[mask]
+        self.counts.add(metric, player, 0, score_state[mask], batch.period_index[mask])
+
+    def consume(self, batch):
+        player = batch['Player']
+        player2 = batch['Player 2']
+
+        # Only process powerplay situations
+        powerplay = batch.situation == POWERPLAY
+        # Draws lost on the powerplay are won by the shorthanded side, so Player 2 is the powerplay player
+        lost_faceoffs = batch.is_event('Faceoff Win') & (batch.opponent_situation == POWERPLAY) & (player2 > 0)
+
+        # Initialize players: Player belongs to the event team, Player 2 to the opponent
+        appearances = np.column_stack((player, player2)).ravel()
+        teams = np.column_stack((batch['Team'], batch.opponent)).ravel()
+        present = np.column_stack((powerplay, powerplay | lost_faceoffs)).ravel() & (appearances > 0)
+        new_players, first = first_appearances(appearances[present], self.seen, return_index=True)
+        self.order.extend(new_players.tolist())
+        self.team[new_players] = teams[present][first]
+
+        active = powerplay & (player > 0)
+
+        # Shifts are not tracked, so a player's powerplay time is their team's, over the games
+        # they recorded a powerplay event in
+        team_seconds = batch.strength_intervals.powerplay_seconds(len(self.store.names('Team')))
+        players, first = np.unique(player[active], return_index=True)
+        self.powerplay_seconds[players] += team_seconds[batch['Team'][active][first]]
+
+        # Process shots
+        shots = active & batch.is_event('Shot')
+        self.count(batch, shots, 'total_shots')
+        unblocked = shots & ~batch.has_detail('Detail 2', 'Blocked')
+        self.count(batch, unblocked, 'shots')
+
+        # Danger zone from the shared shot model; expected goals use the flat powerplay probabilities
+        located = unblocked & batch.has_coordinates
+        _, is_danger_zone = calculate_expected_goals(batch['X Coordinate'][located], batch['Y Coordinate'][located])
+        danger_zone = np.zeros(len(batch), dtype=bool)
+        danger_zone[located] = is_danger_zone
+
+        self.count(batch, danger_zone, 'danger_zone_shots')
+        self.count(batch, located & ~danger_zone, 'non_danger_shots')
+        np.add.at(self.expected_goals, player[located],
+                  np.where(is_danger_zone, GOAL_PROBABILITIES['danger_zone'], GOAL_PROBABILITIES['non_danger']))
+
+        # Process other events
+        self.count(batch, active & batch.is_event('Goal'), 'goals')
+        self.count(batch, active & batch.is_event('Penalty Taken'), 'penalties')
+        self.count(batch, active & batch.is_event('Puck Recovery'), 'puck_recoveries')
+
+        faceoffs = active & batch.is_event('Faceoff Win')
+        self.count(batch, faceoffs, 'faceoff_wins')
+        self.count(batch, faceoffs, 'total_faceoffs')
+        self.count(batch, lost_faceoffs, 'total_faceoffs', player=player2)
+
+        entries = active & batch.is_event('Zone Entry')
+        self.count(batch, entries, 'total_entries')
+        for entry_type in ['Carried', 'Dumped']:
+            successful = entries & batch.has_detail('Detail 1', entry_type)
+            self.count(batch, successful, entry_type.lower())
+            self.count(batch, successful, 'successful_entries')
+
+        # Process denials
+        turnovers = batch.is_event('Incomplete Play') | batch.is_event('Takeaway')
+        denials = active & ((batch.lost_dump & (player2 > 0)) | (turnovers & batch.neutral_zone))
+        self.count(batch, denials, 'denials')
+
+    def finalize(self):
+        player_stats = {}
+        for player in self.order:
+            stats = initialize_player_stats(self.team[player])
+            totals = self.counts.totals(player)
+            stats.update({metric: totals[metric] for metric in PLAYER_COUNTS})
+            stats['powerplay_time'] = self.powerplay_seconds[player].item() / 60
+            # Players without a scored shot keep an integer 0, as in the row-by-row version
+            if stats['danger_zone_shots'] + stats['non_danger_shots']:
+                stats['expected_goals'] = self.expected_goals[player].item()
+            player_stats[player] = stats
 
         # Calculate final rates and scores
         for stats in player_stats.values():
@@ -179,40 +214,76 @@ def calculate_powerplay_player_scores(file_path):
                 stats['denial_rate'] = stats['denials'] / stats['total_entries']
                 stats['carried_rate'] = stats['carried'] / stats['total_entries']
                 stats['dumped_rate'] = stats['dumped'] / stats['total_entries']
-                
-                # Add rate weights to total score
-                stats['total_score'] += (
-                    stats['entry_rate'] * weights['Entry Rate'] +
-                    stats['denial_rate'] * weights['Denial Rate'] +
-                    stats['carried_rate'] * weights['Carried Rate'] +
-                    stats['dumped_rate'] * weights['Dumped Rate']
-                )
             else:
                 stats['entry_rate'] = stats['denial_rate'] = 0
                 stats['carried_rate'] = stats['dumped_rate'] = 0
 
             if stats['total_faceoffs'] > 0:
                 stats['faceoff_win_rate'] = stats['faceoff_wins'] / stats['total_faceoffs']
-                stats['total_score'] += stats['faceoff_win_rate'] * weights['Faceoff Win Rate']
             else:
                 stats['faceoff_win_rate'] = 0
 
-            # Add expected goals to total score
-            stats['total_score'] += stats['expected_goals'] * weights['Expected Goals']
             stats['goals_above_expected'] = stats['goals'] - stats['expected_goals']
+            stats['team'] = self.store.decode('Team', stats['team'])
+
+        # Score every player at once from the raw counts and rates; kept for re-scoring
+        codes = np.array(self.order, dtype=np.int64)
+        self.features = ScoreFeatures(
+            [self.store.decode('Player', player) for player in player_stats],
+            {name: self.counts[metric][codes] for name, metric in SCORED_COUNTS.items()},
+            {name: [stats[rate] for stats in player_stats.values()] for name, rate in SCORED_RATES.items()},
+            [stats['total_entries'] > 0 or stats['total_faceoffs'] > 0 or
+             stats['danger_zone_shots'] + stats['non_danger_shots'] > 0 for stats in player_stats.values()],
+        )
+        for stats, score in zip(player_stats.values(), self.features.scores(weights)):
+            stats['total_score'] = score
+
+        # Key the results by player name
+        return {self.store.decode('Player', player): stats for player, stats in player_stats.items()}
 
-    return player_stats
+    def window_metrics(self):
+        """Expected Goals and the INTERVAL_DECIMALS columns for many sets of games at once (see Analysis)."""
+        totals = {metric: self.counts[metric][..., 0] for metric in PLAYER_COUNTS + TRACKING_COUNTS}
+        rates = {
+            'Entry Rate': ratio(totals['successful_entries'], totals['total_entries']),
+            'Denial Rate': ratio(totals['denials'], totals['total_entries']),
+            'Carried Rate': ratio(totals['carried'], totals['total_entries']),
+            'Dumped Rate': ratio(totals['dumped'], totals['total_entries']),
+            'Faceoff Win Rate': ratio(totals['faceoff_wins'], totals['total_faceoffs']),
+            'Expected Goals': self.expected_goals,
+        }
+        # Undefined rates score 0, as in finalize()
+        scored_rates = {name: np.nan_to_num(rate) for name, rate in rates.items()}
+        counts = {name: totals[metric] for name, metric in SCORED_COUNTS.items()}
+        return {
+            'Total Score': weighted_sum({**counts, **scored_rates}, weights),
+            'Expected Goals': self.expected_goals,
+            'Goals Above Expected': totals['goals'] - self.expected_goals,
+            'Faceoff Win Rate': rates['Faceoff Win Rate'] * 100,
+            'Entry Rate': rates['Entry Rate'] * 100,
+            'Denial Rate': rates['Denial Rate'] * 100,
+        }
 
-def save_powerplay_players_to_csv(player_stats, output_file_path):
-    """Save powerplay player statistics to CSV file."""
+def calculate_powerplay_player_scores(store):
+    """Calculate player scores during powerplay situations."""
+    return run_analyses(store, [PowerplayPlayerAnalysis()])[0]
+
+def create_analysis():
+    """Powerplay player analysis for this report's date range, for the combined runner."""
+    return PowerplayPlayerAnalysis(start_date, end_date)
+
+def save_powerplay_players_to_csv(player_stats, output_file_path, intervals=None):
+    """Save powerplay player statistics to CSV file, with bootstrap CI columns when intervals are given."""
     fieldnames = [
-        'Player', 'Team', 'Total Score', 'Goals', 'Expected Goals', 'Goals Above Expected',
+        'Player', 'Team', 'PP Minutes', 'Total Score', 'Goals', 'Expected Goals', 'Goals Above Expected',
         'Penalties', 'Faceoff Wins', 'Faceoff Win Rate',
         'Carried', 'Dumped', 'Total Entries', 'Successful Entries',
         'Denials', 'Entry Rate', 'Denial Rate',
         'Shots', 'Danger Zone Shots', 'Non-Danger Shots', 'Shot Accuracy',
         'Carried Rate', 'Dumped Rate'
     ]
+    if intervals is not None:
+        fieldnames += interval_columns(INTERVAL_DECIMALS)
     
     with open(output_file_path, 'w', newline='') as file:
         writer = csv.DictWriter(file, fieldnames=fieldnames)
@@ -220,9 +291,10 @@ def save_powerplay_players_to_csv(player_stats, output_file_path):
 
         sorted_players = sorted(player_stats.items(), key=lambda x: x[1]['total_score'], reverse=True)
         for player, stats in sorted_players:
-            writer.writerow({
+            row = {
                 'Player': player,
                 'Team': stats['team'],
+                'PP Minutes': round(stats['powerplay_time'], 1),
                 'Total Score': round(stats['total_score'], 2),
                 'Goals': stats['goals'],
                 'Expected Goals': round(stats['expected_goals'], 2),
@@ -243,17 +315,16 @@ def save_powerplay_players_to_csv(player_stats, output_file_path):
                 'Shot Accuracy': round((stats['shots'] / stats['total_shots'] * 100 if stats['total_shots'] > 0 else 0), 1),
                 'Carried Rate': round(stats['carried_rate'] * 100, 1),
                 'Dumped Rate': round(stats['dumped_rate'] * 100, 1)
-            })
+            }
+            if intervals is not None:
+                row.update(zip(interval_columns(INTERVAL_DECIMALS), interval_cells(intervals, player, INTERVAL_DECIMALS)))
+            writer.writerow(row)
     print(f"Powerplay player stats saved to {output_file_path}")
 
 if __name__ == "__main__":
-    # Use the same date range as PrescoutAnalysis
-    start_date = '2018-02-11'
-    end_date = '2018-02-21'
-    
-    # Filter data for the date range
-    filter_data_by_date(original_file_path, filtered_file_path, start_date, end_date)
+    # Load the shared event store for the date range
+    store = load_event_store(original_file_path).between(start_date, end_date)
     
-    # Calculate and save player value scores
-    player_stats = calculate_powerplay_player_scores(filtered_file_path)
-    save_powerplay_players_to_csv(player_stats, output_file_path)
\ No newline at end of file
+    # Calculate and save player value scores, with bootstrap intervals over the games
+    (player_stats,), (intervals,) = run_with_intervals(store, [PowerplayPlayerAnalysis()])
+    save_powerplay_players_to_csv(player_stats, output_file_path, intervals)
\ No newline at end of file
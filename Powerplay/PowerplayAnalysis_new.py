@@ -1,11 +1,24 @@
 import csv
-from collections import defaultdict
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import interval_cells, interval_columns, ratio, run_with_intervals
+from engine import Analysis, first_appearances, run_analyses
+from event_store import POWERPLAY, load_event_store
+from possessions import ENTRY_SHOT_WINDOW
+from scoring import ScoreFeatures, weighted_sum
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Powerplay/Powerplanalysisfiltered.csv'
 output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Powerplay/Powerplanalysis.csv'
 
+# Define date range
+start_date = '2018-02-11'
+end_date = '2018-02-21'
+
 # Define goal probability constants
 GOAL_PROBABILITIES = {
     'danger_zone': 0.18,    # 18% chance of scoring from danger zone on powerplay
@@ -30,17 +43,6 @@ weights = {
     'Takeaways': 2
 }
 
-def filter_data_by_date(file_path, filtered_path, start_date, end_date):
-    """Filter the dataset by date range."""
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            game_date = row['game_date']
-            if start_date <= game_date <= end_date:
-                writer.writerow(row)
-
 def initialize_team_stats():
     """Initialize dictionary for team statistics."""
     return {
@@ -63,177 +65,247 @@ def initialize_team_stats():
         'expected_goals': 0,
         'takeaways': 0,
         'blocked': 0,
-        'total_entries': 0
+        'total_entries': 0,
+        'carried_entry_shots': 0,
+        'dumped_entry_shots': 0
     }
 
-def get_shot_details(x_coord, y_coord):
-    """Calculate shot zone and expected goals."""
-    is_danger_zone = ((11 <= x_coord <= 19.8 or 180.2 <= x_coord <= 188.8) and 
-                     (20.5 <= y_coord <= 64.4))
-    
-    if is_danger_zone:
-        expected_goals = GOAL_PROBABILITIES['danger_zone']
-    else:
-        expected_goals = GOAL_PROBABILITIES['non_danger']
-        
-    return is_danger_zone, expected_goals
-
-def calculate_powerplay_analysis(file_path):
+TEAM_COUNTS = [stat for stat in initialize_team_stats() if stat != 'total_score']
+
+# Count behind each event weight, and the stat behind each rate weight
+SCORED_COUNTS = {
+    'Goal': 'total_goals',
+    'Carried': 'total_carried',
+    'Dumped': 'total_dumped',
+    'Faceoff Win': 'faceoff_wins',
+    'Danger Zone Shot': 'danger_zone_shots',
+    'Blocks': 'blocked',
+    'Takeaways': 'takeaways',
+}
+SCORED_RATES = {
+    'Carried Rate': 'carried_rate',
+    'Dumped Rate': 'dumped_rate',
+    'Faceoff Win Rate': 'faceoff_win_rate',
+    'PP Success Rate': 'pp_success_rate',
+    'Entry Rate': 'entry_rate',
+    'Denial Rate': 'denial_rate',
+    'Expected Goals': 'expected_goals',
+}
+
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {
+    'Total Score': 2,
+    'PP Success Rate': 2,
+    'PP Goals Per Minute': 3,
+    'Goals Above Expected': 2,
+    'Entry Rate': 2,
+    'Denial Rate': 2,
+    'Faceoff Win Rate': 2,
+}
+
+class PowerplayTeamAnalysis(Analysis):
+    """Team powerplay analysis, accumulated one game at a time from the shared event stream."""
+
+    code_column = 'Team'
+    accumulators = ('counts', 'expected_goals', 'pp_opportunities', 'pp_seconds')
+
+    def bind(self, store):
+        super().bind(store)
+        n_teams = len(store.names('Team'))
+        self.seen = np.zeros(n_teams, dtype=bool)
+        self.order = []
+        self.counts = np.zeros((n_teams, len(TEAM_COUNTS)), dtype=np.int64)
+        self.expected_goals = np.zeros(n_teams)
+        self.pp_opportunities = np.zeros(n_teams, dtype=np.int64)
+        self.pp_seconds = np.zeros(n_teams, dtype=np.int64)
+
+    def count(self, team, mask, *stats):
+        """Add one to each stat for every masked row."""
+        for stat in stats:
+            np.add.at(self.counts[:, TEAM_COUNTS.index(stat)], team[mask], 1)
+
+    def consume(self, batch):
+        team = batch['Team']
+
+        # Powerplay events are recorded by the team with the extra skater
+        powerplay = (batch.situation == POWERPLAY) & (batch.is_home | (team == batch['Away Team']))
+
+        # Powerplay opportunities and time come from the game's strength intervals
+        strength = batch.strength_intervals
+        self.pp_opportunities += strength.powerplay_opportunities(len(self.pp_opportunities))
+        self.pp_seconds += strength.powerplay_seconds(len(self.pp_seconds))
+
+        faceoff_wins = powerplay & batch.is_event('Faceoff Win')
+        # Draws the powerplay team lost were won by the shorthanded side, so they are read from the opponent
+        opposing_faceoffs = (batch.is_event('Faceoff Win') & (batch.opponent_situation == POWERPLAY) &
+                             (batch['Player 2'] > 0))
+        blocked = powerplay & batch.is_event('Shot') & batch.has_detail('Detail 2', 'Blocked')
+
+        # Teams are reported in the order they are first credited with anything
+        appearances = np.column_stack((team, batch.opponent)).ravel()
+        credited = np.column_stack((powerplay, opposing_faceoffs | blocked)).ravel()
+        self.order.extend(first_appearances(appearances[credited], self.seen).tolist())
+
+        self.count(team, powerplay, 'powerplay_count', 'games_played')
+
+        # Process events
+        self.count(team, powerplay & batch.is_event('Goal'), 'total_goals')
+
+        entries = powerplay & batch.is_event('Zone Entry')
+        self.count(team, entries, 'entries', 'total_zone_entries', 'total_entries')
+        self.count(team, entries & batch.has_detail('Detail 1', 'Carried'), 'total_carried', 'successful_entries')
+        self.count(team, entries & batch.has_detail('Detail 1', 'Dumped'), 'total_dumped', 'successful_entries')
+
+        # Shots and goals off each entry, later in the same possession
+        entry_shots = batch.possessions.count_within(entries, batch.shot_attempts, ENTRY_SHOT_WINDOW)
+        for entry_type in ['Carried', 'Dumped']:
+            typed = entries & batch.has_detail('Detail 1', entry_type)
+            stat = TEAM_COUNTS.index(f"{entry_type.lower()}_entry_shots")
+            np.add.at(self.counts[:, stat], team[typed], entry_shots[typed])
+
+        self.count(team, faceoff_wins, 'faceoff_wins', 'total_faceoffs')
+        self.count(batch.opponent, opposing_faceoffs, 'total_faceoffs')
+
+        self.count(team, powerplay & batch.is_event('Takeaway'), 'takeaways')
+
+        # Process blocked shots
+        self.count(batch.opponent, blocked, 'blocked')
+
+        # Process shots and expected goals
+        shots = powerplay & batch.is_event('Shot') & batch.has_coordinates
+        danger_zone = batch.danger_zone
+        self.count(team, shots, 'shots')
+        self.count(team, shots & batch.has_detail('Detail 2', 'On Net'), 'shots_on_net')
+        np.add.at(self.expected_goals, team[shots],
+                  np.where(danger_zone[shots], GOAL_PROBABILITIES['danger_zone'], GOAL_PROBABILITIES['non_danger']))
+        self.count(team, shots & danger_zone, 'danger_zone_shots')
+        self.count(team, shots & ~danger_zone, 'non_danger_shots')
+
+        # Process denials
+        self.count(team, powerplay & batch.has_detail('Detail 1', 'Lost'), 'denials')
+
+    def finalize(self):
+        team_stats = {}
+        for team in self.order:
+            stats = initialize_team_stats()
+            stats.update(zip(TEAM_COUNTS, self.counts[team].tolist()))
+            # Expected goals stay an integer 0 until the team records a shot
+            if stats['shots']:
+                stats['expected_goals'] = self.expected_goals[team].item()
+            team_stats[team] = stats
+
+        # Calculate final rates and scores
+        for team, stats in team_stats.items():
+            # Zone entry rates
+            if stats['total_zone_entries'] > 0:
+                stats['carried_rate'] = stats['total_carried'] / stats['total_zone_entries']
+                stats['dumped_rate'] = stats['total_dumped'] / stats['total_zone_entries']
+                stats['carried_rate_weight'] = stats['carried_rate'] * weights['Carried Rate']
+                stats['dumped_rate_weight'] = stats['dumped_rate'] * weights['Dumped Rate']
+            else:
+                stats['carried_rate'] = stats['dumped_rate'] = 0
+                stats['carried_rate_weight'] = stats['dumped_rate_weight'] = 0
+
+            # Shots per carried and dumped entry
+            stats['shots_per_carried_entry'] = (stats['carried_entry_shots'] / stats['total_carried']
+                                                if stats['total_carried'] > 0 else 0)
+            stats['shots_per_dumped_entry'] = (stats['dumped_entry_shots'] / stats['total_dumped']
+                                               if stats['total_dumped'] > 0 else 0)
+
+            # Faceoff rates
+            if stats['total_faceoffs'] > 0:
+                stats['faceoff_win_rate'] = stats['faceoff_wins'] / stats['total_faceoffs']
+            else:
+                stats['faceoff_win_rate'] = 0
+
+            # Powerplay success rate, per opportunity and per minute on the powerplay
+            stats['pp_opportunities'] = self.pp_opportunities[team].item()
+            stats['pp_minutes'] = self.pp_seconds[team].item() / 60
+            if stats['pp_opportunities'] > 0:
+                stats['pp_success_rate'] = stats['total_goals'] / stats['pp_opportunities']
+            else:
+                stats['pp_success_rate'] = 0
+            if stats['pp_minutes'] > 0:
+                stats['pp_goals_per_minute'] = stats['total_goals'] / stats['pp_minutes']
+            else:
+                stats['pp_goals_per_minute'] = 0
+
+            # Entry and denial rates
+            if stats['total_entries'] > 0:
+                stats['entry_rate'] = stats['successful_entries'] / stats['total_entries']
+                stats['denial_rate'] = stats['denials'] / stats['entries'] if stats['entries'] > 0 else 0
+            else:
+                stats['entry_rate'] = stats['denial_rate'] = 0
+
+            # Expected goals calculations
+            stats['expected_goals_weight'] = stats['expected_goals'] * weights['Expected Goals']
+            stats['goals_above_expected'] = stats['total_goals'] - stats['expected_goals']
+
+        # Score every team at once from the raw counts and rates; kept for re-scoring
+        codes = np.array(self.order, dtype=np.int64)
+        self.features = ScoreFeatures(
+            [self.store.decode('Team', team) for team in team_stats],
+            {name: self.counts[codes, TEAM_COUNTS.index(stat)] for name, stat in SCORED_COUNTS.items()},
+            {name: [stats[rate] for stats in team_stats.values()] for name, rate in SCORED_RATES.items()},
+            [stats['total_zone_entries'] > 0 or stats['total_faceoffs'] > 0 or stats['pp_opportunities'] > 0 or
+             stats['total_entries'] > 0 or stats['shots'] > 0 for stats in team_stats.values()],
+        )
+        for stats, score in zip(team_stats.values(), self.features.scores(weights)):
+            stats['total_score'] = score
+
+        ranked = sorted(team_stats.items(), key=lambda x: x[1]['total_score'], reverse=True)
+        return [(self.store.decode('Team', team), stats) for team, stats in ranked]
+
+    def window_metrics(self):
+        """Expected Goals and the INTERVAL_DECIMALS columns for many sets of games at once (see Analysis)."""
+        totals = {stat: self.counts[..., TEAM_COUNTS.index(stat)] for stat in TEAM_COUNTS}
+        rates = {
+            'Carried Rate': ratio(totals['total_carried'], totals['total_zone_entries']),
+            'Dumped Rate': ratio(totals['total_dumped'], totals['total_zone_entries']),
+            'Faceoff Win Rate': ratio(totals['faceoff_wins'], totals['total_faceoffs']),
+            'PP Success Rate': ratio(totals['total_goals'], self.pp_opportunities),
+            'Entry Rate': ratio(totals['successful_entries'], totals['total_entries']),
+            'Denial Rate': ratio(totals['denials'], totals['entries']),
+            'Expected Goals': self.expected_goals,
+        }
+        # Undefined rates score 0, as in finalize()
+        scored_rates = {name: np.nan_to_num(rate) for name, rate in rates.items()}
+        counts = {name: totals[stat] for name, stat in SCORED_COUNTS.items()}
+        return {
+            'Total Score': weighted_sum({**counts, **scored_rates}, weights),
+            'PP Success Rate': rates['PP Success Rate'],
+            'PP Goals Per Minute': ratio(totals['total_goals'], self.pp_seconds / 60),
+            'Expected Goals': self.expected_goals,
+            'Goals Above Expected': totals['total_goals'] - self.expected_goals,
+            'Entry Rate': rates['Entry Rate'],
+            'Denial Rate': rates['Denial Rate'],
+            'Faceoff Win Rate': rates['Faceoff Win Rate'],
+        }
+
+def calculate_powerplay_analysis(store):
     """Calculate powerplay analysis for all teams."""
-    team_stats = defaultdict(initialize_team_stats)
-    pp_opportunities = defaultdict(set)
-    
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        current_game = None
-        
-        for row in reader:
-            game_date = row['game_date']
-            home_team = row['Home Team']
-            away_team = row['Away Team']
-            event = row['Event']
-            detail = row['Detail 1']
-            detail_2 = row['Detail 2']
-            team = row['Team']
-            player2 = row['Player 2']
-            home_skaters = int(row['Home Team Skaters'])
-            away_skaters = int(row['Away Team Skaters'])
-
-            game_id = f"{game_date}_{home_team}_{away_team}"
-            if game_id != current_game:
-                current_game = game_id
-
-            # Determine powerplay situation
-            is_powerplay = False
-            if team == home_team and home_skaters > away_skaters and away_skaters < 5:
-                is_powerplay = True
-                pp_opportunities[home_team].add(game_id)
-            elif team == away_team and away_skaters > home_skaters and home_skaters < 5:
-                is_powerplay = True
-                pp_opportunities[away_team].add(game_id)
-
-            if not is_powerplay:
-                continue
-
-            team_stats[team]['powerplay_count'] += 1
-            team_stats[team]['games_played'] += 1
-
-            # Process events
-            if event == 'Goal':
-                team_stats[team]['total_goals'] += 1
-                team_stats[team]['total_score'] += weights['Goal']
-                
-            elif event == 'Zone Entry':
-                team_stats[team]['entries'] += 1
-                team_stats[team]['total_zone_entries'] += 1
-                team_stats[team]['total_entries'] += 1
-
-                if detail == 'Carried':
-                    team_stats[team]['total_carried'] += 1
-                    team_stats[team]['successful_entries'] += 1
-                    team_stats[team]['total_score'] += weights['Carried']
-                elif detail == 'Dumped':
-                    team_stats[team]['total_dumped'] += 1
-                    team_stats[team]['successful_entries'] += 1
-                    team_stats[team]['total_score'] += weights['Dumped']
-                    
-            elif event == 'Faceoff Win':
-                team_stats[team]['faceoff_wins'] += 1
-                team_stats[team]['total_score'] += weights['Faceoff Win']
-                team_stats[team]['total_faceoffs'] += 1
-                if player2:
-                    opposing_team = away_team if team == home_team else home_team
-                    team_stats[opposing_team]['total_faceoffs'] += 1
-            
-            elif event == 'Takeaway':
-                team_stats[team]['takeaways'] += 1
-                team_stats[team]['total_score'] += weights['Takeaways']
-
-            # Process blocked shots
-            if event == 'Shot' and detail_2 == 'Blocked':
-                blocking_team = away_team if team == home_team else home_team
-                team_stats[blocking_team]['blocked'] += 1
-                team_stats[blocking_team]['total_score'] += weights['Blocks']
-            
-            # Process shots and expected goals
-            if event == 'Shot' and row['X Coordinate'] and row['Y Coordinate']:
-                x_coord = float(row['X Coordinate'])
-                y_coord = float(row['Y Coordinate'])
-                team_stats[team]['shots'] += 1
-                
-                # Add counter for shots on net
-                if detail_2 == 'On Net':
-                    team_stats[team]['shots_on_net'] += 1
-
-                is_danger_zone, xg = get_shot_details(x_coord, y_coord)
-                team_stats[team]['expected_goals'] += xg
-                
-                if is_danger_zone:
-                    team_stats[team]['danger_zone_shots'] += 1
-                    team_stats[team]['total_score'] += weights['Danger Zone Shot']
-                else:
-                    team_stats[team]['non_danger_shots'] += 1
-
-            # Process denials
-            if detail == 'Lost':
-                team_stats[team]['denials'] += 1
-
-    # Calculate final rates and scores
-    for team, stats in team_stats.items():
-        # Zone entry rates
-        if stats['total_zone_entries'] > 0:
-            stats['carried_rate'] = stats['total_carried'] / stats['total_zone_entries']
-            stats['dumped_rate'] = stats['total_dumped'] / stats['total_zone_entries']
-            stats['carried_rate_weight'] = stats['carried_rate'] * weights['Carried Rate']
-            stats['dumped_rate_weight'] = stats['dumped_rate'] * weights['Dumped Rate']
-            stats['total_score'] += stats['carried_rate_weight'] + stats['dumped_rate_weight']
-        else:
-            stats['carried_rate'] = stats['dumped_rate'] = 0
-            stats['carried_rate_weight'] = stats['dumped_rate_weight'] = 0
-
-        # Faceoff rates
-        if stats['total_faceoffs'] > 0:
-            stats['faceoff_win_rate'] = stats['faceoff_wins'] / stats['total_faceoffs']
-            stats['total_score'] += stats['faceoff_win_rate'] * weights['Faceoff Win Rate']
-        else:
-            stats['faceoff_win_rate'] = 0
-
-        # Powerplay success rate
-        stats['pp_opportunities'] = len(pp_opportunities[team])
-        if stats['pp_opportunities'] > 0:
-            stats['pp_success_rate'] = stats['total_goals'] / stats['pp_opportunities']
-            stats['total_score'] += stats['pp_success_rate'] * weights['PP Success Rate']
-        else:
-            stats['pp_success_rate'] = 0
-
-        # Entry and denial rates
-        if stats['total_entries'] > 0:
-            stats['entry_rate'] = stats['successful_entries'] / stats['total_entries']
-            stats['denial_rate'] = stats['denials'] / stats['entries'] if stats['entries'] > 0 else 0
-            stats['total_score'] += (stats['entry_rate'] * weights['Entry Rate'] +
-                                   stats['denial_rate'] * weights['Denial Rate'])
-        else:
-            stats['entry_rate'] = stats['denial_rate'] = 0
-
-        # Expected goals calculations
-        stats['expected_goals_weight'] = stats['expected_goals'] * weights['Expected Goals']
-        stats['total_score'] += stats['expected_goals_weight']
-        stats['goals_above_expected'] = stats['total_goals'] - stats['expected_goals']
-
-    return sorted(team_stats.items(), key=lambda x: x[1]['total_score'], reverse=True)
-
-def save_top_teams_to_csv(top_teams, output_file_path):
-    """Save team analysis results to CSV."""
+    return run_analyses(store, [PowerplayTeamAnalysis()])[0]
+
+def create_analysis():
+    """Powerplay team analysis for this report's date range, for the combined runner."""
+    return PowerplayTeamAnalysis(start_date, end_date)
+
+def save_top_teams_to_csv(top_teams, output_file_path, intervals=None):
+    """Save team analysis results to CSV, with bootstrap CI columns when intervals are given."""
     fieldnames = [
         'Team', 'Total Score', 'Total Goals', 'PP Opportunities', 'PP Success Rate',
+        'PP Minutes', 'PP Goals Per Minute',
         'Expected Goals', 'Expected Goals Weight', 'Goals Above Expected',
         'Total Carried', 'Total Dumped', 'Total Zone Entries', 'Successful Entries',
         'Entry Rate', 'Denials', 'Denial Rate', 
         'Faceoff Wins', 'Total Faceoffs', 'Faceoff Win Rate',
         'Shots', 'Shots on Net', 'Danger Zone Shots', 'Non-Danger Shots', 'Shot Danger Rate',  # Added Shots on Net
         'Takeaways', 'Blocked', 'Games Played', 'Powerplay Count',
-        'Carried Rate', 'Dumped Rate', 'Carried Rate Weight', 'Dumped Rate Weight'
+        'Carried Rate', 'Dumped Rate', 'Carried Rate Weight', 'Dumped Rate Weight',
+        'Carried Entry Shots', 'Shots Per Carried Entry', 'Dumped Entry Shots', 'Shots Per Dumped Entry'
     ]
+    if intervals is not None:
+        fieldnames += interval_columns(INTERVAL_DECIMALS)
     
     with open(output_file_path, 'w', newline='') as file:
         writer = csv.writer(file)
@@ -241,12 +313,14 @@ def save_top_teams_to_csv(top_teams, output_file_path):
 
         for team, stats in top_teams:
             shot_danger_rate = (stats['danger_zone_shots'] / stats['shots']) if stats['shots'] > 0 else 0
-            writer.writerow([
+            row = [
                 team,
                 round(stats['total_score'], 2),
                 stats['total_goals'],
                 stats['pp_opportunities'],
                 f"{stats['pp_success_rate']:.2f}",
+                round(stats['pp_minutes'], 1),
+                f"{stats['pp_goals_per_minute']:.3f}",
                 round(stats['expected_goals'], 2),
                 round(stats['expected_goals_weight'], 2),
                 round(stats['goals_above_expected'], 2),
@@ -272,14 +346,18 @@ def save_top_teams_to_csv(top_teams, output_file_path):
                 f"{stats['carried_rate']:.2f}",
                 f"{stats['dumped_rate']:.2f}",
                 f"{stats['carried_rate_weight']:.2f}",
-                f"{stats['dumped_rate_weight']:.2f}"
-            ])
+                f"{stats['dumped_rate_weight']:.2f}",
+                stats['carried_entry_shots'],
+                f"{stats['shots_per_carried_entry']:.2f}",
+                stats['dumped_entry_shots'],
+                f"{stats['shots_per_dumped_entry']:.2f}"
+            ]
+            if intervals is not None:
+                row += interval_cells(intervals, team, INTERVAL_DECIMALS)
+            writer.writerow(row)
     print(f"Top powerplay teams saved to {output_file_path}")
 
 if __name__ == "__main__":
-    start_date = '2018-02-11'
-    end_date = '2018-02-21'
-    
-    filter_data_by_date(original_file_path, filtered_file_path, start_date, end_date)
-    best_teams_analysis = calculate_powerplay_analysis(filtered_file_path)
-    save_top_teams_to_csv(best_teams_analysis, output_file_path)
\ No newline at end of file
+    store = load_event_store(original_file_path).between(start_date, end_date)
+    (best_teams_analysis,), (intervals,) = run_with_intervals(store, [PowerplayTeamAnalysis()])
+    save_top_teams_to_csv(best_teams_analysis, output_file_path, intervals)
\ No newline at end of file
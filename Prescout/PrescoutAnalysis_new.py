@@ -1,11 +1,25 @@
 
 import csv
-from collections import defaultdict
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Shared'))
+from bootstrap import interval_cells, interval_columns, ratio, run_with_intervals
+from engine import Analysis, MetricTensor, first_appearances, run_analyses
+from event_store import POWERPLAY, load_event_store
+from faceoffs import load_faceoff_matrix, rating_rows
+from scoring import ScoreFeatures, weighted_sum
 
 # Define file paths
 original_file_path = '/Users/joshuaolin/Desktop/Calgary/olympic_womens_dataset.csv'
-filtered_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Prescout/Prescoutfiltered.csv'
 output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Prescout/prescout_analysis.csv'
+faceoff_output_file_path = '/Users/joshuaolin/Desktop/Calgary/NewDraft/Prescout/prescout_faceoffs.csv'
+
+# Define date range
+start_date = '2018-02-11'
+end_date = '2018-02-21'
 
 # Define goal probability constants
 GOAL_PROBABILITIES = {
@@ -41,16 +55,6 @@ weights = {
     'Takeaways': 2
 }
 
-def filter_data_by_date(file_path, filtered_path, start_date, end_date):
-    with open(file_path, 'r') as infile, open(filtered_path, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        for row in reader:
-            game_date = row['game_date']
-            if start_date <= game_date <= end_date:
-                writer.writerow(row)
-
 def initialize_category_stats():
     """Initialize statistics for a single category."""
     return {
@@ -75,157 +79,214 @@ def initialize_category_stats():
         'powerplay_count': 0
     }
 
-def determine_game_situation(row, event_team):
-    """Determine if the team is on powerplay, shorthanded, or even strength."""
-    home_team = row['Home Team']
-    home_skaters = int(row['Home Team Skaters'])
-    away_skaters = int(row['Away Team Skaters'])
-    
-    if event_team == home_team:
-        if home_skaters > away_skaters and away_skaters <= 4:
-            return 'powerplay'
-        elif home_skaters < away_skaters and home_skaters <= 4:
-            return 'shorthanded'
-    else:
-        if away_skaters > home_skaters and home_skaters <= 4:
-            return 'powerplay'
-        elif away_skaters < home_skaters and away_skaters <= 4:
-            return 'shorthanded'
-    return 'even_strength'
-
-def calculate_powerplay_analysis(file_path):
-    team_stats = defaultdict(lambda: {
-        'shorthanded': initialize_category_stats(),
-        'powerplay': initialize_category_stats(),
-        'even_strength': initialize_category_stats()
-    })
-    
-    pp_opportunities = defaultdict(set)
-    
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        current_game = None
-        
-        for row in reader:
-            game_date = row['game_date']
-            home_team = row['Home Team']
-            away_team = row['Away Team']
-            event = row['Event']
-            detail = row['Detail 1']
-            detail_2 = row['Detail 2']
-            team = row['Team']
-            player2 = row['Player 2']
-
-            game_id = f"{game_date}_{home_team}_{away_team}"
-            if game_id != current_game:
-                current_game = game_id
-
-            situation = determine_game_situation(row, team)
-            if situation == 'powerplay':
-                pp_opportunities[team].add(game_id)
-
-            stats = team_stats[team][situation]
-
-            if event == 'Goal':
-                stats['total_goals'] += 1
-                stats['total_score'] += weights['Goal']
-                
-            elif event == 'Zone Entry':
-                stats['entries'] += 1
-                stats['total_zone_entries'] += 1
-                stats['total_entries'] += 1
-
-                if detail == 'Carried':
-                    stats['total_carried'] += 1
-                    stats['successful_entries'] += 1
-                    stats['total_score'] += weights['Carried']
-                elif detail == 'Dumped':
-                    stats['total_dumped'] += 1
-                    stats['successful_entries'] += 1
-                    stats['total_score'] += weights['Dumped']
-                    
-            elif event == 'Faceoff Win':
-                stats['faceoff_wins'] += 1
-                stats['total_score'] += weights['Faceoff Win']
-                stats['total_faceoffs'] += 1
-                if player2:
-                    opposing_team = away_team if team == home_team else home_team
-                    team_stats[opposing_team][situation]['total_faceoffs'] += 1
-            
-            if detail == 'Lost':
-                stats['denials'] += 1
+# Situation categories, indexed by the engine's situation codes, and the order they are reported in
+CATEGORIES = ['even_strength', 'powerplay', 'shorthanded']
+REPORT_CATEGORIES = ['shorthanded', 'powerplay', 'even_strength']
+CATEGORY_COUNTS = [stat for stat in initialize_category_stats() if stat != 'total_score']
 
-            elif event == 'Takeaway':
-                stats['takeaways'] += 1
-                stats['total_score'] += weights['Takeaways']
+# Count behind each event weight, and the stat behind each rate weight
+SCORED_COUNTS = {
+    'Goal': 'total_goals',
+    'Carried': 'total_carried',
+    'Dumped': 'total_dumped',
+    'Faceoff Win': 'faceoff_wins',
+    'Danger Zone Shot': 'danger_zone_shots',
+    'Blocks': 'blocked',
+    'Takeaways': 'takeaways',
+}
+SCORED_RATES = {
+    'Carried Rate': 'carried_rate',
+    'Dumped Rate': 'dumped_rate',
+    'Entry Rate': 'entry_rate',
+    'Denial Rate': 'denial_rate',
+    'Faceoff Win Rate': 'faceoff_win_rate',
+    'Expected Goals': 'expected_goals',
+    'PP Success Rate': 'pp_success_rate',
+}
 
-            if event == 'Shot' and detail_2 == 'Blocked':
-                blocking_team = away_team if team == home_team else home_team
-                team_stats[blocking_team][situation]['blocked'] += 1
-                team_stats[blocking_team][situation]['total_score'] += weights['Blocks']
-            
-            if event == 'Shot' and row['X Coordinate'] and row['Y Coordinate']:
-                x_coord = float(row['X Coordinate'])
-                y_coord = float(row['Y Coordinate'])
-                stats['shots'] += 1
-                
-                # Add counter for shots on net
-                if detail_2 == 'On Net':
-                    stats['shots_on_net'] += 1
-
-                is_danger_zone = ((11 <= x_coord <= 19.8 or 180.2 <= x_coord <= 188.8) and 
-                                (20.5 <= y_coord <= 64.4))
-                
-                if is_danger_zone:
-                    stats['danger_zone_shots'] += 1
-                    stats['expected_goals'] += GOAL_PROBABILITIES[situation]['danger_zone']
-                    stats['total_score'] += weights['Danger Zone Shot']
-                else:
-                    stats['non_danger_shots'] += 1
-                    stats['expected_goals'] += GOAL_PROBABILITIES[situation]['non_danger']
-
-    # Calculate rates and final scores
-    for team_data in team_stats.values():
-        for category, stats in team_data.items():
-            # Zone entry rates
-            if stats['total_zone_entries'] > 0:
-                stats['carried_rate'] = stats['total_carried'] / stats['total_zone_entries']
-                stats['dumped_rate'] = stats['total_dumped'] / stats['total_zone_entries']
-                stats['carried_rate_weight'] = stats['carried_rate'] * weights['Carried Rate']
-                stats['dumped_rate_weight'] = stats['dumped_rate'] * weights['Dumped Rate']
-                stats['total_score'] += stats['carried_rate_weight'] + stats['dumped_rate_weight']
+# Columns given bootstrap confidence intervals, with the decimals they are rounded to
+INTERVAL_DECIMALS = {
+    'Goals vs Expected': 2,
+    'Entry Rate': 2,
+    'Denial Rate': 2,
+    'Faceoff Win Rate': 2,
+    'Total Score': 2,
+    'PP Success Rate': 2,
+}
+
+# Goal probability per shot, indexed by [situation code, is danger zone]
+SHOT_PROBABILITIES = np.array([
+    [GOAL_PROBABILITIES[category]['non_danger'], GOAL_PROBABILITIES[category]['danger_zone']]
+    for category in CATEGORIES
+])
+
+class PrescoutTeamAnalysis(Analysis):
+    """Team metrics per situation, accumulated one game at a time from the shared event stream."""
+
+    code_column = 'Team'
+    accumulators = ('counts', 'expected_goals', 'pp_opportunities')
+
+    def bind(self, store):
+        super().bind(store)
+        n_teams = len(store.names('Team'))
+        self.seen = np.zeros(n_teams, dtype=bool)
+        self.order = []
+        self.counts = MetricTensor(n_teams, CATEGORY_COUNTS, len(CATEGORIES))
+        self.expected_goals = np.zeros((n_teams, len(CATEGORIES)))
+        self.pp_opportunities = np.zeros(n_teams, dtype=np.int64)
+
+    def count(self, batch, mask, *stats, team=None, situation=None, score_state=None):
+        """Add one to each stat for every masked row, in the row's situation and score state unless others are given."""
+        team = batch['Team'] if team is None else team
+        situation = batch.situation if situation is None else situation
+        score_state = batch.score_state if score_state is None else score_state
+        team, situation, score_state, period = team[mask], situation[mask], score_state[mask], batch.period_index[mask]
+        for stat in stats:
+            self.counts.add(stat, team, situation, score_state, period)
+
+    def consume(self, batch):
+        team = batch['Team']
+
+        # Powerplay opportunities come from the game's strength intervals
+        self.pp_opportunities += batch.strength_intervals.powerplay_opportunities(len(self.pp_opportunities))
+
+        faceoff_wins = batch.is_event('Faceoff Win')
+        opposing_faceoffs = faceoff_wins & (batch['Player 2'] > 0)
+        blocked = batch.is_event('Shot') & batch.has_detail('Detail 2', 'Blocked')
+
+        # Every event credits its team; faceoffs and blocked shots can also credit the opponent
+        appearances = np.column_stack((team, batch.opponent)).ravel()
+        credited = np.column_stack((np.ones(len(batch), dtype=bool), opposing_faceoffs | blocked)).ravel()
+        self.order.extend(first_appearances(appearances[credited], self.seen).tolist())
+
+        self.count(batch, batch.is_event('Goal'), 'total_goals')
+
+        entries = batch.is_event('Zone Entry')
+        self.count(batch, entries, 'entries', 'total_zone_entries', 'total_entries')
+        self.count(batch, entries & batch.has_detail('Detail 1', 'Carried'), 'total_carried', 'successful_entries')
+        self.count(batch, entries & batch.has_detail('Detail 1', 'Dumped'), 'total_dumped', 'successful_entries')
+
+        self.count(batch, faceoff_wins, 'faceoff_wins', 'total_faceoffs')
+        # The losing side took the draw in its own situation
+        self.count(batch, opposing_faceoffs, 'total_faceoffs', team=batch.opponent, situation=batch.opponent_situation,
+                   score_state=batch.opponent_score_state)
+
+        # A takeaway whose Detail 1 is 'Lost' counts only as a denial
+        denials = batch.has_detail('Detail 1', 'Lost')
+        self.count(batch, denials, 'denials')
+        self.count(batch, batch.is_event('Takeaway') & ~denials, 'takeaways')
+
+        self.count(batch, blocked, 'blocked', team=batch.opponent, score_state=batch.opponent_score_state)
+
+        shots = batch.is_event('Shot') & batch.has_coordinates
+        danger_zone = batch.danger_zone
+        self.count(batch, shots, 'shots')
+        self.count(batch, shots & batch.has_detail('Detail 2', 'On Net'), 'shots_on_net')
+        self.count(batch, shots & danger_zone, 'danger_zone_shots')
+        self.count(batch, shots & ~danger_zone, 'non_danger_shots')
+        situation = batch.situation[shots]
+        np.add.at(self.expected_goals, (team[shots], situation),
+                  SHOT_PROBABILITIES[situation, danger_zone[shots].astype(int)])
+
+    def finalize(self):
+        team_stats = {}
+        for team in self.order:
+            team_data = {}
+            for category in REPORT_CATEGORIES:
+                situation = CATEGORIES.index(category)
+                stats = initialize_category_stats()
+                stats.update(zip(CATEGORY_COUNTS, self.counts.collapse(self.counts.values[team, :, situation]).tolist()))
+                # Expected goals stay an integer 0 until the team records a shot
+                if stats['shots']:
+                    stats['expected_goals'] = self.expected_goals[team, situation].item()
+                team_data[category] = stats
+            team_stats[team] = team_data
+
+        # Calculate rates and final scores
+        for team, team_data in team_stats.items():
+            for category, stats in team_data.items():
+                # Zone entry rates
+                if stats['total_zone_entries'] > 0:
+                    stats['carried_rate'] = stats['total_carried'] / stats['total_zone_entries']
+                    stats['dumped_rate'] = stats['total_dumped'] / stats['total_zone_entries']
+                    stats['carried_rate_weight'] = stats['carried_rate'] * weights['Carried Rate']
+                    stats['dumped_rate_weight'] = stats['dumped_rate'] * weights['Dumped Rate']
             
-            # Entry and denial rates
-            if stats['total_entries'] > 0:
-                stats['entry_rate'] = stats['successful_entries'] / stats['total_entries']
-                stats['denial_rate'] = stats['denials'] / stats['entries'] if stats['entries'] > 0 else 0
-                stats['total_score'] += (stats['entry_rate'] * weights['Entry Rate'] +
-                                       stats['denial_rate'] * weights['Denial Rate'])
+                # Entry and denial rates
+                if stats['total_entries'] > 0:
+                    stats['entry_rate'] = stats['successful_entries'] / stats['total_entries']
+                    stats['denial_rate'] = stats['denials'] / stats['entries'] if stats['entries'] > 0 else 0
             
-            # Faceoff rates
-            if stats['total_faceoffs'] > 0:
-                stats['faceoff_win_rate'] = stats['faceoff_wins'] / stats['total_faceoffs']
-                stats['total_score'] += stats['faceoff_win_rate'] * weights['Faceoff Win Rate']
-
-            # Expected goals contribution
-            stats['total_score'] += stats['expected_goals'] * weights['Expected Goals']
-            stats['goals_above_expected'] = stats['total_goals'] - stats['expected_goals']
-
-            # Shot danger rate
-            if stats['shots'] > 0:
-                stats['shot_danger_rate'] = stats['danger_zone_shots'] / stats['shots']
-
-        # Calculate PP success rate for powerplay category
-        team_data['powerplay']['pp_opportunities'] = len(pp_opportunities[team])
-        if team_data['powerplay']['pp_opportunities'] > 0:
-            team_data['powerplay']['pp_success_rate'] = (team_data['powerplay']['total_goals'] / 
-                                                       team_data['powerplay']['pp_opportunities'])
-            success_score = team_data['powerplay']['pp_success_rate'] * weights['PP Success Rate']
-            team_data['powerplay']['total_score'] += success_score
-
-    return team_stats
-
-def save_top_teams_to_csv(team_stats, output_file_path):
+                # Faceoff rates
+                if stats['total_faceoffs'] > 0:
+                    stats['faceoff_win_rate'] = stats['faceoff_wins'] / stats['total_faceoffs']
+
+                stats['goals_above_expected'] = stats['total_goals'] - stats['expected_goals']
+
+                # Shot danger rate
+                if stats['shots'] > 0:
+                    stats['shot_danger_rate'] = stats['danger_zone_shots'] / stats['shots']
+
+            # Calculate PP success rate for powerplay category
+            team_data['powerplay']['pp_opportunities'] = self.pp_opportunities[team].item()
+            if team_data['powerplay']['pp_opportunities'] > 0:
+                team_data['powerplay']['pp_success_rate'] = (team_data['powerplay']['total_goals'] / 
+                                                           team_data['powerplay']['pp_opportunities'])
+
+        # Score every team and category at once from the raw counts and rates; kept for re-scoring
+        rows = [(team, category, stats) for team, team_data in team_stats.items() for category, stats in team_data.items()]
+        teams = np.array([team for team, _, _ in rows], dtype=np.int64)
+        situations = np.array([CATEGORIES.index(category) for _, category, _ in rows], dtype=np.int64)
+        self.features = ScoreFeatures(
+            [(self.store.decode('Team', team), category) for team, category, _ in rows],
+            {name: self.counts[stat][teams, situations] for name, stat in SCORED_COUNTS.items()},
+            {name: [stats.get(rate, 0) for _, _, stats in rows] for name, rate in SCORED_RATES.items()},
+            [stats['total_zone_entries'] > 0 or stats['total_entries'] > 0 or stats['total_faceoffs'] > 0 or
+             stats['shots'] > 0 or 'pp_success_rate' in stats for _, _, stats in rows],
+        )
+        for (_, _, stats), score in zip(rows, self.features.scores(weights)):
+            stats['total_score'] = score
+
+        # Key the results by team name
+        return {self.store.decode('Team', team): team_data for team, team_data in team_stats.items()}
+
+    def window_metrics(self):
+        """Expected Goals and the INTERVAL_DECIMALS columns per situation for many sets of games at once (see Analysis)."""
+        counts = self.counts
+        # Only the powerplay category has a success rate, against each team's own opportunities
+        pp_success_rate = np.zeros(counts['total_goals'].shape)
+        pp_success_rate[..., POWERPLAY] = ratio(counts['total_goals'][..., POWERPLAY], self.pp_opportunities)
+        rates = {
+            'Carried Rate': ratio(counts['total_carried'], counts['total_zone_entries']),
+            'Dumped Rate': ratio(counts['total_dumped'], counts['total_zone_entries']),
+            'Entry Rate': ratio(counts['successful_entries'], counts['total_entries']),
+            'Denial Rate': ratio(counts['denials'], counts['entries']),
+            'Faceoff Win Rate': ratio(counts['faceoff_wins'], counts['total_faceoffs']),
+            'Expected Goals': self.expected_goals,
+            'PP Success Rate': pp_success_rate,
+        }
+        # Undefined rates score 0, as in finalize()
+        scored_rates = {name: np.nan_to_num(rate) for name, rate in rates.items()}
+        scored = {name: counts[stat] for name, stat in SCORED_COUNTS.items()}
+        return {
+            'Expected Goals': self.expected_goals,
+            'Goals vs Expected': counts['total_goals'] - self.expected_goals,
+            'Entry Rate': rates['Entry Rate'],
+            'Denial Rate': rates['Denial Rate'],
+            'Faceoff Win Rate': rates['Faceoff Win Rate'],
+            'Total Score': weighted_sum({**scored, **scored_rates}, weights),
+            'PP Success Rate': pp_success_rate,
+        }
+
+def calculate_powerplay_analysis(store):
+    return run_analyses(store, [PrescoutTeamAnalysis()])[0]
+
+def create_analysis():
+    """Prescout team analysis for this report's date range, for the combined runner."""
+    return PrescoutTeamAnalysis(start_date, end_date)
+
+def save_top_teams_to_csv(team_stats, output_file_path, intervals=None):
+    """Save team metrics per category, with bootstrap CI columns when intervals are given."""
     with open(output_file_path, 'w', newline='') as file:
         fieldnames = [
             'Team', 'Category', 'Goals', 'Expected Goals', 'Goals vs Expected', 
@@ -238,6 +299,8 @@ def save_top_teams_to_csv(team_stats, output_file_path):
             'Carried', 'Dumped', 'Carried Rate', 'Dumped Rate',
             'Carried Rate Weight', 'Dumped Rate Weight'
         ]
+        if intervals is not None:
+            fieldnames += interval_columns(INTERVAL_DECIMALS)
         writer = csv.writer(file)
         writer.writerow(fieldnames)
 
@@ -275,14 +338,33 @@ def save_top_teams_to_csv(team_stats, output_file_path):
                     f"{stats.get('carried_rate_weight', 0):.2f}",
                     f"{stats.get('dumped_rate_weight', 0):.2f}"
                 ]
+                if intervals is not None:
+                    row_data += interval_cells(intervals, team, INTERVAL_DECIMALS, CATEGORIES.index(category))
                 writer.writerow(row_data)
 
     print(f"Team analysis saved to {output_file_path}")
 
+def calculate_faceoff_ratings(file_path):
+    """Every faceoff taker's raw and opponent-adjusted win rate per category, from the cached faceoff matrix."""
+    matrix = load_faceoff_matrix(file_path)
+    rows = []
+    for category in REPORT_CATEGORIES:
+        for row in rating_rows(matrix, [CATEGORIES.index(category)], None, start_date, end_date):
+            rows.append({'Category': category, **row})
+    rows.sort(key=lambda row: (row['Team'], REPORT_CATEGORIES.index(row['Category']), -row['Adjusted Win Rate']))
+    return rows
+
+def save_faceoff_ratings_to_csv(rows, output_file_path):
+    """Save the faceoff ratings, one row per player and category."""
+    with open(output_file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['Team', 'Category', 'Player', 'Faceoffs', 'Wins', 'Win Rate',
+                                                  'Adjusted Win Rate'])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Faceoff ratings saved to {output_file_path}")
+
 if __name__ == "__main__":
-    start_date = '2018-02-11'
-    end_date = '2018-02-21'
-    
-    filter_data_by_date(original_file_path, filtered_file_path, start_date, end_date)
-    team_stats = calculate_powerplay_analysis(filtered_file_path)
-    save_top_teams_to_csv(team_stats, output_file_path)
\ No newline at end of file
+    store = load_event_store(original_file_path).between(start_date, end_date)
+    (team_stats,), (intervals,) = run_with_intervals(store, [PrescoutTeamAnalysis()])
+    save_top_teams_to_csv(team_stats, output_file_path, intervals)
+    save_faceoff_ratings_to_csv(calculate_faceoff_ratings(original_file_path), faceoff_output_file_path)
\ No newline at end of file
@@ -0,0 +1,153 @@
+import copy
+import warnings
+
+import numpy as np
+
+from engine import MetricTensor, merge_analyses, reduce_analyses
+
+# Game resamples drawn per report, and how many of them are summed per tensordot
+BOOTSTRAP_REPLICATES = 2000
+REPLICATE_CHUNK = 100
+
+
+def code_positions(analysis):
+    """Position of every code in analysis.order, -1 for codes the analysis does not report."""
+    positions = np.full(len(analysis.store.names(analysis.code_column)), -1)
+    positions[analysis.order] = np.arange(len(analysis.order))
+    return positions
+
+
+def played_games(analysis, records):
+    """(games x codes) mask of the games each code in analysis.order appears in."""
+    positions = code_positions(analysis)
+    played = np.zeros((len(records), len(analysis.order)), dtype=bool)
+    for game, record in enumerate(records):
+        rows = positions[record['codes']]
+        played[game, rows[rows >= 0]] = True
+    return played
+
+
+def game_arrays(analysis, records):
+    """Dense (games x codes ...) array of each accumulator, over the codes in analysis.order.
+
+    records are the analysis's per-game partial() records; rows for codes the analysis does
+    not report are dropped. MetricTensors keep their per-situation totals only, since
+    window_metrics() never reads the score state and period axes.
+    """
+    positions = code_positions(analysis)
+    n_codes = len(analysis.order)
+
+    arrays = {}
+    for name in analysis.accumulators:
+        accumulator = getattr(analysis, name)
+        collapse = accumulator.collapse if isinstance(accumulator, MetricTensor) else lambda values: values
+        shape = collapse(analysis._accumulator(name)[:0]).shape[1:]
+        array = np.zeros((len(records), n_codes) + shape, dtype=analysis._accumulator(name).dtype)
+        for game, record in enumerate(records):
+            rows = positions[record['codes']]
+            keep = rows >= 0
+            array[game, rows[keep]] = collapse(record[name][keep])
+        arrays[name] = array
+    return arrays
+
+
+def replicate_analysis(analysis, totals):
+    """Shallow copy of a finalized analysis whose accumulators are replaced by totals.
+
+    Each total has a leading replicate axis and its codes in analysis.order, so the
+    analysis's window_metrics() reads every replicate at once.
+    """
+    replica = copy.copy(analysis)
+    for name, values in totals.items():
+        accumulator = getattr(analysis, name)
+        if isinstance(accumulator, MetricTensor):
+            accumulator = copy.copy(accumulator)
+            accumulator.values = values
+            accumulator.state_axes = 0
+            setattr(replica, name, accumulator)
+        else:
+            setattr(replica, name, values)
+    return replica
+
+
+def bootstrap_intervals(analysis, records, replicates=BOOTSTRAP_REPLICATES, seed=0, confidence=0.95):
+    """Percentile bootstrap intervals of the analysis's window_metrics(), resampling games.
+
+    Each replicate draws as many games as records holds, with replacement, as a row of game
+    multiplicities; the replicate totals are then one tensordot with the per-game arrays,
+    so the events are never read again. Returns {column: {name: (low, high)}}, with low and
+    high per situation for metrics reported per situation.
+
+    Replicates where a metric is undefined (NaN, e.g. a rate whose games were all left out)
+    are skipped; a metric undefined in every replicate gets the reports' 0. A replicate that
+    draws none of a code's own games leaves every metric of that code undefined, counts
+    included, rather than pulling its interval towards 0.
+
+    With fewer than two games there is nothing to resample, and None is returned so the
+    reports leave their CI columns out.
+    """
+    if len(records) < 2:
+        return None
+    arrays = game_arrays(analysis, records)
+    played = played_games(analysis, records)
+    n_games = len(records)
+    rng = np.random.default_rng(seed)
+
+    samples = {}
+    for start in range(0, replicates, REPLICATE_CHUNK):
+        size = min(REPLICATE_CHUNK, replicates - start)
+        multiplicities = rng.multinomial(n_games, np.full(n_games, 1 / n_games), size=size)
+        totals = {name: np.tensordot(multiplicities, array, axes=1) for name, array in arrays.items()}
+        # (replicates x codes) mask of the codes none of whose games were drawn
+        absent = (multiplicities @ played) == 0
+        for column, values in replicate_analysis(analysis, totals).window_metrics().items():
+            mask = absent.reshape(absent.shape + (1,) * (values.ndim - 2))
+            samples.setdefault(column, []).append(np.where(mask, np.nan, values))
+
+    tail = (1 - confidence) / 2 * 100
+    names = analysis.store.names(analysis.code_column)[analysis.order].tolist()
+    intervals = {}
+    for column, values in samples.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN slices
+            bounds = np.nanpercentile(np.concatenate(values), [tail, 100 - tail], axis=0)
+        low, high = np.nan_to_num(bounds)
+        intervals[column] = {name: (low[i], high[i]) for i, name in enumerate(names)}
+    return intervals
+
+
+def run_with_intervals(store, analyses, workers=None, replicates=BOOTSTRAP_REPLICATES, seed=0):
+    """run_analyses(), plus each analysis's bootstrap_intervals() (None below two games) from the same per-game records."""
+    store, games = reduce_analyses(store, analyses, workers)
+    results = merge_analyses(store, analyses, games)
+    intervals = [
+        bootstrap_intervals(analysis, [records[i] for records in games if records[i] is not None], replicates, seed)
+        for i, analysis in enumerate(analyses)
+    ]
+    return results, intervals
+
+
+def ratio(numerator, denominator):
+    """numerator / denominator, NaN where the denominator is 0.
+
+    The reports print and score such rates as 0; pass them through np.nan_to_num() before
+    scoring, and leave them NaN for bootstrap_intervals() to skip.
+    """
+    return np.divide(numerator, denominator, out=np.full(np.broadcast(numerator, denominator).shape, np.nan),
+                     where=denominator > 0)
+
+
+def interval_columns(decimals):
+    """CSV headers of the CI columns for the columns in decimals, low and high after each other."""
+    return [f"{column} CI {bound}" for column in decimals for bound in ('Low', 'High')]
+
+
+def interval_cells(intervals, name, decimals, situation=None):
+    """The CI cells of one CSV row, in interval_columns() order, each rounded to its column's decimals."""
+    cells = []
+    for column, places in decimals.items():
+        low, high = intervals[column][name]
+        if situation is not None:
+            low, high = low[situation], high[situation]
+        cells.extend([round(float(low), places), round(float(high), places)])
+    return cells
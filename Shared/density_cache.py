@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from event_store import cache_path, file_fingerprint, load_event_store
+from heatmap import DENSITY_SIGMA, shot_coordinates, shot_density
+
+# Bump whenever shot_density() changes, so densities cached by an older version are misses
+DENSITY_VERSION = 2
+
+# Largest the cache folder may grow before the least recently used densities are removed
+DENSITY_CACHE_BYTES = 256 * 2**20
+
+
+class DensityCache:
+    """Smoothed shot densities saved as .npz files, evicted least recently used first.
+
+    Reading a density touches its file, so file modification times double as the LRU order
+    and several processes can share one cache folder.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DENSITY_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.npz')
+
+    def get(self, key):
+        """The density saved under key, or None."""
+        path = self.path(key)
+        try:
+            with np.load(path) as saved:
+                density = saved['density']
+            os.utime(path)
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+        return density
+
+    def put(self, key, density):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Written to a temporary file and renamed, so other processes never read half a file
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            np.savez(file, density=density)
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used densities until the folder fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def density_cache_dir(file_path):
+    """Default cache folder for the densities of the event log at file_path."""
+    return cache_path(file_path, '.densities')
+
+
+def subject_density(file_path, column, names, situation=None, danger_zone=False, date_range=(None, None),
+                    cache=None, store=None):
+    """Shot density of the shots by names in column ('Team' or 'Player'), from the cache when possible.
+
+    The key includes the event log's fingerprint and DENSITY_VERSION, so any change to the
+    data or to the smoothing is a miss. Only
+    on a miss is the event store opened (or store used) to select and bin the shots.
+    """
+    if cache is None:
+        cache = DensityCache(density_cache_dir(file_path))
+    key = [file_fingerprint(file_path), column, list(names), situation, danger_zone, list(date_range), DENSITY_SIGMA,
+           DENSITY_VERSION]
+    density = cache.get(key)
+    if density is None:
+        if store is None:
+            store = load_event_store(file_path)
+        games = store.between(*date_range)
+        selection = {'teams': names} if column == 'Team' else {'players': names}
+        density = shot_density(*shot_coordinates(games, situation=situation, danger_zone=danger_zone, **selection))
+        cache.put(key, density)
+    return density
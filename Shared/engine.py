@@ -0,0 +1,370 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from functools import cached_property
+
+import numpy as np
+
+from event_store import N_PERIODS, OPPONENT_SCORE_STATE, OPPONENT_SITUATION, period_index
+from possessions import build_possessions
+from shot_model import in_danger_zone
+from strength_states import segment_strength
+
+
+class EventBatch:
+    """One game's events plus the derived columns every analysis shares.
+
+    Each derived column is computed at most once per game, however many analyses read it.
+    """
+
+    def __init__(self, store, game_id):
+        self.store = store
+        self.game_id = game_id
+        self._mask_cache = {}
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, name):
+        return self.store[name]
+
+    def is_event(self, name):
+        """Mask of rows whose Event is name."""
+        return self._masks('Event', name)
+
+    def has_detail(self, column, name):
+        """Mask of rows whose detail column (e.g. 'Detail 1') is name."""
+        return self._masks(column, name)
+
+    def _masks(self, column, name):
+        key = (column, name)
+        if key not in self._mask_cache:
+            self._mask_cache[key] = self.store[column] == self.store.code(column, name)
+        return self._mask_cache[key]
+
+    @cached_property
+    def is_home(self):
+        return self.store['Team'] == self.store['Home Team']
+
+    @cached_property
+    def opponent(self):
+        """Team code of the side that did not record the event."""
+        return np.where(self.is_home, self.store['Away Team'], self.store['Home Team'])
+
+    @property
+    def situation(self):
+        """EVEN_STRENGTH, POWERPLAY or SHORTHANDED for the event team (see derive_situation)."""
+        return self.store['situation']
+
+    @cached_property
+    def opponent_situation(self):
+        """The situation of the side that did not record the event, e.g. SHORTHANDED for a powerplay event."""
+        return OPPONENT_SITUATION[self.store['situation']]
+
+    @property
+    def score_state(self):
+        """TRAILING, TIED or LEADING for the event team before the event (see derive_score_state)."""
+        return self.store['score_state']
+
+    @cached_property
+    def opponent_score_state(self):
+        """The score state of the side that did not record the event."""
+        return OPPONENT_SCORE_STATE[self.store['score_state']]
+
+    @cached_property
+    def period_index(self):
+        """Each event's period as an index into N_PERIODS, overtime periods pooled."""
+        return period_index(self.store['Period'])
+
+    @cached_property
+    def has_coordinates(self):
+        """Rows with both an X and a Y coordinate."""
+        return ~np.isnan(self.store['X Coordinate']) & ~np.isnan(self.store['Y Coordinate'])
+
+    @cached_property
+    def danger_zone(self):
+        """Shots from the slot in front of either net, using the raw (unmirrored) coordinates."""
+        return in_danger_zone(self.store['X Coordinate'], self.store['Y Coordinate'])
+
+    @cached_property
+    def lost_dump(self):
+        """Dump In/Out events where the puck was lost, which count as an entry denial."""
+        return self.is_event('Dump In/Out') & self.has_detail('Detail 1', 'Lost')
+
+    @cached_property
+    def neutral_zone(self):
+        """Events between x = 29 and x = 207, where a turnover counts as an entry denial."""
+        x = self.store['X Coordinate']
+        return (29 <= x) & (x <= 207)
+
+    @cached_property
+    def strength_intervals(self):
+        """The game's StrengthIntervals, for powerplay opportunities and time."""
+        return segment_strength(self.store)
+
+    @cached_property
+    def possessions(self):
+        """The game's Possessions, for joining events to what follows them."""
+        return build_possessions(self.store)
+
+    @cached_property
+    def shot_attempts(self):
+        """Shots and goals, which are recorded as separate events."""
+        return self.is_event('Shot') | self.is_event('Goal')
+
+
+class Analysis:
+    """Base class for an analysis fed by the engine's shared stream of game batches.
+
+    Subclasses allocate their accumulators in bind(), add one game at a time in consume()
+    and build the same result their calculate_* function returns in finalize().
+
+    Subclasses keep the codes they report in self.order (first appearance order, with
+    self.seen marking them) and list their per-code arrays in accumulators, which are
+    summed across games, and first_seen, which keep the value from a code's first game.
+    That is enough for partial() and merge() to split the work into per-game records.
+    """
+
+    # Categorical column whose codes index the per-code arrays ('Player' or 'Team')
+    code_column = None
+    # Per-code arrays (or MetricTensors) that add up across games
+    accumulators = ()
+    # Per-code arrays set once, when the code first appears, mapped to the column their values code
+    first_seen = {}
+
+    def __init__(self, start_date=None, end_date=None):
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def covers(self, game_date):
+        """Whether a game played on game_date belongs in this analysis."""
+        return ((self.start_date is None or self.start_date <= game_date) and
+                (self.end_date is None or game_date <= self.end_date))
+
+    def bind(self, store):
+        self.store = store
+
+    def consume(self, batch):
+        raise NotImplementedError
+
+    def finalize(self):
+        raise NotImplementedError
+
+    def window_metrics(self):
+        """Key result columns for many sets of games at once, computed from the accumulators alone.
+
+        Called on a copy whose accumulators carry an extra leading axis (one entry per bootstrap
+        replicate or rolling window) and hold only the codes in self.order. Returns
+        {column: array} with that leading axis; rates with no denominator are NaN.
+        """
+        raise NotImplementedError
+
+    def _accumulator(self, name):
+        accumulator = getattr(self, name)
+        return accumulator.values if isinstance(accumulator, MetricTensor) else accumulator
+
+    def partial(self):
+        """Take everything consumed since the last partial() as a compact record and reset.
+
+        The record only holds the rows of the codes that were touched. Records are merged
+        with merge(); merging several and taking partial() again gives a record for the
+        combined games, so records can be rolled up in any grouping.
+        """
+        order = np.array(self.order, dtype=np.int64)
+        touched = [order]
+        for name in self.accumulators:
+            array = self._accumulator(name)
+            touched.append(np.flatnonzero(array.reshape(len(array), -1).any(axis=1)))
+        codes = np.unique(np.concatenate(touched))
+
+        record = {'order': order, 'codes': codes}
+        for name in self.accumulators:
+            array = self._accumulator(name)
+            record[name] = array[codes].copy()
+            array[codes] = 0
+        for name in self.first_seen:
+            record[name] = getattr(self, name)[codes].copy()
+
+        self.seen[order] = False
+        self.order = []
+        return record
+
+    def merge(self, record):
+        """Add a record from partial() into this analysis, after any games already merged."""
+        codes = record['codes']
+        for name in self.accumulators:
+            self._accumulator(name)[codes] += record[name]
+
+        new_codes = first_appearances(record['order'], self.seen)
+        self.order.extend(new_codes.tolist())
+        rows = np.searchsorted(codes, new_codes)
+        for name in self.first_seen:
+            getattr(self, name)[new_codes] = record[name][rows]
+
+
+class MetricTensor:
+    """Dense accumulator indexed by (code, metric, situation, score state, period).
+
+    One array holds every counter for every player or team; tensor['goals'] is a
+    (codes x situations) array of it summed over score states and periods, so results can
+    still be read out by metric name. tensor.slice() reads the same for any combination of
+    score states and periods, which add() fills in the same pass as the situation.
+    """
+
+    def __init__(self, size, metrics, n_situations=3, dtype=np.int64):
+        self.metrics = list(metrics)
+        self._index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.values = np.zeros((size, len(self.metrics), n_situations, len(OPPONENT_SCORE_STATE), N_PERIODS),
+                               dtype=dtype)
+        # Trailing (score state, period) axes of values; 0 once they are summed away (see collapse())
+        self.state_axes = 2
+
+    def __getitem__(self, metric):
+        return self.slice(metric)
+
+    def slice(self, metric, score_states=None, periods=None):
+        """(codes x situations) counts of metric over any of score_states and period indices; None selects all."""
+        # Indexed from the end, so values with leading axes (e.g. bootstrap replicates) read the same way
+        values = self.values[(Ellipsis, self._index[metric]) + (slice(None),) * (1 + self.state_axes)]
+        if not self.state_axes:
+            if score_states is not None or periods is not None:
+                raise ValueError("score states and periods were summed away by collapse()")
+            return values
+        if score_states is not None:
+            values = values[..., sorted(set(score_states)), :]
+        if periods is not None:
+            values = values[..., sorted(set(periods))]
+        return values.sum(axis=(-2, -1))
+
+    def add(self, metric, codes, situation, score_state, period, amount=1):
+        """Add amount to metric for each (code, situation, score state, period index), repeats included."""
+        np.add.at(self.values, (codes, self._index[metric], situation, score_state, period), amount)
+
+    def totals(self, code):
+        """Each metric's count for code summed over situations, score states and periods, keyed by metric name."""
+        return dict(zip(self.metrics, self.values[code].reshape(len(self.metrics), -1).sum(axis=1).tolist()))
+
+    def collapse(self, values):
+        """values (e.g. one per-game record) with the score state and period axes summed away."""
+        return values.sum(axis=tuple(range(-self.state_axes, 0)))
+
+
+def first_appearances(codes, seen, return_index=False):
+    """Codes not yet marked in seen, in the order they first appear; marks them as seen.
+
+    Used to keep results in the same order a dict filled row by row would have. With
+    return_index, also returns the position of each code's first appearance in codes.
+    """
+    unique, first = np.unique(codes, return_index=True)
+    new = ~seen[unique]
+    order = np.argsort(first[new], kind='stable')
+    ordered = unique[new][order]
+    seen[ordered] = True
+    if return_index:
+        return ordered, first[new][order]
+    return ordered
+
+
+def aggregate_games(store, analysis):
+    """Reduce every game in store to a per-game record for analysis.
+
+    Returns a list of (game_id, game_date, record) in game order. Any date range can then be
+    answered with merge_games() without reading the events again.
+    """
+    analysis.bind(store)
+    dates = store['game_date']
+    records = []
+    for game_id, rows in store.game_slices():
+        analysis.consume(EventBatch(store.take(rows), game_id))
+        records.append((game_id, str(dates[rows.start]), analysis.partial()))
+    return records
+
+
+def merge_games(store, analysis, records):
+    """Result of analysis over its date range, built by merging per-game records."""
+    analysis.bind(store)
+    for game_id, game_date, record in records:
+        if analysis.covers(game_date):
+            analysis.merge(record)
+    return analysis.finalize()
+
+
+def reduce_games(store, analyses):
+    """Reduce each game in store to one partial() record per analysis (None where not covered).
+
+    Returns a list of per-game record lists in game order.
+    """
+    for analysis in analyses:
+        analysis.bind(store)
+
+    dates = store['game_date']
+    games = []
+    for game_id, rows in store.game_slices():
+        game_date = dates[rows.start]
+        batch = None
+        records = []
+        for analysis in analyses:
+            record = None
+            if analysis.covers(game_date):
+                if batch is None:
+                    batch = EventBatch(store.take(rows), game_id)
+                analysis.consume(batch)
+                record = analysis.partial()
+            records.append(record)
+        games.append(records)
+    return games
+
+
+def shard_games(store, n_shards):
+    """Split store into at most n_shards contiguous runs of whole games."""
+    bounds = [rows.start for _, rows in store.game_slices()]
+    if not bounds:
+        return []
+    starts = [bounds[i] for i in np.linspace(0, len(bounds), min(n_shards, len(bounds)), endpoint=False).astype(int)]
+    stops = starts[1:] + [len(store)]
+    return [store.take(slice(start, stop)) for start, stop in zip(starts, stops)]
+
+
+def reduce_in_pool(store, reducers, workers=None):
+    """reduce_games() over store, sharded across workers processes when workers > 1."""
+    if workers is None or workers <= 1:
+        return reduce_games(store, reducers)
+    # A few shards per worker keeps the pool busy when games differ in size
+    shards = shard_games(store, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [game for shard in pool.map(reduce_games, shards, [reducers] * len(shards)) for game in shard]
+
+
+def reduce_analyses(store, analyses, workers=None):
+    """Reduce every game any of analyses covers to per-game records, in one scan.
+
+    Returns the store narrowed to the analyses' date ranges and the list of per-game record
+    lists from reduce_games(). The analyses passed in are left untouched.
+    """
+    if analyses and all(a.start_date is not None and a.end_date is not None for a in analyses):
+        store = store.between(min(a.start_date for a in analyses), max(a.end_date for a in analyses))
+
+    # Reduction runs on copies, so the analyses passed in only ever see merged records
+    return store, reduce_in_pool(store, [copy.deepcopy(analysis) for analysis in analyses], workers)
+
+
+def merge_analyses(store, analyses, games):
+    """Merge per-game records from reduce_analyses() in game order and return each analysis's result."""
+    for analysis in analyses:
+        analysis.bind(store)
+    for records in games:
+        for analysis, record in zip(analyses, records):
+            if record is not None:
+                analysis.merge(record)
+
+    return [analysis.finalize() for analysis in analyses]
+
+
+def run_analyses(store, analyses, workers=None):
+    """Feed every game in store to each analysis in one scan and return their results.
+
+    Only the games inside at least one analysis's date range are read. Each game is reduced
+    to a per-game record and the records are merged in game order, so with workers > 1 the
+    games can be sharded across a process pool and the results are identical to a serial run.
+    """
+    store, games = reduce_analyses(store, analyses, workers)
+    return merge_analyses(store, analyses, games)
@@ -0,0 +1,443 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+
+# Bump whenever the on-disk layout or derived columns change so stale caches are rebuilt
+STORE_VERSION = 7
+
+# Bytes at the end of the CSV remembered in store.json, to tell an append from an edit
+TAIL_BYTES = 65536
+
+# Columns of olympic_womens_dataset.csv that are parsed into numbers; everything else stays text
+INT_COLUMNS = ['Period', 'Home Team Skaters', 'Away Team Skaters', 'Home Team Goals', 'Away Team Goals']
+COORDINATE_COLUMNS = ['X Coordinate', 'Y Coordinate', 'X Coordinate 2', 'Y Coordinate 2']
+
+# Text columns stored as integer codes, and the lookup table each one shares.
+# Code 0 is always the empty string, so a blank Player or Detail is falsy.
+CATEGORICAL_COLUMNS = {
+    'Home Team': 'teams',
+    'Away Team': 'teams',
+    'Team': 'teams',
+    'Player': 'players',
+    'Player 2': 'players',
+    'Event': 'events',
+    'Detail 1': 'details',
+    'Detail 2': 'details',
+    'Detail 3': 'details',
+    'Detail 4': 'details',
+}
+
+# Codes of the derived 'situation' column, always from the event team's point of view
+EVEN_STRENGTH = 0
+POWERPLAY = 1
+SHORTHANDED = 2
+
+# Situation of the other side, indexed by situation code
+OPPONENT_SITUATION = np.array([EVEN_STRENGTH, SHORTHANDED, POWERPLAY], dtype=np.int8)
+
+# Codes of the derived 'score_state' column: the event team's score against the other side's
+# before the event, so a goal scored from behind counts as TRAILING
+TRAILING = 0
+TIED = 1
+LEADING = 2
+
+# Score state of the other side, indexed by score state code
+OPPONENT_SCORE_STATE = np.array([LEADING, TIED, TRAILING], dtype=np.int8)
+
+# Periods kept apart by period index: the three of regulation, then every overtime period pooled
+N_PERIODS = 4
+
+# Length of every period, overtime included; the game clock counts down from it
+PERIOD_SECONDS = 20 * 60
+
+
+class EventStore:
+    """Typed column arrays for the event log, keyed by the original CSV header names.
+
+    Rows are kept sorted by (game_date, Home Team, Away Team, Period, clock), so every
+    date range and every game is a contiguous slice found by binary search. Team, player,
+    event and detail columns hold integer codes into the shared vocabularies.
+    """
+
+    def __init__(self, columns, fieldnames, vocabularies):
+        self.columns = columns
+        self.fieldnames = fieldnames
+        self.vocabularies = vocabularies
+        self._code_index = {}
+
+    def __len__(self):
+        return len(self.columns['game_date'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def take(self, index):
+        """Return a new store holding only the selected rows (mask, slice or index array)."""
+        columns = {name: column[index] for name, column in self.columns.items()}
+        store = EventStore(columns, self.fieldnames, self.vocabularies)
+        store._code_index = self._code_index
+        return store
+
+    def names(self, column):
+        """Lookup table (code -> string) used by a categorical column."""
+        return self.vocabularies[CATEGORICAL_COLUMNS[column]]
+
+    def decode(self, column, code):
+        """String value of a single code from a categorical column."""
+        return str(self.names(column)[code])
+
+    def code(self, column, value):
+        """Integer code of value in a categorical column, or -1 when it never occurs."""
+        vocabulary = CATEGORICAL_COLUMNS[column]
+        if vocabulary not in self._code_index:
+            self._code_index[vocabulary] = {name: code for code, name in enumerate(self.vocabularies[vocabulary].tolist())}
+        return self._code_index[vocabulary].get(value, -1)
+
+    def codes(self, column, *values):
+        """Integer codes for several values of a categorical column, in order."""
+        return tuple(self.code(column, value) for value in values)
+
+    def date_slice(self, start_date, end_date):
+        """Row slice covering the games played between start_date and end_date (inclusive).
+
+        Either date may be None to leave that end of the range open.
+        """
+        dates = self.columns['game_date']
+        start = 0 if start_date is None else int(np.searchsorted(dates, start_date, side='left'))
+        stop = len(dates) if end_date is None else int(np.searchsorted(dates, end_date, side='right'))
+        return slice(start, stop)
+
+    def between(self, start_date, end_date):
+        """Return the events played between start_date and end_date (inclusive)."""
+        return self.take(self.date_slice(start_date, end_date))
+
+    def on(self, game_date):
+        """Return the events played on a single game date."""
+        return self.between(game_date, game_date)
+
+    def game_slices(self):
+        """List (game_id, row slice) for every game, using the scripts' date_home_away key."""
+        dates = self.columns['game_date']
+        home = self.columns['Home Team']
+        away = self.columns['Away Team']
+        if len(dates) == 0:
+            return []
+        changed = (dates[1:] != dates[:-1]) | (home[1:] != home[:-1]) | (away[1:] != away[:-1])
+        bounds = np.concatenate(([0], np.flatnonzero(changed) + 1, [len(dates)]))
+        teams = self.vocabularies['teams']
+        return [
+            (f"{dates[start]}_{teams[home[start]]}_{teams[away[start]]}", slice(int(start), int(stop)))
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+
+    def game_index(self):
+        """(game ids, game dates, game number of every row), numbering games in game_slices() order.
+
+        Per-game tables built from the store index their games by these numbers.
+        """
+        slices = self.game_slices()
+        dates = self.columns['game_date']
+        game_ids = np.array([game_id for game_id, _ in slices], dtype=str)
+        game_dates = np.array([str(dates[rows.start]) for _, rows in slices], dtype=str)
+        game = np.repeat(np.arange(len(slices)), [rows.stop - rows.start for _, rows in slices])
+        return game_ids, game_dates, game
+
+    def rows(self):
+        """Yield one dict per event, like csv.DictReader but with typed values.
+
+        Integer columns come back as int, categorical columns as their integer code and
+        coordinates as float, or None when blank.
+        """
+        values = []
+        for name in self.fieldnames:
+            column = self.columns[name].tolist()
+            if name in COORDINATE_COLUMNS:
+                column = [None if value != value else value for value in column]
+            values.append(column)
+        for row in zip(*values):
+            yield dict(zip(self.fieldnames, row))
+
+
+def parse_clock(clock):
+    """Convert a 'MM:SS' game clock to seconds remaining in the period."""
+    minutes, seconds = clock.split(':')
+    return int(minutes) * 60 + int(seconds)
+
+
+def elapsed_seconds(period, clock_seconds):
+    """Seconds since the start of the game, from the period and the seconds left in it."""
+    return (period.astype(np.int32) - 1) * PERIOD_SECONDS + PERIOD_SECONDS - clock_seconds
+
+
+def read_event_csv(file_path):
+    """Parse the master CSV once into a sorted EventStore."""
+    with open(file_path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        fieldnames = next(reader)
+        columns = parse_columns(fieldnames, reader)
+    vocabularies = encode_categories(columns)
+    return sort_events(EventStore(columns, fieldnames, vocabularies))
+
+
+def append_event_csv(store, file_path, offset):
+    """Add the rows written to file_path after byte offset to store, parsing only those rows."""
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        text = file.read().decode('utf-8')
+    columns = parse_columns(store.fieldnames, csv.reader(io.StringIO(text, newline='')))
+    vocabularies, old_columns = extend_categories(store, columns)
+    combined = {name: np.concatenate((old_columns[name], columns[name])) for name in old_columns}
+    return sort_events(EventStore(combined, store.fieldnames, vocabularies))
+
+
+def parse_columns(fieldnames, reader):
+    """Typed column arrays, plus the derived clock_seconds, elapsed_seconds, situation and score_state, from CSV rows."""
+    raw_columns = list(zip(*reader)) or [()] * len(fieldnames)
+    columns = {}
+    for name, raw in zip(fieldnames, raw_columns):
+        if name in INT_COLUMNS:
+            columns[name] = np.array([int(value) for value in raw], dtype=np.int16)
+        elif name in COORDINATE_COLUMNS:
+            columns[name] = np.array([float(value) if value else np.nan for value in raw], dtype=np.float64)
+        else:
+            columns[name] = np.array(raw, dtype=str)
+    columns['clock_seconds'] = np.array([parse_clock(value) for value in columns['Clock'].tolist()], dtype=np.int16)
+    columns['elapsed_seconds'] = elapsed_seconds(columns['Period'], columns['clock_seconds'])
+    columns['situation'] = derive_situation(columns)
+    columns['score_state'] = derive_score_state(columns)
+    return columns
+
+
+def sort_events(store):
+    """Sort by (game_date, Home Team, Away Team, Period, clock).
+
+    The clock counts down, so later events in a period have fewer seconds remaining.
+    lexsort is stable, which keeps simultaneous events in file order.
+    """
+    order = np.lexsort((
+        -store['clock_seconds'].astype(np.int32),
+        store['Period'],
+        store['Away Team'],
+        store['Home Team'],
+        store['game_date'],
+    ))
+    return store.take(order)
+
+
+def derive_situation(columns):
+    """EVEN_STRENGTH, POWERPLAY or SHORTHANDED for the team that recorded each event.
+
+    This is the one definition every report uses. A team is on the powerplay when it has
+    more skaters than the other side and the other side is down to four or fewer (so 6-on-5
+    with a goalie pulled stays even strength), and shorthanded in the mirror case. Events
+    whose Team is not the home team are read from the away side.
+    """
+    home_skaters = columns['Home Team Skaters']
+    away_skaters = columns['Away Team Skaters']
+    is_home = columns['Team'] == columns['Home Team']
+    team_skaters = np.where(is_home, home_skaters, away_skaters)
+    opponent_skaters = np.where(is_home, away_skaters, home_skaters)
+    situation = np.full(len(is_home), EVEN_STRENGTH, dtype=np.int8)
+    situation[is_powerplay(team_skaters, opponent_skaters)] = POWERPLAY
+    situation[is_powerplay(opponent_skaters, team_skaters)] = SHORTHANDED
+    return situation
+
+
+def derive_score_state(columns):
+    """TRAILING, TIED or LEADING for the team that recorded each event, from the goals before it."""
+    is_home = columns['Team'] == columns['Home Team']
+    margin = columns['Home Team Goals'].astype(np.int32) - columns['Away Team Goals']
+    return (np.sign(np.where(is_home, margin, -margin)) + TIED).astype(np.int8)
+
+
+def period_index(period):
+    """0, 1 or 2 for the regulation periods and 3 for any overtime, indexing N_PERIODS."""
+    return np.minimum(period, N_PERIODS) - 1
+
+
+def is_powerplay(skaters, opponent_skaters):
+    """Whether a side with skaters on the ice is on the powerplay against opponent_skaters (see derive_situation)."""
+    return (skaters > opponent_skaters) & (opponent_skaters <= 4)
+
+
+def encode_categories(columns):
+    """Replace categorical text columns with int32 codes in place; return the lookup tables."""
+    vocabularies = {}
+    for vocabulary in sorted(set(CATEGORICAL_COLUMNS.values())):
+        names = [name for name, table in CATEGORICAL_COLUMNS.items() if table == vocabulary and name in columns]
+        values = np.concatenate([np.array([''])] + [columns[name] for name in names])
+        # np.unique sorts, so '' always gets code 0 and team codes follow alphabetical order
+        vocabularies[vocabulary], inverse = np.unique(values, return_inverse=True)
+        offset = 1
+        for name in names:
+            size = len(columns[name])
+            columns[name] = inverse[offset:offset + size].astype(np.int32)
+            offset += size
+    return vocabularies
+
+
+def extend_categories(store, columns):
+    """Encode new text columns against store's vocabularies, growing them as needed.
+
+    Vocabularies stay sorted, so when one grows the store's existing codes are remapped.
+    Returns the vocabularies and the store's columns under them.
+    """
+    vocabularies = {}
+    old_columns = dict(store.columns)
+    for vocabulary, old_names in store.vocabularies.items():
+        names = [name for name, table in CATEGORICAL_COLUMNS.items() if table == vocabulary and name in columns]
+        new_names = np.unique(np.concatenate([old_names] + [columns[name] for name in names]))
+        if len(new_names) != len(old_names):
+            remap = np.searchsorted(new_names, old_names).astype(np.int32)
+            for name in names:
+                old_columns[name] = remap[old_columns[name]]
+        for name in names:
+            columns[name] = np.searchsorted(new_names, columns[name]).astype(np.int32)
+        vocabularies[vocabulary] = new_names
+    return vocabularies, old_columns
+
+
+def distinct_keys(columns, sizes):
+    """Distinct combinations of integer columns, where column i only holds values below sizes[i].
+
+    Each row's values are packed into one integer key and the keys deduplicated with np.unique.
+    Returns the distinct combinations (one array per column, in key order), the index of each
+    row's combination and the number of rows sharing each combination.
+    """
+    keys = np.ravel_multi_index(tuple(np.asarray(column, dtype=np.int64) for column in columns), sizes)
+    unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return np.unravel_index(unique, sizes), inverse, counts
+
+
+def cache_path(file_path, suffix):
+    """Path of a cache kept beside the event log, named after it with suffix (e.g. '.store')."""
+    return os.path.splitext(file_path)[0] + suffix
+
+
+def load_cached_arrays(file_path, suffix, build, fields, path=None):
+    """{field: array} derived from the event log at file_path, kept in an .npz file beside it.
+
+    build(store) returns an object holding the arrays as attributes named by fields. It only
+    runs when the file is missing, unreadable or was written for another version of the log.
+    The file is written under a temporary name and renamed into place, so it is never read
+    half written.
+    """
+    if path is None:
+        path = cache_path(file_path, suffix)
+    fingerprint = np.array(file_fingerprint(file_path), dtype=np.int64)
+    try:
+        with np.load(path) as saved:
+            if np.array_equal(saved['fingerprint'], fingerprint):
+                return {field: saved[field] for field in fields}
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        pass  # Missing or unreadable, so rebuilt below
+
+    built = build(load_event_store(file_path))
+    arrays = {field: np.asarray(getattr(built, field)) for field in fields}
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(handle, 'wb') as file:
+        np.savez(file, fingerprint=fingerprint, **arrays)
+    os.replace(temp_path, path)
+    return arrays
+
+
+def file_tail(file_path, size):
+    """Checksum of the last TAIL_BYTES of the first size bytes of file_path."""
+    with open(file_path, 'rb') as file:
+        file.seek(max(0, size - TAIL_BYTES))
+        return hashlib.sha1(file.read(size - max(0, size - TAIL_BYTES))).hexdigest()
+
+
+def is_append(file_path, meta, fingerprint):
+    """Whether file_path only gained rows at the end since the cache described by meta was built."""
+    old_size = meta['fingerprint'][0]
+    if fingerprint[0] <= old_size:
+        return False
+    with open(file_path, 'rb') as file:
+        file.seek(old_size - 1)
+        if file.read(1) != b'\n':
+            return False
+    return file_tail(file_path, old_size) == meta['tail']
+
+
+def file_fingerprint(file_path):
+    """Size and modification time of file_path, used to tell when a cached store is stale."""
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_event_store(store, cache_dir, file_path, fingerprint):
+    """Write one .npy file per column plus a store.json describing them."""
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, 'store.json')
+    # Removed before any column is overwritten (an append rewrites them in place) and written
+    # back last, so an interrupted save never leaves the old store.json over new columns
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name, column in store.columns.items():
+        np.save(os.path.join(cache_dir, name + '.npy'), column)
+    for vocabulary, names in store.vocabularies.items():
+        np.save(os.path.join(cache_dir, f"vocabulary.{vocabulary}.npy"), names)
+    with open(meta_path + '.tmp', 'w') as file:
+        json.dump({
+            'version': STORE_VERSION,
+            'fingerprint': fingerprint,
+            'tail': file_tail(file_path, fingerprint[0]),
+            'fieldnames': store.fieldnames,
+            'columns': list(store.columns),
+            'vocabularies': list(store.vocabularies),
+        }, file)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def load_event_store(file_path, cache_dir=None):
+    """Load the event store for file_path, re-parsing the CSV only when it has changed.
+
+    Cached columns are memory-mapped, so slicing out one game only reads that game's rows.
+    When rows were only appended to the CSV, just the new rows are parsed and merged in.
+    """
+    if cache_dir is None:
+        cache_dir = cache_path(file_path, '.store')
+    fingerprint = file_fingerprint(file_path)
+
+    meta_path = os.path.join(cache_dir, 'store.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        if meta['version'] == STORE_VERSION:
+            if meta['fingerprint'] == fingerprint:
+                return open_event_store(cache_dir, meta)
+            if is_append(file_path, meta, fingerprint):
+                store = append_event_csv(open_event_store(cache_dir, meta), file_path, meta['fingerprint'][0])
+                save_event_store(store, cache_dir, file_path, fingerprint)
+                return store
+
+    store = read_event_csv(file_path)
+    save_event_store(store, cache_dir, file_path, fingerprint)
+    return store
+
+
+def open_event_store(cache_dir, meta):
+    """Memory-map the cached columns described by meta."""
+    columns = {
+        name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+        for name in meta['columns']
+    }
+    vocabularies = {
+        vocabulary: np.load(os.path.join(cache_dir, f"vocabulary.{vocabulary}.npy"))
+        for vocabulary in meta['vocabularies']
+    }
+    return EventStore(columns, meta['fieldnames'], vocabularies)
+
+
+if __name__ == "__main__":
+    # Build (or refresh) the cached store ahead of the nightly run
+    store = load_event_store(sys.argv[1])
+    print(f"Loaded {len(store)} events from {sys.argv[1]}")
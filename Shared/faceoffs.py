@@ -0,0 +1,245 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+from scipy import sparse
+
+from event_store import OPPONENT_SITUATION, distinct_keys, load_cached_arrays
+from metric_cube import SITUATION_CODES
+
+# Zones split at the blue lines by the draw's X coordinate. Coordinates have the event team
+# attacking to the right, so the zone is the winner's; the loser's is its mirror.
+BLUE_LINES = [75, 125]
+ZONE_CODES = {
+    'DZ': 0,
+    'NZ': 1,
+    'OZ': 2,
+}
+OPPONENT_ZONE = np.array([2, 1, 0])
+
+# Draws against an average centre, half of them won, that every player starts from
+PRIOR_FACEOFFS = 4
+
+
+class FaceoffMatrix:
+    """Faceoffs won per (game, situation, zone) layer, kept as sparse winner x loser counts.
+
+    Layer k is game layer_game[k] (an index into game_ids), in the winner's situation
+    layer_situation[k] and zone layer_zone[k]. Edge e carries count[e] draws won by player
+    winner[e] over player loser[e] within layer edge_layer[e]. Rows and columns are the
+    store's player codes in every layer, so wins() can sum any selection of layers.
+    player_team holds the team code each player last took a draw for.
+    """
+
+    def __init__(self, game_ids, game_dates, teams, players, player_team, layer_game, layer_situation, layer_zone,
+                 edge_layer, winner, loser, count):
+        self.game_ids = game_ids
+        self.game_dates = game_dates
+        self.teams = teams
+        self.players = players
+        self.player_team = player_team
+        self.layer_game = layer_game
+        self.layer_situation = layer_situation
+        self.layer_zone = layer_zone
+        self.edge_layer = edge_layer
+        self.winner = winner
+        self.loser = loser
+        self.count = count
+
+    def __len__(self):
+        return len(self.layer_game)
+
+    def select(self, situations=None, zones=None, start_date=None, end_date=None):
+        """Indices of the layers in any of situations and zones (winner's codes), in the inclusive date range."""
+        dates = self.game_dates[self.layer_game]
+        selected = np.ones(len(self), dtype=bool)
+        if situations is not None:
+            selected &= np.isin(self.layer_situation, situations)
+        if zones is not None:
+            selected &= np.isin(self.layer_zone, zones)
+        if start_date is not None:
+            selected &= dates >= start_date
+        if end_date is not None:
+            selected &= dates <= end_date
+        return np.flatnonzero(selected)
+
+    def wins(self, layers=None):
+        """Sparse (players x players) draws won by the row player over the column player, summed over layers."""
+        edges = slice(None) if layers is None else np.isin(self.edge_layer, layers)
+        size = len(self.players)
+        return sparse.coo_matrix((self.count[edges], (self.winner[edges], self.loser[edges])),
+                                 shape=(size, size)).tocsr()
+
+    def head_to_head(self, situations=None, zones=None, start_date=None, end_date=None):
+        """(wins, losses) of every row player against every column player, in the row player's situations and zones.
+
+        A loss is the opponent's win in the mirrored situation and zone, so losses is the
+        transposed win matrix of the mirrored layers.
+        """
+        mirrored_situations = None if situations is None else OPPONENT_SITUATION[np.asarray(situations)]
+        mirrored_zones = None if zones is None else OPPONENT_ZONE[np.asarray(zones)]
+        wins = self.wins(self.select(situations, zones, start_date, end_date))
+        losses = self.wins(self.select(mirrored_situations, mirrored_zones, start_date, end_date)).T.tocsr()
+        return wins, losses
+
+
+def build_faceoff_matrix(store):
+    """Count every faceoff in store into a FaceoffMatrix in one vectorised pass."""
+    game_ids, game_dates, game = store.game_index()
+
+    winner = np.asarray(store['Player'], dtype=np.int64)
+    loser = np.asarray(store['Player 2'], dtype=np.int64)
+    faceoffs = (np.asarray(store['Event']) == store.code('Event', 'Faceoff Win')) & (winner > 0) & (loser > 0)
+    rows = np.flatnonzero(faceoffs)
+    winner, loser = winner[rows], loser[rows]
+
+    # Step 1: Number the (game, situation, zone) layers that have a draw, from the winner's side
+    n_situations = len(SITUATION_CODES)
+    n_zones = len(ZONE_CODES)
+    situation = np.asarray(store['situation'], dtype=np.int64)[rows]
+    x = store['X Coordinate'][rows]
+    zone = np.where(np.isnan(x), ZONE_CODES['NZ'], np.digitize(x, BLUE_LINES))
+    (layer_game, layer_situation, layer_zone), layer, _ = distinct_keys(
+        (game[rows], situation, zone), (len(game_ids), n_situations, n_zones))
+
+    # Step 2: Collapse repeated draws between the same two players into one weighted edge
+    n_players = len(store.names('Player'))
+    edges, _, count = distinct_keys((layer, winner, loser), (len(layer_game), n_players, n_players))
+
+    # Step 3: Each player's team, from the last draw they took
+    player_team = np.zeros(n_players, dtype=np.int64)
+    team = np.asarray(store['Team'], dtype=np.int64)[rows]
+    opponent = np.where(team == store['Home Team'][rows], store['Away Team'][rows], store['Home Team'][rows])
+    player_team[np.concatenate((winner, loser))] = np.concatenate((team, opponent))
+
+    return FaceoffMatrix(game_ids, game_dates, store.names('Team'), store.names('Player'), player_team,
+                         layer_game, layer_situation, layer_zone, *edges, count)
+
+
+def load_faceoff_matrix(file_path, cache_path=None):
+    """The FaceoffMatrix for file_path, kept in a .faceoffs.npz file and rebuilt only when the log has changed."""
+    fields = ['game_ids', 'game_dates', 'teams', 'players', 'player_team', 'layer_game', 'layer_situation',
+              'layer_zone', 'edge_layer', 'winner', 'loser', 'count']
+    return FaceoffMatrix(**load_cached_arrays(file_path, '.faceoffs.npz', build_faceoff_matrix, fields, cache_path))
+
+
+def faceoff_strengths(wins, losses, prior=PRIOR_FACEOFFS, tolerance=1e-10, max_iterations=1000):
+    """Bradley-Terry strength of every player from head_to_head() matrices, an average centre being 1.
+
+    Each player also gets prior draws against an average centre, half of them won, so
+    players who never lost stay finite. The fit is the usual minorisation-maximisation
+    update, done with sparse row sums over the draws each player took:
+        strength = wins / sum over opponents (draws / (strength + opponent's strength)).
+    Players without a draw in the matrices keep strength 1.
+    """
+    draws = (wins + losses).tocoo()
+    won = np.asarray(wins.sum(axis=1)).ravel() + prior / 2
+    strength = np.ones(wins.shape[0])
+    for _ in range(max_iterations):
+        per_draw = draws.data / (strength[draws.row] + strength[draws.col])
+        expected = np.bincount(draws.row, weights=per_draw, minlength=len(strength)) + prior / (strength + 1)
+        updated = won / expected
+        if np.max(np.abs(updated - strength) / strength) < tolerance:
+            return updated
+        strength = updated
+    return strength
+
+
+def adjusted_win_rates(strength):
+    """Chance of every player beating an average centre, from faceoff_strengths()."""
+    return strength / (strength + 1)
+
+
+def rating_rows(matrix, situations=None, zones=None, start_date=None, end_date=None):
+    """Draws, wins, raw and opponent-adjusted win rates of every player who took a draw in the selection."""
+    wins, losses = matrix.head_to_head(situations, zones, start_date, end_date)
+    won = np.asarray(wins.sum(axis=1)).ravel()
+    lost = np.asarray(losses.sum(axis=1)).ravel()
+    adjusted = adjusted_win_rates(faceoff_strengths(wins, losses))
+    rows = []
+    for player in np.flatnonzero(won + lost):
+        rows.append({
+            'Player': str(matrix.players[player]),
+            'Team': str(matrix.teams[matrix.player_team[player]]),
+            'Faceoffs': int(won[player] + lost[player]),
+            'Wins': int(won[player]),
+            'Win Rate': round(float(won[player] / (won[player] + lost[player])), 3),
+            'Adjusted Win Rate': round(float(adjusted[player]), 3),
+        })
+    rows.sort(key=lambda row: (row['Team'], -row['Adjusted Win Rate']))
+    return rows
+
+
+def best_matchups(matrix, opponent, team, situations=None, zones=None, start_date=None, end_date=None,
+                  prior=PRIOR_FACEOFFS):
+    """Players of team ranked by their expected win rate against the opponent centre.
+
+    The expectation starts from both players' strengths and moves towards their own
+    head-to-head record the more draws they have taken against each other. Reads one
+    column of each head-to-head matrix; situations and zones are the team's side of the draw.
+    Raises ValueError when the opponent or the team is not in the matrix.
+    """
+    if opponent not in matrix.players:
+        raise ValueError(f"Unknown player: {opponent}")
+    if team not in matrix.teams:
+        raise ValueError(f"Unknown team: {team}")
+    wins, losses = matrix.head_to_head(situations, zones, start_date, end_date)
+    strength = faceoff_strengths(wins, losses, prior)
+    code = int(np.flatnonzero(matrix.players == opponent)[0])
+    team_code = int(np.flatnonzero(matrix.teams == team)[0])
+
+    candidates = np.flatnonzero((matrix.player_team == team_code) &
+                                (np.asarray((wins + losses).sum(axis=1)).ravel() > 0))
+    won = wins[:, code].toarray().ravel()[candidates]
+    lost = losses[:, code].toarray().ravel()[candidates]
+    expected = strength[candidates] / (strength[candidates] + strength[code])
+    blended = (won + prior * expected) / (won + lost + prior)
+
+    return [
+        {
+            'Player': str(matrix.players[player]),
+            'Head-to-Head Wins': int(w),
+            'Head-to-Head Losses': int(l),
+            'Expected Win Rate': round(float(e), 3),
+        }
+        for player, w, l, e in sorted(zip(candidates, won, lost, blended), key=lambda item: -item[3])
+    ]
+
+
+def save_faceoff_ratings(rows, output_file_path):
+    with open(output_file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['Player', 'Team', 'Faceoffs', 'Wins', 'Win Rate', 'Adjusted Win Rate'])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Faceoff ratings saved to {output_file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rate faceoff takers against the opponents they faced, or pick who should take a draw.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('output_file_path', nargs='?', help="default: the event log's path with _faceoffs added")
+    parser.add_argument('--against', help="opposing centre to pick a draw-taker against (needs --team)")
+    parser.add_argument('--team', help="team picking the draw-taker")
+    parser.add_argument('--situations', nargs='*', choices=list(SITUATION_CODES), help="situations to include (default: all)")
+    parser.add_argument('--zones', nargs='*', choices=list(ZONE_CODES), help="zones to include, from the rated player's side (default: all)")
+    parser.add_argument('--dates', nargs=2, default=(None, None), metavar=('START', 'END'), help="inclusive date range")
+    args = parser.parse_args()
+
+    if args.against and not args.team:
+        parser.error("--against needs --team")
+    matrix = load_faceoff_matrix(args.file_path)
+    if args.against and args.against not in matrix.players:
+        parser.error(f"unknown player for --against: {args.against}")
+    if args.team and args.team not in matrix.teams:
+        parser.error(f"unknown team for --team: {args.team}")
+    situations = None if args.situations is None else [SITUATION_CODES[name] for name in args.situations]
+    zones = None if args.zones is None else [ZONE_CODES[name] for name in args.zones]
+    selection = (situations, zones, *args.dates)
+    if args.against:
+        for row in best_matchups(matrix, args.against, args.team, *selection):
+            print(f"{row['Player']}: {row['Expected Win Rate']:.3f} "
+                  f"({row['Head-to-Head Wins']}-{row['Head-to-Head Losses']} head to head)")
+    else:
+        output_file_path = args.output_file_path or os.path.splitext(args.file_path)[0] + '_faceoffs.csv'
+        save_faceoff_ratings(rating_rows(matrix, *selection), output_file_path)
@@ -0,0 +1,75 @@
+import numpy as np
+
+from shot_model import in_danger_zone
+
+# Rink grid the densities are binned on, one cell per square foot
+RINK_LENGTH = 200
+RINK_WIDTH = 85
+
+# Gaussian smoothing in feet. Fixed rather than fitted per map, so any two densities compare cell for cell.
+DENSITY_SIGMA = 4.0
+
+
+def shot_rows(store, teams=None, players=None, situation=None, danger_zone=False, event='Shot'):
+    """Row indices of the events plotted on a shot map, selected with boolean masks.
+
+    Only the Event column is scanned in full. Team, Player, situation and coordinates are
+    read at the matching events alone, so a memory-mapped store never loads the rest.
+    Shots without both coordinates are always left out.
+    """
+    rows = np.flatnonzero(store['Event'] == store.code('Event', event))
+    if teams is not None:
+        rows = rows[np.isin(store['Team'][rows], [store.code('Team', team) for team in teams])]
+    if players is not None:
+        rows = rows[np.isin(store['Player'][rows], [store.code('Player', player) for player in players])]
+    if situation is not None:
+        rows = rows[store['situation'][rows] == situation]
+
+    x = store['X Coordinate'][rows]
+    y = store['Y Coordinate'][rows]
+    keep = ~np.isnan(x) & ~np.isnan(y)
+    if danger_zone:
+        # On the raw (unmirrored) coordinates, like the reports' danger zone counts
+        keep &= in_danger_zone(x, y)
+    return rows[keep]
+
+
+def shot_coordinates(store, teams=None, players=None, situation=None, danger_zone=False, event='Shot'):
+    """X and Y coordinate arrays of the shots selected by shot_rows()."""
+    rows = shot_rows(store, teams, players, situation, danger_zone, event)
+    return np.asarray(store['X Coordinate'][rows]), np.asarray(store['Y Coordinate'][rows])
+
+
+def gaussian_matrix(size, sigma):
+    """Matrix that smooths a length-size axis with a Gaussian of sigma cells.
+
+    Column j spreads whatever is in cell j over the axis. Each column is normalised, so a
+    shot on or near the boards keeps its full weight instead of losing the part of its
+    Gaussian that falls off the grid.
+    """
+    offsets = np.arange(size)
+    matrix = np.exp(-0.5 * ((offsets[:, None] - offsets[None, :]) / sigma)**2)
+    return matrix / matrix.sum(axis=0, keepdims=True)
+
+
+def smoothed_counts(x_coord, y_coord, sigma=DENSITY_SIGMA):
+    """Shot counts on the RINK_LENGTH x RINK_WIDTH grid, smoothed so every shot still adds up to 1.
+
+    Shots are binned with np.histogram2d and smoothed one axis at a time (the Gaussian is
+    separable), so the cost depends on the grid size rather than on the number of shots.
+    """
+    counts, _, _ = np.histogram2d(x_coord, y_coord, bins=(RINK_LENGTH, RINK_WIDTH),
+                                  range=((0, RINK_LENGTH), (0, RINK_WIDTH)))
+    if sigma:
+        counts = gaussian_matrix(RINK_LENGTH, sigma) @ counts @ gaussian_matrix(RINK_WIDTH, sigma).T
+    return counts
+
+
+def shot_density(x_coord, y_coord, sigma=DENSITY_SIGMA):
+    """Smoothed shot density on the RINK_LENGTH x RINK_WIDTH grid, summing to 1 (or all zero).
+
+    Every shot carries the same weight wherever it was taken (see smoothed_counts()).
+    """
+    counts = smoothed_counts(x_coord, y_coord, sigma)
+    total = counts.sum()
+    return counts / total if total else counts
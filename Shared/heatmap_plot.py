@@ -0,0 +1,24 @@
+import matplotlib.pyplot as plt
+import numpy as np
+
+from heatmap import RINK_LENGTH, RINK_WIDTH
+
+# Share of the peak density below which cells are left blank, like kdeplot's default thresh
+DENSITY_THRESHOLD = 0.05
+
+
+def draw_density(density, title, ax=None, levels=10, cmap="YlGnBu"):
+    """Draw a density from heatmap.shot_density() as filled contours on ax (default: current axes)."""
+    if ax is None:
+        ax = plt.gca()
+    peak = density.max()
+    if peak > 0:
+        x_centers = np.arange(RINK_LENGTH) + 0.5
+        y_centers = np.arange(RINK_WIDTH) + 0.5
+        ax.contourf(x_centers, y_centers, density.T, levels=np.linspace(DENSITY_THRESHOLD * peak, peak, levels), cmap=cmap)
+    ax.set_xlim(0, RINK_LENGTH)
+    ax.set_ylim(0, RINK_WIDTH)
+    ax.set_title(title)
+    ax.set_xlabel("X Coordinate (Feet)")
+    ax.set_ylabel("Y Coordinate (Feet)")
+    return ax
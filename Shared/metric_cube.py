@@ -0,0 +1,126 @@
+import argparse
+
+import numpy as np
+
+from event_store import EVEN_STRENGTH, POWERPLAY, SHORTHANDED, distinct_keys, load_cached_arrays
+
+# Situation names accepted by queries, mapped to the store's situation codes
+SITUATION_CODES = {
+    'ES': EVEN_STRENGTH,
+    'PP': POWERPLAY,
+    'SH': SHORTHANDED,
+}
+
+
+class MetricCube:
+    """Cumulative event counts along the game axis, per (team, player) pair, situation and event.
+
+    prefix[g] holds the counts of every game before game g, so the counts over any run of
+    games (and any date range, games being in date order) are prefix[stop] - prefix[start].
+    Only (team, player) pairs that occur are kept rather than every team x player product;
+    a pair's player is '' for events without one. Counts are credited to the event's Team
+    and Player, in the event team's situation.
+    """
+
+    def __init__(self, game_dates, pair_teams, pair_players, events, prefix):
+        self.game_dates = game_dates
+        self.pair_teams = pair_teams
+        self.pair_players = pair_players
+        self.events = events
+        self.prefix = prefix
+        self._event_index = {event: i for i, event in enumerate(events.tolist())}
+
+    def game_range(self, start_date=None, end_date=None):
+        """(start, stop) game indices of the games played between the dates, inclusive; None leaves an end open."""
+        start = 0 if start_date is None else int(np.searchsorted(self.game_dates, start_date, side='left'))
+        stop = len(self.game_dates) if end_date is None else int(np.searchsorted(self.game_dates, end_date, side='right'))
+        return start, max(start, stop)
+
+    def pairs(self, teams=None, players=None):
+        """Indices of the (team, player) pairs for any of teams and any of players; None selects all."""
+        selected = np.ones(len(self.pair_teams), dtype=bool)
+        if teams is not None:
+            selected &= np.isin(self.pair_teams, teams)
+        if players is not None:
+            selected &= np.isin(self.pair_players, players)
+        return np.flatnonzero(selected)
+
+    def window(self, start_date=None, end_date=None):
+        """(pairs x situations x events) counts over the games between the dates."""
+        start, stop = self.game_range(start_date, end_date)
+        return self.prefix[stop] - self.prefix[start]
+
+    def event_columns(self, events):
+        """Event axis indices of an event name or list of names, each once; names that never occur are skipped."""
+        events = [events] if isinstance(events, str) else events
+        return sorted({self._event_index[event] for event in events if event in self._event_index})
+
+    def count(self, events, teams=None, players=None, situations=None, start_date=None, end_date=None):
+        """Number of events of the given types in the selection, from two prefix rows.
+
+        situations is a list of SITUATION_CODES values; None selects every situation. The
+        cost depends on the size of the selection, never on the number of games or events.
+        """
+        start, stop = self.game_range(start_date, end_date)
+        situations = range(self.prefix.shape[2]) if situations is None else sorted(set(situations))
+        index = np.ix_(self.pairs(teams, players), list(situations), self.event_columns(events))
+        return int(self.prefix[stop][index].sum() - self.prefix[start][index].sum())
+
+    def rate(self, events, of_events, teams=None, players=None, situations=None, start_date=None, end_date=None):
+        """count(events) / count(of_events) over the same selection, or 0 when there are none."""
+        total = self.count(of_events, teams, players, situations, start_date, end_date)
+        return self.count(events, teams, players, situations, start_date, end_date) / total if total else 0
+
+    def totals(self, events, by='Team', situations=None, start_date=None, end_date=None):
+        """Counts of events for every team (by='Team') or player (by='Player') in the window, keyed by name."""
+        counts = self.window(start_date, end_date)
+        if situations is not None:
+            counts = counts[:, sorted(set(situations))]
+        per_pair = counts[:, :, self.event_columns(events)].sum(axis=(1, 2))
+        keys = self.pair_teams if by == 'Team' else self.pair_players
+        names, inverse = np.unique(keys, return_inverse=True)
+        return dict(zip(names.tolist(), np.bincount(inverse, weights=per_pair, minlength=len(names)).astype(np.int64).tolist()))
+
+
+def build_metric_cube(store):
+    """Count every event of store into a MetricCube in one vectorised pass."""
+    game_ids, game_dates, game = store.game_index()
+
+    # Number the (team, player) pairs that occur
+    n_teams, n_players = len(store.names('Team')), len(store.names('Player'))
+    (pair_teams, pair_players), pair, _ = distinct_keys((store['Team'], store['Player']), (n_teams, n_players))
+
+    events = store.names('Event')
+    n_situations = len(SITUATION_CODES)
+    shape = (len(game_ids), len(pair_teams), n_situations, len(events))
+    flat = np.ravel_multi_index((game, pair, np.asarray(store['situation']), np.asarray(store['Event'])), shape)
+    counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+
+    prefix = np.zeros((len(game_ids) + 1,) + shape[1:], dtype=np.int64)
+    np.cumsum(counts, axis=0, out=prefix[1:])
+    return MetricCube(game_dates, store.names('Team')[pair_teams], store.names('Player')[pair_players], events, prefix)
+
+
+def load_metric_cube(file_path, cube_path=None):
+    """The MetricCube for file_path, kept in a .cube.npz file and rebuilt only when the log has changed."""
+    fields = ['game_dates', 'pair_teams', 'pair_players', 'events', 'prefix']
+    return MetricCube(**load_cached_arrays(file_path, '.cube.npz', build_metric_cube, fields, cube_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count events for any team, player, situation and date range from the metric cube.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('events', nargs='+', help="event types to count, e.g. Goal Shot")
+    parser.add_argument('--of', nargs='*', help="also print the count as a rate of these event types")
+    parser.add_argument('--teams', nargs='*', help="teams to count (default: all)")
+    parser.add_argument('--players', nargs='*', help="players to count (default: all)")
+    parser.add_argument('--situations', nargs='*', choices=list(SITUATION_CODES), help="situations to count (default: all)")
+    parser.add_argument('--dates', nargs=2, default=(None, None), metavar=('START', 'END'), help="inclusive date range")
+    args = parser.parse_args()
+
+    cube = load_metric_cube(args.file_path)
+    situations = None if args.situations is None else [SITUATION_CODES[name] for name in args.situations]
+    selection = (args.teams, args.players, situations, *args.dates)
+    print(cube.count(args.events, *selection))
+    if args.of:
+        print(f"{cube.rate(args.events, args.of, *selection):.3f}")
@@ -0,0 +1,237 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import shortest_path
+
+from event_store import distinct_keys, load_cached_arrays
+from metric_cube import SITUATION_CODES
+
+# Upper edges of the pass distance bins, in feet; the last bin is open
+DISTANCE_BINS = [15, 30, 45, 60, 90]
+# Pass directions are binned into this many equal sectors, counter-clockwise from the +x axis
+DIRECTION_SECTORS = 8
+
+
+class PassNetworks:
+    """Completed passes per (game, team, situation) network, kept as sparse passer x receiver counts.
+
+    Network k is game network_game[k] (an index into game_ids), team network_team[k] and
+    situation network_situation[k]. Edge e carries count[e] passes from player passer[e] to
+    player receiver[e] within network edge_network[e]. Nodes are the store's player codes
+    in every network, so a team's tournament network is the sum of its game networks.
+    distances and directions hold each network's pass distance and direction histograms.
+    """
+
+    def __init__(self, game_ids, game_dates, teams, players, network_game, network_team, network_situation,
+                 edge_network, passer, receiver, count, distances, directions):
+        self.game_ids = game_ids
+        self.game_dates = game_dates
+        self.teams = teams
+        self.players = players
+        self.network_game = network_game
+        self.network_team = network_team
+        self.network_situation = network_situation
+        self.edge_network = edge_network
+        self.passer = passer
+        self.receiver = receiver
+        self.count = count
+        self.distances = distances
+        self.directions = directions
+
+    def __len__(self):
+        return len(self.network_game)
+
+    def select(self, teams=None, situations=None, start_date=None, end_date=None):
+        """Indices of the networks for any of teams (names) and situations, in the inclusive date range."""
+        dates = self.game_dates[self.network_game]
+        selected = np.ones(len(self), dtype=bool)
+        if teams is not None:
+            selected &= np.isin(self.teams[self.network_team], teams)
+        if situations is not None:
+            selected &= np.isin(self.network_situation, situations)
+        if start_date is not None:
+            selected &= dates >= start_date
+        if end_date is not None:
+            selected &= dates <= end_date
+        return np.flatnonzero(selected)
+
+    def matrix(self, networks=None):
+        """Sparse (players x players) pass counts summed over networks (default: all), in CSR form."""
+        edges = slice(None) if networks is None else np.isin(self.edge_network, networks)
+        size = len(self.players)
+        # Duplicate (passer, receiver) entries from different networks are summed on conversion
+        return sparse.coo_matrix((self.count[edges], (self.passer[edges], self.receiver[edges])),
+                                 shape=(size, size)).tocsr()
+
+    def matrices(self):
+        """One CSR matrix per network, in network order; sum() any of them for a longer stretch of games."""
+        return [self.matrix([network]) for network in range(len(self))]
+
+    def distance_histogram(self, networks=None):
+        """Passes per DISTANCE_BINS bin, summed over networks (default: all)."""
+        return self.distances[slice(None) if networks is None else networks].sum(axis=0)
+
+    def direction_histogram(self, networks=None):
+        """Passes per direction sector, summed over networks (default: all)."""
+        return self.directions[slice(None) if networks is None else networks].sum(axis=0)
+
+
+def build_pass_networks(store):
+    """Count every completed pass in store into PassNetworks in one vectorised pass.
+
+    A pass is a 'Play' event (Direct or Indirect) from Player to Player 2, credited to the
+    event team in its situation. Distances and directions use passes with both ends located.
+    """
+    game_ids, game_dates, game = store.game_index()
+
+    passer = np.asarray(store['Player'], dtype=np.int64)
+    receiver = np.asarray(store['Player 2'], dtype=np.int64)
+    passes = (np.asarray(store['Event']) == store.code('Event', 'Play')) & (passer > 0) & (receiver > 0)
+    rows = np.flatnonzero(passes)
+    passer, receiver = passer[rows], receiver[rows]
+
+    # Step 1: Number the (game, team, situation) networks that have a pass
+    n_teams = len(store.names('Team'))
+    n_situations = len(SITUATION_CODES)
+    team = np.asarray(store['Team'], dtype=np.int64)[rows]
+    situation = np.asarray(store['situation'], dtype=np.int64)[rows]
+    (network_game, network_team, network_situation), network, _ = distinct_keys(
+        (game[rows], team, situation), (len(game_ids), n_teams, n_situations))
+
+    # Step 2: Collapse repeated passes between the same two players into one weighted edge
+    n_players = len(store.names('Player'))
+    n_networks = len(network_game)
+    edges, _, count = distinct_keys((network, passer, receiver), (n_networks, n_players, n_players))
+
+    # Step 3: Histogram every network's pass distances and directions
+    dx = store['X Coordinate 2'][rows] - store['X Coordinate'][rows]
+    dy = store['Y Coordinate 2'][rows] - store['Y Coordinate'][rows]
+    located = ~np.isnan(dx) & ~np.isnan(dy)
+    distance_bin = np.digitize(np.hypot(dx[located], dy[located]), DISTANCE_BINS)
+    sector = (np.arctan2(dy[located], dx[located]) % (2 * np.pi) // (2 * np.pi / DIRECTION_SECTORS)).astype(np.int64)
+    n_bins = len(DISTANCE_BINS) + 1
+    distances = np.bincount(network[located] * n_bins + distance_bin,
+                            minlength=n_networks * n_bins).reshape(n_networks, n_bins)
+    directions = np.bincount(network[located] * DIRECTION_SECTORS + np.minimum(sector, DIRECTION_SECTORS - 1),
+                             minlength=n_networks * DIRECTION_SECTORS).reshape(n_networks, DIRECTION_SECTORS)
+
+    return PassNetworks(game_ids, game_dates, store.names('Team'), store.names('Player'),
+                        network_game, network_team, network_situation, *edges, count, distances, directions)
+
+
+def load_pass_networks(file_path, cache_path=None):
+    """The PassNetworks for file_path, kept in a .passes.npz file and rebuilt only when the log has changed."""
+    fields = ['game_ids', 'game_dates', 'teams', 'players', 'network_game', 'network_team', 'network_situation',
+              'edge_network', 'passer', 'receiver', 'count', 'distances', 'directions']
+    return PassNetworks(**load_cached_arrays(file_path, '.passes.npz', build_pass_networks, fields, cache_path))
+
+
+def weighted_degree(matrix):
+    """(passes made, passes received) by every node of a pass matrix."""
+    return np.asarray(matrix.sum(axis=1)).ravel(), np.asarray(matrix.sum(axis=0)).ravel()
+
+
+def eigenvector_centrality(matrix):
+    """Eigenvector centrality of every node, on pass volume in either direction, scaled so the top node is 1.
+
+    Nodes outside the component holding the leading eigenvector get 0, so score one team at a time.
+    """
+    symmetric = (matrix + matrix.T).toarray().astype(float)
+    if not symmetric.any():
+        return np.zeros(len(symmetric))
+    _, vectors = np.linalg.eigh(symmetric)
+    leading = np.abs(vectors[:, -1])
+    return leading / leading.max()
+
+
+def betweenness_centrality(matrix):
+    """Number of shortest passing paths between other players that run through each node.
+
+    A link's length is 1 / the passes along it, so frequent connections are short. Paths are
+    read off the all-pairs predecessor matrix, walking every (source, target) pair back one
+    step at a time together; ties between equally short paths go to the one found first.
+    """
+    n = matrix.shape[0]
+    lengths = matrix.astype(float)
+    lengths.data = 1 / lengths.data
+    _, predecessors = shortest_path(lengths, directed=True, return_predecessors=True)
+
+    sources, targets = np.nonzero(predecessors >= 0)
+    step = predecessors[sources, targets]
+    betweenness = np.zeros(n, dtype=np.int64)
+    inner = step != sources
+    while inner.any():
+        sources, step = sources[inner], step[inner]
+        np.add.at(betweenness, step, 1)
+        step = predecessors[sources, step]
+        inner = step != sources
+    return betweenness
+
+
+def centrality_rows(networks, teams=None, situations=None, start_date=None, end_date=None):
+    """Per-player pass counts and centralities over the selected networks, one team at a time."""
+    selected = networks.select(teams, situations, start_date, end_date)
+    rows = []
+    for team in np.unique(networks.network_team[selected]):
+        matrix = networks.matrix(selected[networks.network_team[selected] == team])
+        nodes = np.flatnonzero(np.asarray((matrix + matrix.T).sum(axis=1)).ravel())
+        team_matrix = matrix[nodes][:, nodes]
+        made, received = weighted_degree(team_matrix)
+        eigenvector = eigenvector_centrality(team_matrix)
+        betweenness = betweenness_centrality(team_matrix)
+        for i in np.argsort(-eigenvector, kind='stable'):
+            rows.append({
+                'Team': str(networks.teams[team]),
+                'Player': str(networks.players[nodes[i]]),
+                'Passes Made': int(made[i]),
+                'Passes Received': int(received[i]),
+                'Eigenvector Centrality': round(float(eigenvector[i]), 3),
+                'Betweenness': int(betweenness[i]),
+            })
+    return rows
+
+
+def shape_rows(networks, teams=None, situations=None, start_date=None, end_date=None):
+    """Per-team pass distance and direction histograms over the selected networks."""
+    selected = networks.select(teams, situations, start_date, end_date)
+    bounds = [0] + DISTANCE_BINS
+    distance_headers = [f"{low}-{high} ft" for low, high in zip(bounds, DISTANCE_BINS)] + [f"{DISTANCE_BINS[-1]}+ ft"]
+    width = 360 // DIRECTION_SECTORS
+    direction_headers = [f"{sector * width}-{(sector + 1) * width} deg" for sector in range(DIRECTION_SECTORS)]
+    rows = []
+    for team in np.unique(networks.network_team[selected]):
+        team_networks = selected[networks.network_team[selected] == team]
+        row = {'Team': str(networks.teams[team])}
+        row.update(zip(distance_headers, networks.distance_histogram(team_networks).tolist()))
+        row.update(zip(direction_headers, networks.direction_histogram(team_networks).tolist()))
+        rows.append(row)
+    return rows
+
+
+def save_rows(rows, output_file_path, label):
+    with open(output_file_path, 'w', newline='') as file:
+        if rows:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    print(f"{label} saved to {output_file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build pass networks and write player centralities and team pass shapes.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('output_file_path', nargs='?', help="default: the event log's path with _passes added")
+    parser.add_argument('--teams', nargs='*', help="teams to include (default: all)")
+    parser.add_argument('--situations', nargs='*', choices=list(SITUATION_CODES), help="situations to include (default: all)")
+    parser.add_argument('--dates', nargs=2, default=(None, None), metavar=('START', 'END'), help="inclusive date range")
+    args = parser.parse_args()
+
+    networks = load_pass_networks(args.file_path)
+    situations = None if args.situations is None else [SITUATION_CODES[name] for name in args.situations]
+    selection = (args.teams, situations, *args.dates)
+    output_file_path = args.output_file_path or os.path.splitext(args.file_path)[0] + '_passes.csv'
+    save_rows(centrality_rows(networks, *selection), output_file_path, "Pass centralities")
+    save_rows(shape_rows(networks, *selection), os.path.splitext(output_file_path)[0] + '_shapes.csv', "Pass shapes")
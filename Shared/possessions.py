@@ -0,0 +1,141 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from event_store import load_event_store
+
+# Seconds after a zone entry in which the entering team's shots count towards it
+ENTRY_SHOT_WINDOW = 10
+
+# Entry types compared by the command line summary
+ENTRY_TYPES = ['Carried', 'Dumped', 'Played']
+
+
+class Possessions:
+    """Possession chains of an event store: the possession each event belongs to and where in it.
+
+    possession[i] numbers event i's possession across the store, in event order, and
+    sequence[i] is its position there (0 for the event that starts it). team[p], first[p]
+    and last[p] give possession p's team and its first and last rows, so a possession's
+    events are always the contiguous rows first[p] to last[p].
+    """
+
+    def __init__(self, possession, sequence, elapsed, team, first, last):
+        self.possession = possession
+        self.sequence = sequence
+        self.elapsed = elapsed
+        self.team = team
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return len(self.first)
+
+    @property
+    def length(self):
+        """Number of events in every possession."""
+        return self.last - self.first + 1
+
+    @property
+    def duration(self):
+        """Seconds from every possession's first event to its last."""
+        return self.elapsed[self.last] - self.elapsed[self.first]
+
+    def join(self, left, right, window):
+        """(left row, right row) pairs where the right row follows the left one in its possession, at most window seconds later.
+
+        left and right are row masks, e.g. entries and shots. Both are walked in row order,
+        where (possession, elapsed) never decreases, so each left row finds its matches with
+        two binary searches (a sorted merge-join) and nothing is compared pairwise.
+        """
+        left_rows = np.flatnonzero(left)
+        right_rows = np.flatnonzero(right)
+        span = int(self.elapsed.max(initial=0)) + window + 1
+        keys = self.possession.astype(np.int64) * span + self.elapsed
+
+        # Matches are the right rows after the left row, up to the last one within the window
+        low = np.searchsorted(right_rows, left_rows, side='right')
+        high = np.searchsorted(keys[right_rows], keys[left_rows] + window, side='right')
+        counts = np.maximum(high - low, 0)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(left_rows, counts), right_rows[np.repeat(low, counts) + offsets]
+
+    def count_within(self, left, right, window):
+        """Per row, how many right rows join() matches to it (0 outside left)."""
+        left_rows, _ = self.join(left, right, window)
+        return np.bincount(left_rows, minlength=len(self.possession))
+
+
+def build_possessions(store):
+    """Split store's events into Possessions in one ordered, vectorised pass.
+
+    A possession starts at each game's and each period's first event, at every faceoff and
+    whenever the event team changes, so a turnover, takeaway or recovery by the other side
+    ends it.
+    """
+    team = np.asarray(store['Team'])
+    period = np.asarray(store['Period'])
+    game_starts = [rows.start for _, rows in store.game_slices()]
+
+    starts = np.zeros(len(team), dtype=bool)
+    starts[game_starts] = True
+    starts[1:] |= (team[1:] != team[:-1]) | (period[1:] != period[:-1])
+    starts |= np.asarray(store['Event']) == store.code('Event', 'Faceoff Win')
+
+    first = np.flatnonzero(starts)
+    possession = np.cumsum(starts) - 1
+    sequence = np.arange(len(team)) - first[possession]
+    last = np.append(first[1:], len(team)) - 1
+    return Possessions(possession, sequence, np.asarray(store['elapsed_seconds'], dtype=np.int64),
+                       team[first], first, last)
+
+
+def entry_shot_summary(store, window=ENTRY_SHOT_WINDOW):
+    """Rows of entries and the shots following them within window seconds, per team and entry type."""
+    possessions = build_possessions(store)
+    event = np.asarray(store['Event'])
+    entries = event == store.code('Event', 'Zone Entry')
+    shots = (event == store.code('Event', 'Shot')) | (event == store.code('Event', 'Goal'))
+    entry_shots = possessions.count_within(entries, shots, window)
+
+    team = np.asarray(store['Team'])
+    detail = np.asarray(store['Detail 1'])
+    n_teams = len(store.names('Team'))
+    rows = []
+    for entry_type in ENTRY_TYPES:
+        typed = entries & (detail == store.code('Detail 1', entry_type))
+        counts = np.bincount(team[typed], minlength=n_teams)
+        shot_counts = np.bincount(team[typed], weights=entry_shots[typed], minlength=n_teams).astype(np.int64)
+        for code in np.flatnonzero(counts):
+            rows.append({
+                'Team': store.decode('Team', code),
+                'Entry Type': entry_type,
+                'Entries': counts[code].item(),
+                'Shots': shot_counts[code].item(),
+                'Shots Per Entry': round(shot_counts[code].item() / counts[code].item(), 3),
+            })
+    rows.sort(key=lambda row: (row['Team'], ENTRY_TYPES.index(row['Entry Type'])))
+    return rows
+
+
+def save_entry_shot_summary(rows, output_file_path):
+    with open(output_file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['Team', 'Entry Type', 'Entries', 'Shots', 'Shots Per Entry'])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Entry shot summary saved to {output_file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the shots teams get within a few seconds of carried, dumped and played zone entries.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('output_file_path', nargs='?', help="default: the event log's path with _entry_shots added")
+    parser.add_argument('--window', type=int, default=ENTRY_SHOT_WINDOW, help="seconds after each entry")
+    parser.add_argument('--dates', nargs=2, default=(None, None), metavar=('START', 'END'), help="inclusive date range (default: every game)")
+    args = parser.parse_args()
+
+    store = load_event_store(args.file_path).between(*args.dates)
+    output_file_path = args.output_file_path or os.path.splitext(args.file_path)[0] + '_entry_shots.csv'
+    save_entry_shot_summary(entry_shot_summary(store, args.window), output_file_path)
@@ -0,0 +1,125 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import matplotlib
+matplotlib.use('Agg')  # Headless: the pack is written to files, never shown
+import matplotlib.pyplot as plt
+import numpy as np
+
+from density_cache import DensityCache, density_cache_dir, subject_density
+from event_store import EVEN_STRENGTH, POWERPLAY, SHORTHANDED, load_event_store
+from heatmap_plot import draw_density
+
+# Label used in titles and file names for each situation; None plots every shot
+SITUATION_LABELS = {
+    None: 'All',
+    EVEN_STRENGTH: 'ES',
+    POWERPLAY: 'PP',
+    SHORTHANDED: 'SH',
+}
+
+
+def heatmap_jobs(subjects, situations, date_ranges, danger_zone=False):
+    """Every (subject, situation, date range, danger zone) combination to render.
+
+    A subject is ('Team', name) or ('Player', name); a date range is (start, end), where
+    None leaves that end open.
+    """
+    return [
+        (subject, situation, date_range, danger_zone)
+        for subject in subjects
+        for situation in situations
+        for date_range in date_ranges
+    ]
+
+
+def short_name(name):
+    """'Olympic (Women) - Canada' -> 'Canada'; player names are unchanged."""
+    return name.split(' - ')[-1]
+
+
+def heatmap_title(job):
+    (column, name), situation, (start_date, end_date), danger_zone = job
+    title = f"Heatmap of {short_name(name)}'s {SITUATION_LABELS[situation]} Shots"
+    if danger_zone:
+        title += " from the Danger Zone"
+    if start_date is not None or end_date is not None:
+        title += f" ({start_date or 'start'} to {end_date or 'end'})"
+    return title
+
+
+def heatmap_file_name(job):
+    """File name in the style of 'PP Heatmap Canada DZ .png', with the date range when one is set."""
+    (column, name), situation, (start_date, end_date), danger_zone = job
+    parts = [SITUATION_LABELS[situation], 'Heatmap', short_name(name).replace('/', '-')]
+    if danger_zone:
+        parts.append('DZ')
+    if start_date is not None or end_date is not None:
+        parts.append(f"{start_date or 'start'}_{end_date or 'end'}")
+    return ' '.join(parts) + '.png'
+
+
+def render_jobs(file_path, output_dir, jobs):
+    """Render jobs one after another on a single reused figure; returns the PNG paths.
+
+    Densities come from the density cache, so re-rendering after a styling change only draws.
+    """
+    # Memory-mapped, so nothing is read unless a density is missing from the cache
+    store = load_event_store(file_path)
+    cache = DensityCache(density_cache_dir(file_path))
+    figure, ax = plt.subplots(figsize=(10, 6))
+    paths = []
+    for job in jobs:
+        (column, name), situation, date_range, danger_zone = job
+        density = subject_density(file_path, column, [name], situation, danger_zone, tuple(date_range), cache, store)
+
+        ax.clear()
+        draw_density(density, heatmap_title(job), ax)
+        path = os.path.join(output_dir, heatmap_file_name(job))
+        figure.savefig(path)
+        paths.append(path)
+    plt.close(figure)
+    return paths
+
+
+def render_heatmaps(file_path, output_dir, jobs, workers=None):
+    """Write one PNG per job into output_dir, on workers processes when workers > 1.
+
+    Returns the PNG paths in job order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # Build (or refresh) the store cache once, before any worker opens it
+    load_event_store(file_path)
+    if workers is None or workers <= 1:
+        return render_jobs(file_path, output_dir, jobs)
+
+    # A few chunks per worker keeps the pool busy; each chunk reuses one figure
+    bounds = np.linspace(0, len(jobs), min(workers * 4, len(jobs)) + 1).astype(int)
+    chunks = [jobs[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(render_jobs, [file_path] * len(chunks), [output_dir] * len(chunks), chunks)
+        return [path for paths in results for path in paths]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a shot map pack: every subject x situation x date range.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('output_dir', help="folder the PNGs are written to")
+    parser.add_argument('--teams', nargs='*', help="teams to map (default: every team when no players are given)")
+    parser.add_argument('--players', nargs='*', default=[], help="players to map")
+    parser.add_argument('--dates', nargs=2, action='append', metavar=('START', 'END'), help="date range, may be repeated")
+    parser.add_argument('--situations', nargs='*', default=list(SITUATION_LABELS.values()),
+                        choices=list(SITUATION_LABELS.values()), help="situations to map")
+    parser.add_argument('--danger-zone', action='store_true', help="only plot danger zone shots")
+    parser.add_argument('--workers', type=int, help="render on this many processes")
+    args = parser.parse_args()
+
+    teams = args.teams
+    if teams is None and not args.players:
+        teams = [str(name) for name in load_event_store(args.file_path).vocabularies['teams'] if name]
+    subjects = [('Team', team) for team in teams or []] + [('Player', player) for player in args.players]
+    situations = [situation for situation, label in SITUATION_LABELS.items() if label in args.situations]
+    jobs = heatmap_jobs(subjects, situations, args.dates or [(None, None)], args.danger_zone)
+    paths = render_heatmaps(args.file_path, args.output_dir, jobs, args.workers)
+    print(f"{len(paths)} heatmaps saved to {args.output_dir}")
@@ -0,0 +1,116 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from bootstrap import game_arrays, played_games, replicate_analysis
+from engine import merge_analyses, reduce_analyses
+from event_store import EVEN_STRENGTH, POWERPLAY, SHORTHANDED, load_event_store
+from run_all_reports import load_report
+
+# Category names of metrics reported per situation, as the Prescout and Postgame reports use them
+SITUATION_NAMES = {
+    EVEN_STRENGTH: 'even_strength',
+    POWERPLAY: 'powerplay',
+    SHORTHANDED: 'shorthanded',
+}
+
+# Games in each rolling window unless one is given
+FORM_WINDOW = 5
+
+
+def window_totals(arrays, played, window=None):
+    """Each accumulator summed over every code's last window games up to each game.
+
+    arrays are game_arrays() and played the matching played_games() mask. The window is
+    counted in the games each code played in, and window=None sums every game so far.
+    Sums come from one running total per accumulator, so the cost does not grow with the window.
+    Returns {name: (games x codes ...) array}, plus the number of games in each window.
+    """
+    n_games, n_codes = played.shape
+    appearances = np.cumsum(played, axis=0)
+    start = np.zeros(played.shape, dtype=np.int64)
+    if window is not None:
+        # Game index of every code's n-th appearance, codes in rows
+        codes, games = np.nonzero(played.T)
+        nth_game = np.zeros((n_codes, n_games), dtype=np.int64)
+        nth_game[codes, np.arange(len(codes)) - np.searchsorted(codes, codes)] = games
+        # A window of the last window appearances starts at appearance number appearances - window
+        earliest = appearances - window
+        start = np.where(earliest > 0, nth_game[np.arange(n_codes), np.maximum(earliest, 0)], 0)
+
+    columns = np.arange(n_codes)
+    totals = {}
+    for name, array in arrays.items():
+        running = np.concatenate((np.zeros((1,) + array.shape[1:], dtype=array.dtype), np.cumsum(array, axis=0)))
+        totals[name] = running[1:] - running[start, columns]
+    games_in_window = appearances if window is None else np.minimum(appearances, window)
+    return totals, games_in_window
+
+
+def rolling_form(store, analysis, window=FORM_WINDOW, workers=None):
+    """Long-format rows of analysis's window_metrics() over each code's last window games.
+
+    One row per code for every game it played in (and per category for metrics reported per
+    situation), with the game's date and id and the number of games in the window.
+    window=None gives the expanding form over every game so far.
+    """
+    store, games = reduce_analyses(store, [analysis], workers)
+    merge_analyses(store, [analysis], games)
+    covered = [(game_id, rows, records[0]) for (game_id, rows), records in zip(store.game_slices(), games)
+               if records[0] is not None]
+    records = [record for _, _, record in covered]
+
+    played = played_games(analysis, records)
+    totals, games_in_window = window_totals(game_arrays(analysis, records), played, window)
+    metrics = replicate_analysis(analysis, totals).window_metrics()
+    names = analysis.store.names(analysis.code_column)[analysis.order].tolist()
+    dates = store['game_date']
+    per_situation = any(values.ndim == 3 for values in metrics.values())
+    categories = SITUATION_NAMES.items() if per_situation else [(None, None)]
+
+    rows = []
+    for game, code in zip(*np.nonzero(played)):
+        game_id, game_rows, _ = covered[game]
+        for situation, category in categories:
+            row = {'Date': str(dates[game_rows.start]), 'Game': game_id, analysis.code_column: names[code],
+                   'Games': games_in_window[game, code].item()}
+            if category is not None:
+                row['Category'] = category
+            for column, values in metrics.items():
+                row[column] = (values[game, code, situation] if values.ndim == 3 else values[game, code]).item()
+            rows.append(row)
+    return rows
+
+
+def save_rolling_form(rows, output_file_path):
+    """Write rolling_form() rows to CSV; undefined rates are left blank."""
+    with open(output_file_path, 'w', newline='') as file:
+        if rows:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({
+                    column: ('' if value != value else round(value, 4)) if isinstance(value, float) else value
+                    for column, value in row.items()
+                })
+    print(f"Rolling form saved to {output_file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a report's key metrics over each team's or player's last K games.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('script_path', help="report script relative to the repository root, e.g. PlayerValueScore/PlayerValueScore_new.py")
+    parser.add_argument('output_file_path', nargs='?', help="default: the report's CSV path with _form added")
+    parser.add_argument('--window', type=int, default=FORM_WINDOW, help="games in each window")
+    parser.add_argument('--expanding', action='store_true', help="use every game so far instead of the last --window")
+    parser.add_argument('--dates', nargs=2, default=(None, None), metavar=('START', 'END'), help="inclusive date range (default: every game)")
+    parser.add_argument('--workers', type=int, help="reduce games on this many processes")
+    args = parser.parse_args()
+
+    module = load_report(args.script_path)
+    analysis = type(module.create_analysis())(*args.dates)
+    rows = rolling_form(load_event_store(args.file_path), analysis, None if args.expanding else args.window, args.workers)
+    output_file_path = args.output_file_path or os.path.splitext(module.output_file_path)[0] + '_form.csv'
+    save_rolling_form(rows, output_file_path)
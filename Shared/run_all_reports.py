@@ -0,0 +1,74 @@
+import argparse
+import importlib
+import os
+import sys
+
+from bootstrap import BOOTSTRAP_REPLICATES, run_with_intervals
+from engine import run_analyses
+from event_store import cache_path, load_event_store
+from totals import run_incremental
+
+# Repository root, one level above Shared
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Report scripts and the function each one uses to write its results
+REPORTS = [
+    ('PlayerValueScore/PlayerValueScore_new.py', 'save_top_players_to_csv'),
+    ('Postgame/PostGameReport_TopPlayers.py', 'save_players_to_csv'),
+    ('Postgame/PostgameAnalysis_new.py', 'save_prescout_metrics_to_csv'),
+    ('Powerplay/PowerplayAnalysis_new.py', 'save_top_teams_to_csv'),
+    ('Powerplay/PowerPlay_Top10.py', 'save_powerplay_players_to_csv'),
+    ('Prescout/PrescoutAnalysis_new.py', 'save_top_teams_to_csv'),
+    ('Entry Defense Analysis/EntryDefenseAnalysis(a).py', 'save_top_players_to_csv'),
+    ('Entry Defense Analysis/EntryDefenseAnalysis(b-c).py', 'save_tradeoff_scores_to_csv'),
+]
+
+# The report folders are not valid package names, so each script is imported by file name
+# from its own folder. Done at import time so process pool workers can find them too.
+for script_path, _ in REPORTS:
+    report_dir = os.path.join(repo_path, os.path.dirname(script_path))
+    if report_dir not in sys.path:
+        sys.path.append(report_dir)
+
+def load_report(script_path):
+    """Import a report script by its path relative to the repository root."""
+    return importlib.import_module(os.path.splitext(os.path.basename(script_path))[0])
+
+def run_all_reports(file_path, output_dir=None, workers=None, incremental=False, replicates=BOOTSTRAP_REPLICATES):
+    """Compute every report in a single pass over the event store and save each one.
+
+    Each report is written to its script's output_file_path, or into output_dir when given.
+    With workers, games are reduced on that many processes. With incremental, each report's
+    totals are kept next to the CSV and only games added since the last run are read.
+    Otherwise each CSV gains bootstrap CI columns from replicates game resamples (none for 0);
+    incremental totals no longer hold the per-game records the resamples are drawn from.
+    """
+    modules = [load_report(script_path) for script_path, _ in REPORTS]
+    store = load_event_store(file_path)
+    analyses = [module.create_analysis() for module in modules]
+    intervals = [None] * len(analyses)
+    if incremental:
+        totals_path = cache_path(file_path, '.totals')
+        totals_dirs = [os.path.join(totals_path, module.__name__) for module in modules]
+        results = run_incremental(store, analyses, totals_dirs, workers)
+    elif replicates:
+        results, intervals = run_with_intervals(store, analyses, workers, replicates)
+    else:
+        results = run_analyses(store, analyses, workers)
+
+    for module, (_, save_function), result, report_intervals in zip(modules, REPORTS, results, intervals):
+        output_file_path = module.output_file_path
+        if output_dir is not None:
+            output_file_path = os.path.join(output_dir, os.path.basename(output_file_path))
+        getattr(module, save_function)(result, output_file_path, intervals=report_intervals)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute and save every report in one pass over the event log.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('output_dir', nargs='?', help="write the CSVs here instead of each script's output path")
+    parser.add_argument('--workers', type=int, help="reduce games on this many processes")
+    parser.add_argument('--incremental', action='store_true', help="reuse saved totals and only read newly appended games")
+    parser.add_argument('--replicates', type=int, default=BOOTSTRAP_REPLICATES,
+                        help="game resamples behind the CI columns; 0 leaves them out (as does --incremental)")
+    args = parser.parse_args()
+    run_all_reports(args.file_path, args.output_dir, args.workers, args.incremental, args.replicates)
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def compile_weights(weights, names, situations=None):
+    """One weight vector for the weights dict entries in names, in order.
+
+    An entry weighted per situation gives one weight per situation, in the order of
+    situations, to line up with a (codes x situations) column of feature_matrix().
+    """
+    vector = []
+    for name in names:
+        weight = weights[name]
+        vector.extend([weight[situation] for situation in situations] if isinstance(weight, dict) else [weight])
+    return np.array(vector)
+
+
+def feature_matrix(columns, n_codes):
+    """Stack per-code columns (1D, or 2D codes x situations) into one (codes x features) matrix."""
+    parts = [np.zeros((n_codes, 0), dtype=np.int64)]
+    for column in columns:
+        column = np.asarray(column)
+        parts.append(column if column.ndim == 2 else column[:, None])
+    return np.hstack(parts)
+
+
+class ScoreFeatures:
+    """The per-code counts and rates a report's total_score is weighted from.
+
+    counts and rates map weights dict entries to per-code columns (2D for entries weighted per
+    situation). total_score is count_matrix @ count_weights, plus rate_matrix @ rate_weights
+    for the codes in has_rates, so scoring a new weights dict never reads the events again.
+    Codes without a rate keep the type of the count weights, so integer weights still give
+    the integer scores the reports print.
+    """
+
+    def __init__(self, names, counts, rates, has_rates, situations=None):
+        self.names = names
+        self.situations = situations
+        self.count_names = list(counts)
+        self.count_matrix = feature_matrix(counts.values(), len(names))
+        self.rate_names = list(rates)
+        self.rate_matrix = feature_matrix(rates.values(), len(names))
+        self.has_rates = np.asarray(has_rates, dtype=bool).reshape(len(names))
+
+    def weight_vectors(self, weights):
+        """(count weights, rate weights) vectors for a weights dict."""
+        return (compile_weights(weights, self.count_names, self.situations),
+                compile_weights(weights, self.rate_names, self.situations))
+
+    def scores(self, weights):
+        """Total score of every code for a weights dict, in the order of names."""
+        count_weights, rate_weights = self.weight_vectors(weights)
+        count_scores = (self.count_matrix @ count_weights).tolist()
+        rate_scores = (self.rate_matrix @ rate_weights).tolist()
+        return [count + rate if has_rate else count
+                for count, rate, has_rate in zip(count_scores, rate_scores, self.has_rates.tolist())]
+
+
+def weighted_sum(columns, weights, situations=None):
+    """Sum of columns, each weighted by the weights dict entry it is keyed by.
+
+    Columns may carry leading axes, such as bootstrap replicates; a column for an entry
+    weighted per situation has the situations as its last axis.
+    """
+    total = 0
+    for name, column in columns.items():
+        vector = compile_weights(weights, [name], situations)
+        total = total + (column @ vector if isinstance(weights[name], dict) else column * vector[0])
+    return total
@@ -0,0 +1,42 @@
+import numpy as np
+
+# Expected goal multiplier for the shooting team's situation, indexed by the situation column's codes
+# (even strength, powerplay, shorthanded)
+SITUATION_MULTIPLIERS = np.array([1.0, 1.2, 0.8])
+
+
+def mirror_coordinates(x_coord, y_coord):
+    """Flip shots taken at the x > 100 end so every shot is measured against the same net."""
+    mirrored = x_coord > 100
+    return np.where(mirrored, 200 - x_coord, x_coord), np.where(mirrored, 85 - y_coord, y_coord)
+
+
+def in_danger_zone(x_coord, y_coord):
+    """Whether each shot is in the slot in front of either net (x 11-19.8 or 180.2-188.8, y 20.5-64.4)."""
+    return (((11 <= x_coord) & (x_coord <= 19.8)) | ((180.2 <= x_coord) & (x_coord <= 188.8))) & \
+           (20.5 <= y_coord) & (y_coord <= 64.4)
+
+
+def calculate_expected_goals(x_coord, y_coord, situation=None):
+    """Expected goals and danger zone flags for arrays of shot coordinates.
+
+    xG starts at 0.09 and decays by 0.985 per 10 feet of distance and per degree of angle
+    from the net at (0, 42.5), doubled in the danger zone. When situation codes are given
+    the situation multipliers are applied as well.
+    """
+    x_coord, y_coord = mirror_coordinates(np.asarray(x_coord, dtype=float), np.asarray(y_coord, dtype=float))
+
+    distance = np.sqrt((x_coord - 0)**2 + (y_coord - 42.5)**2)
+    angle = np.abs(np.arctan2(y_coord - 42.5, x_coord))
+
+    xg = np.full(x_coord.shape, 0.09)
+    xg *= 0.985 ** (distance/10)
+    xg *= 0.985 ** np.degrees(angle)
+
+    is_danger_zone = in_danger_zone(x_coord, y_coord)
+    xg[is_danger_zone] *= 2.0
+
+    if situation is not None:
+        xg *= SITUATION_MULTIPLIERS[situation]
+
+    return xg, is_danger_zone
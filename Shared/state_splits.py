@@ -0,0 +1,87 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from engine import MetricTensor, run_analyses
+from event_store import LEADING, N_PERIODS, TIED, TRAILING, load_event_store
+from rolling_form import SITUATION_NAMES
+from run_all_reports import load_report
+
+# Names of the score states and period indices, as queries and the CSV use them
+SCORE_STATE_NAMES = {
+    TRAILING: 'trailing',
+    TIED: 'tied',
+    LEADING: 'leading',
+}
+PERIOD_NAMES = ['1', '2', '3', 'OT']
+
+
+def state_split_rows(analysis, score_states=None, periods=None):
+    """Long-format counts of a finished analysis's MetricTensor, split by score state and period.
+
+    One row per code and situation for every score state and period, or, for whichever of
+    score_states and periods is given, one row summing the ones selected. Everything is read
+    from the accumulators the analysis already filled, so no events are read again. Rows
+    with nothing counted are left out.
+    """
+    tensor = next(getattr(analysis, name) for name in analysis.accumulators
+                  if isinstance(getattr(analysis, name), MetricTensor))
+    score_state_groups = [[state] for state in SCORE_STATE_NAMES] if score_states is None else [score_states]
+    period_groups = [[period] for period in range(N_PERIODS)] if periods is None else [periods]
+    codes = np.array(analysis.order, dtype=np.int64)
+    names = analysis.store.names(analysis.code_column)[codes].tolist()
+    n_situations = tensor.values.shape[2]
+
+    rows = []
+    for score_state_group in score_state_groups:
+        for period_group in period_groups:
+            # (codes x metrics x situations) counts for this combination
+            counts = np.stack([tensor.slice(metric, score_state_group, period_group)[codes]
+                               for metric in tensor.metrics], axis=1)
+            for code, name in enumerate(names):
+                for situation in range(n_situations):
+                    if not counts[code, :, situation].any():
+                        continue
+                    row = {analysis.code_column: name}
+                    if n_situations > 1:
+                        row['Category'] = SITUATION_NAMES[situation]
+                    row['Score State'] = '/'.join(SCORE_STATE_NAMES[state] for state in score_state_group)
+                    row['Period'] = '/'.join(PERIOD_NAMES[period] for period in period_group)
+                    row.update(zip(tensor.metrics, counts[code, :, situation].tolist()))
+                    rows.append(row)
+    return rows
+
+
+def save_state_splits(rows, output_file_path):
+    with open(output_file_path, 'w', newline='') as file:
+        if rows:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    print(f"State splits saved to {output_file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a report's counts split by score state and period, from one pass over the games.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('script_path', help="report script relative to the repository root, e.g. Prescout/PrescoutAnalysis_new.py")
+    parser.add_argument('output_file_path', nargs='?', help="default: the report's CSV path with _states added")
+    parser.add_argument('--score-states', nargs='*', choices=list(SCORE_STATE_NAMES.values()),
+                        help="sum these score states into one row (default: a row for each)")
+    parser.add_argument('--periods', nargs='*', choices=PERIOD_NAMES, help="sum these periods into one row (default: a row for each)")
+    parser.add_argument('--dates', nargs=2, default=(None, None), metavar=('START', 'END'), help="inclusive date range (default: every game)")
+    args = parser.parse_args()
+
+    module = load_report(args.script_path)
+    analysis = type(module.create_analysis())(*args.dates)
+    run_analyses(load_event_store(args.file_path), [analysis])
+    if not any(isinstance(getattr(analysis, name), MetricTensor) for name in analysis.accumulators):
+        parser.error(f"{args.script_path} does not count its events in a MetricTensor")
+
+    state_codes = {name: state for state, name in SCORE_STATE_NAMES.items()}
+    score_states = None if args.score_states is None else [state_codes[name] for name in args.score_states]
+    periods = None if args.periods is None else [PERIOD_NAMES.index(name) for name in args.periods]
+    output_file_path = args.output_file_path or os.path.splitext(module.output_file_path)[0] + '_states.csv'
+    save_state_splits(state_split_rows(analysis, score_states, periods), output_file_path)
@@ -0,0 +1,167 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from event_store import PERIOD_SECONDS, is_powerplay, load_event_store
+
+# Periods after this are overtime, which ends at its last event rather than on the clock
+REGULATION_PERIODS = 3
+
+
+class StrengthIntervals:
+    """Compact table of the strength states every game went through, in game and time order.
+
+    Interval i covers elapsed seconds start[i] up to end[i] of game game[i] (an index into
+    game_ids), with home_skaters[i] and away_skaters[i] on the ice. A game's intervals follow
+    each other without gaps, so the state at any moment is found by binary search (locate()).
+    """
+
+    def __init__(self, game_ids, game, start, end, home_team, away_team, home_skaters, away_skaters):
+        self.game_ids = game_ids
+        self.game = game
+        self.start = start
+        self.end = end
+        self.home_team = home_team
+        self.away_team = away_team
+        self.home_skaters = home_skaters
+        self.away_skaters = away_skaters
+        # One sorted key per interval start; games are further apart than any game lasts
+        self._span = int(end.max()) + 1 if len(end) else 1
+        self._keys = game.astype(np.int64) * self._span + start
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def duration(self):
+        """Length of every interval in seconds."""
+        return self.end - self.start
+
+    @property
+    def advantage_team(self):
+        """Team code of the side with more skaters, 0 when the numbers are even."""
+        return np.where(self.home_skaters > self.away_skaters, self.home_team,
+                        np.where(self.away_skaters > self.home_skaters, self.away_team, 0))
+
+    @property
+    def powerplay_team(self):
+        """Team code of the side on the powerplay (see derive_situation), 0 when neither is."""
+        return np.where(is_powerplay(self.home_skaters, self.away_skaters), self.home_team,
+                        np.where(is_powerplay(self.away_skaters, self.home_skaters), self.away_team, 0))
+
+    def strengths(self):
+        """Each interval's state as 'AvB', the side with more skaters first (e.g. '5v4', '4v4')."""
+        more = np.maximum(self.home_skaters, self.away_skaters).tolist()
+        fewer = np.minimum(self.home_skaters, self.away_skaters).tolist()
+        return [f"{a}v{b}" for a, b in zip(more, fewer)]
+
+    def locate(self, game, elapsed):
+        """Index of the interval each (game index, elapsed seconds) moment falls in.
+
+        game and elapsed may be arrays; a moment on a boundary belongs to the interval that
+        starts there. Each lookup is one binary search over the interval starts.
+        """
+        keys = np.asarray(game, dtype=np.int64) * self._span + np.asarray(elapsed, dtype=np.int64)
+        return np.searchsorted(self._keys, keys, side='right') - 1
+
+    def powerplay_opportunities(self, n_teams):
+        """Powerplays each team code had, as runs of back-to-back powerplay intervals.
+
+        A 5v4 that becomes a 5v3 and then a 5v4 again is one opportunity; a powerplay that
+        carries over a period break is one as well, since the intervals join up.
+        """
+        team = self.powerplay_team
+        follows_on = np.zeros(len(team), dtype=bool)
+        follows_on[1:] = (team[1:] == team[:-1]) & (self.game[1:] == self.game[:-1])
+        return np.bincount(team[(team > 0) & ~follows_on], minlength=n_teams)
+
+    def powerplay_seconds(self, n_teams):
+        """Seconds each team code spent on the powerplay."""
+        team = self.powerplay_team
+        powerplay = team > 0
+        return np.bincount(team[powerplay], weights=self.duration[powerplay], minlength=n_teams).astype(np.int64)
+
+
+def segment_strength(store):
+    """Split every game in store into StrengthIntervals, in one vectorised pass over the skater columns.
+
+    An interval starts at the first event showing new skater numbers, or at the start of the
+    period when that is the period's first event. A game runs from 0 to the end of its last
+    period, or to its last event when that period is overtime. Intervals of no length, such as
+    simultaneous events disagreeing around a delayed penalty, are dropped and their neighbours
+    joined.
+    """
+    slices = store.game_slices()
+    game_ids, _, game = store.game_index()
+    period = np.asarray(store['Period'], dtype=np.int64)
+    elapsed = np.asarray(store['elapsed_seconds'], dtype=np.int64)
+    home = np.asarray(store['Home Team Skaters'])
+    away = np.asarray(store['Away Team Skaters'])
+
+    # Step 1: Open an interval at every change of skaters, and at each game's first event
+    new_game = np.ones(len(game), dtype=bool)
+    new_game[1:] = game[1:] != game[:-1]
+    changed = new_game.copy()
+    changed[1:] |= (home[1:] != home[:-1]) | (away[1:] != away[:-1])
+    new_period = new_game.copy()
+    new_period[1:] |= period[1:] != period[:-1]
+    rows = np.flatnonzero(changed)
+    start = np.where(new_period[rows], (period[rows] - 1) * PERIOD_SECONDS, elapsed[rows])
+
+    # Step 2: Each interval ends where the game's next one starts, the last one where the game ends
+    last_rows = np.array([rows.stop - 1 for _, rows in slices], dtype=np.int64)
+    last_period = period[last_rows]
+    game_end = np.where(last_period > REGULATION_PERIODS, elapsed[last_rows], last_period * PERIOD_SECONDS)
+    last = np.ones(len(rows), dtype=bool)
+    last[:-1] = game[rows][1:] != game[rows][:-1]
+    end = np.empty_like(start)
+    end[:-1] = start[1:]
+    end[last] = game_end[game[rows][last]]
+
+    # Step 3: Drop intervals of no length and join the neighbours they separated
+    keep = end > start
+    rows, start, end = rows[keep], start[keep], end[keep]
+    joined = np.zeros(len(rows), dtype=bool)
+    joined[1:] = ((game[rows][1:] == game[rows][:-1]) & (home[rows][1:] == home[rows][:-1]) &
+                  (away[rows][1:] == away[rows][:-1]))
+    first = np.flatnonzero(~joined)
+    final = np.append(first[1:], len(rows)) - 1
+    rows = rows[first]
+
+    return StrengthIntervals(game_ids, game[rows], start[first], end[final],
+                             np.asarray(store['Home Team'])[rows], np.asarray(store['Away Team'])[rows],
+                             home[rows], away[rows])
+
+
+def event_intervals(store, intervals):
+    """Index into intervals of the strength state each event of store was played in."""
+    _, _, game = store.game_index()
+    return intervals.locate(game, store['elapsed_seconds'])
+
+
+def save_strength_intervals(store, intervals, output_file_path):
+    """Write the interval table, one row per strength state, with team names and seconds elapsed."""
+    teams = store.names('Team')
+    with open(output_file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Game', 'Start', 'End', 'Seconds', 'Strength', 'Team', 'Powerplay'])
+        rows = zip(intervals.game.tolist(), intervals.start.tolist(), intervals.end.tolist(),
+                   intervals.duration.tolist(), intervals.strengths(), teams[intervals.advantage_team].tolist(),
+                   (intervals.powerplay_team > 0).tolist())
+        for game, start, end, seconds, strength, team, powerplay in rows:
+            writer.writerow([intervals.game_ids[game], start, end, seconds, strength, team, int(powerplay)])
+    print(f"Strength intervals saved to {output_file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split every game into strength-state intervals (5v5, 5v4, 4v4, ...).")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('output_file_path', nargs='?', help="default: the event log's path with _strength added")
+    parser.add_argument('--dates', nargs=2, default=(None, None), metavar=('START', 'END'), help="inclusive date range (default: every game)")
+    args = parser.parse_args()
+
+    store = load_event_store(args.file_path).between(*args.dates)
+    output_file_path = args.output_file_path or os.path.splitext(args.file_path)[0] + '_strength.csv'
+    save_strength_intervals(store, segment_strength(store), output_file_path)
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from heatmap import RINK_LENGTH, RINK_WIDTH, shot_density, smoothed_counts
+
+
+@pytest.mark.parametrize('y', [0, 0.5, 2, 5, RINK_WIDTH / 2, RINK_WIDTH - 2, RINK_WIDTH - 0.5])
+@pytest.mark.parametrize('x', [0, 3, RINK_LENGTH / 2, RINK_LENGTH - 0.5])
+def test_every_shot_keeps_its_weight(x, y):
+    shots = 3
+    counts = smoothed_counts(np.full(shots, x), np.full(shots, y))
+    assert counts.sum() == pytest.approx(shots)
+
+
+def test_board_and_open_ice_shots_weigh_the_same():
+    # One shot on the boards and one in open ice, far enough apart that their Gaussians do not meet
+    density = shot_density(np.array([50.0, 150.0]), np.array([0.0, RINK_WIDTH / 2]))
+    assert density.sum() == pytest.approx(1)
+    assert density[:RINK_LENGTH // 2].sum() == pytest.approx(0.5)
+    assert density[RINK_LENGTH // 2:].sum() == pytest.approx(0.5)
@@ -0,0 +1,148 @@
+import copy
+import glob
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from engine import reduce_in_pool
+
+# Shared modules every analysis depends on; editing any of them invalidates saved totals
+shared_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def analysis_signature(analysis):
+    """Identify an analysis by class, date range and the source it was computed with.
+
+    Weights live in the report scripts, so changing a weight (or any code) changes the
+    signature and the saved totals are recomputed rather than reused.
+    """
+    sources = [sys.modules[type(analysis).__module__].__file__] + sorted(glob.glob(os.path.join(shared_path, '*.py')))
+    digest = hashlib.sha1()
+    for source in sources:
+        with open(source, 'rb') as file:
+            digest.update(file.read())
+    return [type(analysis).__name__, analysis.start_date, analysis.end_date, digest.hexdigest()]
+
+
+def save_totals(totals_dir, analysis, record, games):
+    """Persist an analysis's partial() record covering games, a list of [game_id, n_rows].
+
+    Codes are saved as names, so the totals survive the store's vocabularies growing.
+    """
+    os.makedirs(totals_dir, exist_ok=True)
+    meta_path = os.path.join(totals_dir, 'totals.json')
+    # Removed before any array is overwritten and written back last, so an interrupted save
+    # leaves no totals rather than old totals.json next to new arrays
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    store = analysis.store
+    extras = {}
+    for name, value in record.items():
+        if name in analysis.accumulators:
+            np.save(os.path.join(totals_dir, name + '.npy'), value)
+        elif name not in ('order', 'codes') and name not in analysis.first_seen:
+            extras[name] = value
+    with open(meta_path + '.tmp', 'w') as file:
+        json.dump({
+            'signature': analysis_signature(analysis),
+            'games': games,
+            'order': store.names(analysis.code_column)[record['order']].tolist(),
+            'codes': store.names(analysis.code_column)[record['codes']].tolist(),
+            'first_seen': {
+                name: store.names(column)[record[name]].tolist()
+                for name, column in analysis.first_seen.items()
+            },
+            'extras': extras,
+        }, file)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def encode_names(store, column, names):
+    """Codes of names in a categorical column, or None if any of them is not in the store."""
+    vocabulary = store.names(column)
+    codes = np.searchsorted(vocabulary, np.array(names, dtype=str))
+    if len(names) and (codes.max() >= len(vocabulary) or (vocabulary[codes] != names).any()):
+        return None
+    return codes.astype(np.int64)
+
+
+def load_totals(totals_dir, analysis, store):
+    """The record and games saved by save_totals(), re-encoded against store.
+
+    Returns None when nothing was saved, the analysis changed or a name is unknown.
+    """
+    meta_path = os.path.join(totals_dir, 'totals.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as file:
+        meta = json.load(file)
+    if meta['signature'] != analysis_signature(analysis):
+        return None
+
+    order = encode_names(store, analysis.code_column, meta['order'])
+    codes = encode_names(store, analysis.code_column, meta['codes'])
+    if order is None or codes is None:
+        return None
+    # Codes are still sorted when the vocabulary grew, but merge() relies on it, so make sure
+    rows = np.argsort(codes, kind='stable')
+    record = {'order': order, 'codes': codes[rows]}
+    for name in analysis.accumulators:
+        record[name] = np.load(os.path.join(totals_dir, name + '.npy'))[rows]
+    for name, column in analysis.first_seen.items():
+        values = encode_names(store, column, meta['first_seen'][name])
+        if values is None:
+            return None
+        record[name] = values.astype(np.int32)[rows]
+    record.update(meta['extras'])
+    return record, meta['games']
+
+
+def run_incremental(store, analyses, totals_dirs, workers=None):
+    """Like run_analyses(), but start each analysis from the totals saved in its totals_dir.
+
+    Saved totals are reused when the games they cover are still the first games the analysis
+    covers, unchanged in size; only the games after them are read. Otherwise the analysis is
+    recomputed from scratch. Rates are always derived from the merged totals in finalize(),
+    and the new totals are saved for the next run.
+    """
+    dates = store['game_date']
+    games = store.game_slices()
+    # Reduction runs on unbound copies, as in run_analyses()
+    reducers = [copy.deepcopy(analysis) for analysis in analyses]
+
+    covered = []
+    pending = []
+    for analysis, totals_dir in zip(analyses, totals_dirs):
+        analysis.bind(store)
+        games_covered = [[game_id, rows.stop - rows.start] for game_id, rows in games if analysis.covers(dates[rows.start])]
+        start = 0
+        saved = load_totals(totals_dir, analysis, store)
+        if saved is not None:
+            record, saved_games = saved
+            if saved_games == games_covered[:len(saved_games)]:
+                analysis.merge(record)
+                start = len(saved_games)
+        covered.append(games_covered)
+        pending.append({game_id for game_id, _ in games_covered[start:]})
+
+    new_games = set().union(*pending)
+    new_rows = [np.arange(rows.start, rows.stop) for game_id, rows in games if game_id in new_games]
+    if new_rows:
+        new_store = store.take(np.concatenate(new_rows))
+        new_ids = [game_id for game_id, _ in new_store.game_slices()]
+        for game_id, records in zip(new_ids, reduce_in_pool(new_store, reducers, workers)):
+            for analysis, game_ids, record in zip(analyses, pending, records):
+                if record is not None and game_id in game_ids:
+                    analysis.merge(record)
+
+    results = []
+    for analysis, totals_dir, games_covered in zip(analyses, totals_dirs, covered):
+        # partial() hands back the merged totals and resets; merging them again restores the state
+        record = analysis.partial()
+        save_totals(totals_dir, analysis, record, games_covered)
+        analysis.merge(record)
+        results.append(analysis.finalize())
+    return results
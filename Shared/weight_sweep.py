@@ -0,0 +1,138 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+
+import numpy as np
+
+from engine import run_analyses
+from event_store import load_event_store
+from run_all_reports import load_report
+from scoring import compile_weights
+
+# Weight vectors scored per matrix multiply; fixed, so results do not depend on the number of workers
+CHUNK_SIZE = 1000
+
+
+def weight_ranges(weights, spread=0.5):
+    """A (low, high) range for every weight, spread times its size either side of it.
+
+    Has the same shape as weights, so entries weighted per situation get a range per
+    situation. Edit the result to fix or widen individual weights before sweeping.
+    """
+    ranges = {}
+    for name, weight in weights.items():
+        if isinstance(weight, dict):
+            ranges[name] = weight_ranges(weight, spread)
+        else:
+            ranges[name] = (weight - abs(weight) * spread, weight + abs(weight) * spread)
+    return ranges
+
+
+def rank_histogram(count_matrix, rate_matrix, count_ranges, rate_ranges, n_samples, seed):
+    """Score n_samples uniformly drawn weight vectors and count how often each code lands at each rank.
+
+    Returns a (codes x ranks) array; rank 0 is the top score.
+    """
+    rng = np.random.default_rng(seed)
+    count_weights = rng.uniform(count_ranges[:, 0], count_ranges[:, 1], (n_samples, len(count_ranges)))
+    rate_weights = rng.uniform(rate_ranges[:, 0], rate_ranges[:, 1], (n_samples, len(rate_ranges)))
+    # One (codes x samples) product per block; codes without a rate have all-zero rate rows
+    scores = count_matrix @ count_weights.T + rate_matrix @ rate_weights.T
+
+    n_codes = len(scores)
+    order = np.argsort(-scores, axis=0, kind='stable')
+    ranks = np.empty_like(order)
+    ranks[order, np.arange(n_samples)] = np.arange(n_codes)[:, None]
+    codes = np.repeat(np.arange(n_codes), n_samples)
+    return np.bincount(codes * n_codes + ranks.ravel(), minlength=n_codes * n_codes).reshape(n_codes, n_codes)
+
+
+def sweep_weights(features, ranges, n_samples, seed=0, workers=None):
+    """Rank histogram of every code in features over n_samples weight vectors drawn from ranges.
+
+    features is an analysis's ScoreFeatures after finalize(); ranges is shaped like the report's
+    weights dict with (low, high) leaves (see weight_ranges()). Chunks of CHUNK_SIZE vectors are
+    scored on workers processes when workers > 1.
+    """
+    count_ranges = compile_weights(ranges, features.count_names, features.situations).reshape(-1, 2)
+    rate_ranges = compile_weights(ranges, features.rate_names, features.situations).reshape(-1, 2)
+    count_matrix = features.count_matrix.astype(float)
+    rate_matrix = features.rate_matrix.astype(float)
+
+    sizes = [min(CHUNK_SIZE, n_samples - start) for start in range(0, n_samples, CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    n = len(sizes)
+    arguments = ([count_matrix] * n, [rate_matrix] * n, [count_ranges] * n, [rate_ranges] * n, sizes, seeds)
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            histograms = list(pool.map(rank_histogram, *arguments))
+    else:
+        histograms = list(map(rank_histogram, *arguments))
+    n_codes = len(features.names)
+    return sum(histograms, np.zeros((n_codes, n_codes), dtype=np.int64))
+
+
+def rank_summary(features, histogram, base_scores, top_n=10):
+    """Per-code rows of base rank, mean and median rank, 5th-95th percentile ranks and top_n share.
+
+    Ranks are 1-based and the rows are ordered by base rank.
+    """
+    n_samples = histogram[0].sum()
+    positions = np.arange(1, histogram.shape[1] + 1)
+    # Rank at which each code's cumulative share reaches 5%, 50% and 95%
+    cumulative = histogram.cumsum(axis=1)
+    p5, median, p95 = (
+        positions[[np.searchsorted(row, q * n_samples) for row in cumulative]] for q in (0.05, 0.5, 0.95)
+    )
+    mean = histogram @ positions / n_samples
+    top_share = histogram[:, :top_n].sum(axis=1) / n_samples
+    base_order = sorted(range(len(base_scores)), key=lambda code: base_scores[code], reverse=True)
+
+    return [
+        {
+            'name': features.names[code],
+            'base_rank': base_rank,
+            'mean_rank': mean[code].item(),
+            'median_rank': median[code].item(),
+            'rank_p5': p5[code].item(),
+            'rank_p95': p95[code].item(),
+            'top_n_share': top_share[code].item(),
+        }
+        for base_rank, code in enumerate(base_order, start=1)
+    ]
+
+
+def save_rank_summary(summary, output_file_path, top_n=10):
+    with open(output_file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Name', 'Base Rank', 'Mean Rank', 'Median Rank', '5th Percentile Rank',
+                         '95th Percentile Rank', f"Top {top_n} Share"])
+        for row in summary:
+            name = row['name'] if isinstance(row['name'], str) else ' - '.join(row['name'])
+            writer.writerow([name, row['base_rank'], f"{row['mean_rank']:.2f}", row['median_rank'],
+                             row['rank_p5'], row['rank_p95'], f"{row['top_n_share']:.3f}"])
+    print(f"Weight sensitivity saved to {output_file_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep a report's weights and summarise how stable its ranking is.")
+    parser.add_argument('file_path', help="olympic_womens_dataset.csv")
+    parser.add_argument('script_path', help="report script relative to the repository root, e.g. PlayerValueScore/PlayerValueScore_new.py")
+    parser.add_argument('output_file_path', nargs='?', help="default: the report's CSV path with _sensitivity added")
+    parser.add_argument('--samples', type=int, default=100000, help="number of weight vectors")
+    parser.add_argument('--spread', type=float, default=0.5, help="each weight varies uniformly by this share of its size")
+    parser.add_argument('--top-n', type=int, default=10, help="report the share of runs spent in the top N")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help="score chunks on this many processes")
+    args = parser.parse_args()
+
+    module = load_report(args.script_path)
+    analysis = module.create_analysis()
+    run_analyses(load_event_store(args.file_path), [analysis])
+    features = analysis.features
+
+    histogram = sweep_weights(features, weight_ranges(module.weights, args.spread), args.samples, args.seed, args.workers)
+    summary = rank_summary(features, histogram, features.scores(module.weights), args.top_n)
+    output_file_path = args.output_file_path or os.path.splitext(module.output_file_path)[0] + '_sensitivity.csv'
+    save_rank_summary(summary, output_file_path, args.top_n)